@@ -1,4 +1,5 @@
 import logging
+from itertools import chain
 
 from django.http import HttpResponse
 
@@ -11,6 +12,23 @@ log = logging.getLogger('ella.api.serialization')
 FULL = object()
 PARTIAL = object()
 
+# types containers of which can skip serialization of their items
+PRIMITIVE_TYPES = (str, unicode, int, long, float, bool, type(None))
+
+
+class StreamingResponse(HttpResponse):
+    """
+    Response sending its content chunk by chunk as the serializer produces
+    it. Middleware reading ``content`` gets it joined, the chunks are only
+    consumed once.
+    """
+    def _get_content(self):
+        if self._base_content_is_iter:
+            self._set_content(super(StreamingResponse, self)._get_content())
+        return super(StreamingResponse, self)._get_content()
+
+    content = property(_get_content, HttpResponse._set_content)
+
 
 class ResponseSerializer(object):
     def __init__(self):
@@ -23,37 +41,82 @@ class ResponseSerializer(object):
         return mimetype in self._registry
 
     def serialize(self, data, mimetype):
-        return HttpResponse(self._registry[mimetype](data), content_type=mimetype)
+        """
+        The first chunk is produced right away so that errors serializing it
+        still result in an error response instead of a truncated one.
+        """
+        content = self._registry[mimetype](data)
+        if not isinstance(content, basestring):
+            content = iter(content)
+            content = chain([next(content, '')], content)
+        return StreamingResponse(content, content_type=mimetype)
 
 
 class ObjectSerializer(object):
+    """
+    Serializers are looked up along the MRO of the object's class, the one
+    found is remembered per class and context until ``register`` is called
+    again.
+    """
     def __init__(self):
         self._registry = {}
 
+    def _get_registry(self):
+        return self.__registry
+
+    def _set_registry(self, registry):
+        self.__registry = registry
+        self._clear_cache()
+
+    # replacing the whole registry drops the cached lookups as well
+    _registry = property(_get_registry, _set_registry)
+
+    def _clear_cache(self):
+        # (class, context) -> serializer or None
+        self._serializers = {}
+        # classes serialized as they are
+        self._primitives = frozenset(t for t in PRIMITIVE_TYPES if not any(c in self._registry for c in t.mro()))
+
     def register(self, cls, serializer, context=PARTIAL):
         self._registry.setdefault(cls, {})[context] = serializer
+        self._clear_cache()
+
+    def get_serializer(self, cls, context=PARTIAL):
+        " Serializer for instances of ``cls`` in ``context`` or ``None``. "
+        try:
+            return self._serializers[(cls, context)]
+        except KeyError:
+            pass
 
-    def serialize(self, request, data, context=PARTIAL):
         # collect relevant registries
-        rs = []
-        for c in data.__class__.mro():
-            if c in self._registry:
-                rs.append(self._registry[c])
-        if not rs:
-            return data
+        rs = [self._registry[c] for c in cls.mro() if c in self._registry]
 
+        serializer = None
         # registered context
         for r in rs:
             if context in r:
-                return r[context](request, data)
+                serializer = r[context]
+                break
+        else:
+            # fall back to PARTIAL context
+            if context is not PARTIAL:
+                for r in rs:
+                    if PARTIAL in r:
+                        serializer = r[PARTIAL]
+                        break
+
+        self._serializers[(cls, context)] = serializer
+        return serializer
+
+    def are_primitive(self, values):
+        " True when all ``values`` would be serialized as they are. "
+        return set(map(type, values)) <= self._primitives
 
-        # fall back to PARTIAL context
-        if context is not PARTIAL:
-            for r in rs:
-                if PARTIAL in r:
-                    return r[PARTIAL](request, data)
-
-        return data
+    def serialize(self, request, data, context=PARTIAL):
+        serializer = self.get_serializer(data.__class__, context)
+        if serializer is None:
+            return data
+        return serializer(request, data)
 
 response_serializer = ResponseSerializer()
 object_serializer = ObjectSerializer()
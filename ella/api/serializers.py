@@ -1,3 +1,6 @@
+import logging
+from types import GeneratorType
+
 from ella.api import object_serializer, response_serializer, FULL
 from ella.api.conf import api_settings
 from ella.core.models import Category, Publishable, Listing, Author, Source
@@ -9,23 +12,158 @@ from django.utils import simplejson
 from django.http import Http404
 from ella.utils.timezone import to_timestamp
 
+log = logging.getLogger('ella.api.serializers')
+
+# JSON responses are sent in chunks of about this size
+JSON_CHUNK_SIZE = 16 * 1024
+
+# closes a list whose item failed to serialize after the response was sent
+SERIALIZATION_ERROR = {'error': 'Serialization failed.'}
+
+
+def iter_json(data, on_error=None):
+    """
+    Encode ``data`` to JSON piece by piece. Dicts and generators are walked
+    so that lazily serialized sequences (see ``serialize_page``) are only
+    produced while the response is being sent, anything else is encoded by
+    ``simplejson.dumps`` at once.
+
+    When an item of a generator fails to serialize, ``on_error`` is called
+    from within the exception handler. Unless it raises, the list is closed
+    by ``SERIALIZATION_ERROR`` so that the output stays valid JSON.
+    """
+    if isinstance(data, dict):
+        yield '{'
+        sep = ''
+        for key, value in data.iteritems():
+            if not isinstance(key, basestring):
+                # same conversion simplejson does for keys
+                key = simplejson.dumps(key)
+            yield sep + simplejson.dumps(key) + ': '
+            for piece in iter_json(value, on_error):
+                yield piece
+            sep = ', '
+        yield '}'
+    elif isinstance(data, GeneratorType):
+        yield '['
+        sep = ''
+        while True:
+            try:
+                item = data.next()
+            except StopIteration:
+                break
+            except Exception:
+                if on_error is None:
+                    raise
+                on_error()
+                yield sep + simplejson.dumps(SERIALIZATION_ERROR)
+                break
+            yield sep
+            for piece in iter_json(item, on_error):
+                yield piece
+            sep = ', '
+        yield ']'
+    else:
+        yield simplejson.dumps(data)
+
+
+def serialize_json(data):
+    """
+    Generator of JSON encoded ``data`` in chunks of ``JSON_CHUNK_SIZE``.
+    Errors raised before the first chunk is produced propagate, later ones
+    are logged and end the failing list with ``SERIALIZATION_ERROR``.
+    """
+    state = {'sent': False}
+
+    def on_error():
+        if not state['sent']:
+            raise
+        log.exception('Failed to serialize an object of a response already being sent.')
+
+    chunk, size = [], 0
+    for piece in iter_json(data, on_error):
+        chunk.append(piece)
+        size += len(piece)
+        if size >= JSON_CHUNK_SIZE:
+            state['sent'] = True
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def get_requested_fields(request):
+    """
+    Names of the fields of publishables listed in the ``fields`` GET
+    parameter, ``None`` when all of them should be serialized.
+    """
+    if request is None:
+        return None
+    if not hasattr(request, '_api_fields'):
+        fields = request.GET.get('fields')
+        request._api_fields = frozenset(f.strip() for f in fields.split(',')) if fields else None
+    return request._api_fields
+
+
+def get_prefetched(request, name):
+    " Data of kind ``name`` loaded by ``prefetch_publishables``. "
+    return getattr(request, '_api_prefetched', {}).get(name, {})
+
+
+def prefetch_publishables(request, publishables):
+    """
+    Load authors and photos of all ``publishables`` at once so that
+    serializing them does not query the database or redis for each of them.
+    Only the data of the requested fields is loaded.
+    """
+    if request is None or not publishables:
+        return
+    fields = get_requested_fields(request)
+    if not hasattr(request, '_api_prefetched'):
+        request._api_prefetched = {'photos': {}}
+    prefetched = request._api_prefetched
+
+    photo_ids = set()
+    if fields is None or 'photo' in fields:
+        photo_ids.update(p.photo_id for p in publishables if p.photo_id)
+
+    if fields is None or 'authors' in fields:
+        Publishable.objects.prefetch_authors(publishables)
+        photo_ids.update(a.photo_id for p in publishables for a in p.get_authors() if a.photo_id)
+
+    if photo_ids:
+        photos = prefetched['photos']
+        for f in api_settings.PUBLISHABLE_PHOTO_FORMATS:
+            for photo_id, info in FormatedPhoto.objects.get_photos_in_format(photo_ids, f, False).iteritems():
+                photos[(photo_id, f)] = info
 
 
 def serialize_list(request, l):
+    if object_serializer.are_primitive(l):
+        return list(l)
     return [object_serializer.serialize(request, o) for o in l]
 
 
 def serialize_dict(request, d):
+    if object_serializer.are_primitive(d.itervalues()):
+        return dict(d)
     return dict((k, object_serializer.serialize(request, v)) for k, v in d.iteritems())
 
 
 def serialize_page(request, page):
+    """
+    Objects of the page are serialized lazily, by a generator, after their
+    authors and photos have been prefetched.
+    """
+    objects = list(page.object_list)
+    publishables = [o.publishable if isinstance(o, Listing) else o for o in objects]
+    prefetch_publishables(request, [p for p in publishables if isinstance(p, Publishable)])
     return {
         'total': page.paginator.count,
         'per_page': page.paginator.per_page,
         'num_pages': page.paginator.num_pages,
         'current_page': page.number,
-        'objects': serialize_list(request, page.object_list),
+        'objects': (object_serializer.serialize(request, o) for o in objects),
     }
 
 
@@ -58,7 +196,7 @@ def serialize_author(request, author):
     return {
         'name': author.name,
         'url': author.get_absolute_url(),
-        'photo': serialize_photo(request, author.photo, formats=api_settings.PUBLISHABLE_PHOTO_FORMATS) if author.photo_id else None,
+        'photo': serialize_photo(request, author.photo_id, formats=api_settings.PUBLISHABLE_PHOTO_FORMATS) if author.photo_id else None,
     }
 
 
@@ -74,28 +212,50 @@ def serialize_source(request, source):
 def serialize_photo(request, photo, formats=None):
     if formats is None:
         formats = api_settings.DEFAULT_PHOTO_FORMATS
-    return dict((f, FormatedPhoto.objects.get_photo_in_format(photo, f, False)) for f in formats)
+    photo_id = getattr(photo, 'pk', photo)
+    prefetched = get_prefetched(request, 'photos')
+    return dict(
+        (f, prefetched[(photo_id, f)] if (photo_id, f) in prefetched else FormatedPhoto.objects.get_photo_in_format(photo, f, False))
+        for f in formats
+    )
+
+
+def serialize_authors(request, publishable):
+    return [serialize_author(request, a) for a in publishable.get_authors()]
+
+
+# field name and the function serializing it for publishables
+PUBLISHABLE_FIELDS = (
+    ('id', lambda r, p: p.id),
+    ('url', lambda r, p: p.get_absolute_url()),
+    ('title', lambda r, p: p.title),
+    ('publish_from', lambda r, p: to_timestamp(p.publish_from) * 1000),
+    ('content_type', lambda r, p: p.content_type.name),
+    ('description', lambda r, p: p.description),
+    ('photo', lambda r, p: serialize_photo(r, p.photo_id, formats=api_settings.PUBLISHABLE_PHOTO_FORMATS) if p.photo_id else None),
+    ('authors', serialize_authors),
+    ('source', lambda r, p: serialize_source(r, p.source) if p.source_id else None),
+)
 
 
 def serialize_publishable(request, publishable):
-    return {
-        'id': publishable.id,
-        'url': publishable.get_absolute_url(),
-        'title': publishable.title,
-        'publish_from': to_timestamp(publishable.publish_from) * 1000,
-        'content_type': publishable.content_type.name,
-        'description': publishable.description,
-        'photo': serialize_photo(request, publishable.photo, formats=api_settings.PUBLISHABLE_PHOTO_FORMATS) if publishable.photo_id else None,
-        'authors': [serialize_author(request, a) for a in publishable.authors.all()],
-        'source': serialize_source(request, publishable.source) if publishable.source_id else None
-    }
+    """
+    Only the fields listed in the ``fields`` GET parameter are serialized
+    when it is given.
+    """
+    fields = get_requested_fields(request)
+    return dict(
+        (name, serializer(request, publishable))
+        for name, serializer in PUBLISHABLE_FIELDS
+        if fields is None or name in fields
+    )
 
 
 def serialize_listing(request, listing):
     return object_serializer.serialize(request, listing.publishable)
 
 
-response_serializer.register('application/json', simplejson.dumps)
+response_serializer.register('application/json', serialize_json)
 
 
 object_serializer.register(list, serialize_list)
@@ -1,13 +1,32 @@
-from django.template import loader
+import re
+from urllib import quote, unquote, urlencode
+
+from django.template import loader, NodeList, TextNode
 from django.utils.datastructures import MultiValueDict
 from django.utils.encoding import smart_str
 from django.db.models import Model
+from django.db.models.loading import get_model
 from django.core.cache import cache
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
 
-from ella.core.cache.utils import normalize_key, _get_key, KEY_PREFIX
+from ella.core.cache.utils import normalize_key, _get_key, KEY_PREFIX, add_dependency
 from ella.core.conf import core_settings
+from ella.core.esi import esi_include, get_signature
+
+
+DOUBLE_RENDER_MARKER = '<!--ella-box:%(ct)s:%(pk)s:%(box_type)s:%(params)s-->'
+DOUBLE_RENDER_MARKER_RE = re.compile(r'<!--ella-box:(\d+):([^:]+):([^:]*):([^:>]*)-->')
+
+
+def parse_double_render_marker(match):
+    """
+    Return content type id, pk, box type and nodelist with parameters from
+    ``DOUBLE_RENDER_MARKER_RE`` match.
+    """
+    ct_id, pk, box_type, params = match.groups()
+    return int(ct_id), unquote(pk), unquote(box_type).decode('utf-8'), NodeList([TextNode(unquote(params).decode('utf-8'))])
 
 
 class Box(object):
@@ -97,6 +116,12 @@ class Box(object):
     def render(self, context):
         self.prepare(context)
         " Cached wrapper around self._render(). "
+        if core_settings.ESI and self.is_model and 'ESI_RENDER' not in context \
+                and isinstance(self.obj, get_model('core', 'publishable')) \
+                and self.get_esi_timeout() is not None:
+            return self.esi_render()
+        if self.is_model:
+            add_dependency(self.obj)
         if getattr(settings, 'DOUBLE_RENDER', False) and self.can_double_render:
             if 'SECOND_RENDER' not in context:
                 return self.double_render()
@@ -110,14 +135,43 @@ class Box(object):
             rend = self._render(context)
         return rend
 
+    def get_params_text(self):
+        " Parameters in the format of the box's contents. "
+        return '\n'.join(('%s:%s' % item for item in self.params.items()))
+
     def double_render(self):
-        return '''{%% box %(box_type)s for %(name)s with pk %(pk)s %%}%(params)s{%% endbox %%}''' % {
-                'box_type' : self.box_type,
-                'name' : self.name,
-                'pk' : self.obj.pk,
-                'params' : '\n'.join(('%s:%s' % item for item in self.params.items())),
+        " Placeholder replaced by the box in ``DoubleRenderMiddleware``. "
+        return DOUBLE_RENDER_MARKER % {
+                'ct' : self.ct.pk,
+                'pk' : quote(smart_str(self.obj.pk), safe=''),
+                'box_type' : quote(smart_str(self.box_type), safe=''),
+                'params' : quote(smart_str(self.get_params_text()), safe=''),
         }
 
+    def get_esi_timeout(self):
+        """
+        Return number of seconds the box can be cached for when it should be
+        rendered as ESI fragment (``esi`` parameter is present), ``None``
+        otherwise.
+        """
+        if 'esi' not in self.params:
+            return None
+        try:
+            return int(self.params['esi'])
+        except ValueError:
+            return core_settings.ESI_TIMEOUT
+
+    def esi_render(self):
+        " Include of the ESI fragment rendered by ``ella.core.views.esi_box``. "
+        url = reverse('esi_box', kwargs={
+                'content_type_id': self.ct.pk,
+                'pk': self.obj.pk,
+                'box_type': self.box_type,
+        })
+        params = smart_str(self.get_params_text())
+        sig = get_signature(self.ct.pk, self.obj.pk, self.box_type, params)
+        return esi_include('%s?%s' % (url, urlencode({'params': params, 'sig': sig})))
+
     def _get_template_list(self):
         " Get the hierarchy of templates belonging to the object/box_type given. "
         t_list = []
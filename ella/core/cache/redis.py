@@ -127,6 +127,47 @@ def listing_post_save(sender, instance, **kwargs):
         pipe.execute()
 
 
+def category_pre_save(sender, instance, **kwargs):
+    if not instance.pk:
+        return
+
+    old = sender.objects.filter(pk=instance.pk).values_list('tree_parent', 'tree_path')
+    if not old or old[0][0] == instance.tree_parent_id:
+        return
+
+    # listings in the moved subtree stay in their categories' keys, only
+    # the keys of the old and new ancestors differ
+    category_ids = [instance.pk] + instance.get_descendant_ids(old[0][1])
+    Listing = get_model('core', 'listing')
+    listings = list(Listing.objects.filter(category__in=category_ids, publishable__published=True).select_related('publishable'))
+
+    # resolve the ancestors as they are in the DB, not as modified in memory
+    sender.objects.clear_cache()
+    pipe = client.pipeline()
+    for l in listings:
+        ListingHandlerClass().remove_publishable(l.category, l.publishable, pipe=pipe, commit=False)
+    instance.__moved_listings = listings, pipe
+
+
+def category_post_save(sender, instance, **kwargs):
+    moved = getattr(instance, '__moved_listings', None)
+    if moved is None:
+        return
+    del instance.__moved_listings
+
+    listings, pipe = moved
+    sender.objects.clear_cache()
+    for l in listings:
+        ListingHandlerClass().add_publishable(
+            sender.objects.get_for_id(l.category_id),
+            l.publishable,
+            publish_from=l.publish_from,
+            pipe=pipe,
+            commit=False
+        )
+    pipe.execute()
+
+
 def update_authors(sender, action, instance, reverse, model, pk_set, **kwargs):
     if action == 'pre_remove':
         instance.__pipe = AuthorListingHandler.remove_publishable(instance, commit=False)
@@ -261,7 +302,7 @@ class RedisListingHandler(ListingHandler):
         publishables = get_cached_objects(ids, missing=SKIP)
 
         # create mock Listing objects to return
-        return map(lambda (p, score): self._get_listing(p, score), zip(publishables, data))
+        return self.prefetch(map(lambda (p, score): self._get_listing(p, score), zip(publishables, data)))
 
     def _union(self, union_keys, pipe):
         if len(union_keys) > 1:
@@ -462,7 +503,7 @@ class SlidingListingHandler(RedisListingHandler):
 def connect_signals():
     from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
     from ella.core.signals import content_published, content_unpublished
-    from ella.core.models import Listing, Publishable
+    from ella.core.models import Listing, Publishable, Category
 
     if not core_settings.USE_REDIS_FOR_LISTINGS:
         return
@@ -478,3 +519,6 @@ def connect_signals():
     pre_delete.connect(listing_pre_delete, sender=Listing)
     post_delete.connect(listing_post_delete, sender=Listing)
 
+    pre_save.connect(category_pre_save, sender=Category)
+    post_save.connect(category_post_save, sender=Category)
+
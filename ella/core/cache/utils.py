@@ -1,10 +1,13 @@
 from hashlib import md5
+from random import randint
+from time import time
 import logging
+import threading
 
 from django.dispatch import receiver
 from django.db.models import ObjectDoesNotExist
 from django.db.models.loading import get_model
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.core.cache import cache
 from django.core.cache.backends.dummy import DummyCache
 from django.http import Http404
@@ -16,24 +19,111 @@ from django.conf import settings
 log = logging.getLogger('ella.core.cache.utils')
 
 KEY_PREFIX = 'ella.obj'
+AUTHORS_KEY = 'ella.authors:%s'
 CACHE_TIMEOUT = getattr(settings, 'CACHE_TIMEOUT', 10 * 60)
+# version keys must outlive every page that depends on them
+VERSION_TIMEOUT = max(
+    getattr(settings, 'CACHE_VERSION_TIMEOUT', 30 * 24 * 60 * 60),
+    getattr(settings, 'CACHE_MIDDLEWARE_SECONDS', 0)
+)
 
 
 def invalidate_cache(sender, instance, **kwargs):
     invalidate_cache_for_object(instance)
 
 
+def invalidate_published(sender, publishable, **kwargs):
+    " Content of the category and its parents' listings changed. "
+    invalidate_cache_for_object(publishable)
+    category = publishable.category
+    while category is not None:
+        invalidate_cache_for_object(category)
+        category = category.tree_parent
+
+
+def add_rendered_dependencies(sender, category=None, publishable=None, **kwargs):
+    add_dependency(category)
+    add_dependency(publishable)
+
+
+def invalidate_authors(sender, instance, action, reverse, pk_set, **kwargs):
+    " Drop the cached author ids (see ``PublishableManager.get_author_ids``) of changed publishables. "
+    if reverse and action == 'pre_clear':
+        # instance is an author, remember its publishables before they are gone
+        instance._cleared_publishable_ids = list(instance.publishable_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        pks = [instance.pk]
+        instance.__dict__.pop('_authors', None)
+    elif action == 'post_clear':
+        pks = instance.__dict__.pop('_cleared_publishable_ids', [])
+    else:
+        pks = pk_set
+    cache.delete_many([AUTHORS_KEY % pk for pk in pks])
+
+
 def connect_invalidation_signals():
+    from ella.core.signals import content_published, content_unpublished, object_rendering
+    from ella.core.models import Publishable
     post_save.connect(invalidate_cache)
     post_delete.connect(invalidate_cache)
+    content_published.connect(invalidate_published)
+    content_unpublished.connect(invalidate_published)
+    object_rendering.connect(add_rendered_dependencies)
+    m2m_changed.connect(invalidate_authors, sender=Publishable.authors.through)
+
+
+# objects the page rendered in this thread depends on
+_dependencies = threading.local()
+
+
+def start_collecting_dependencies():
+    " Start recording objects the page rendered in this thread depends on. "
+    _dependencies.keys = set()
+
+
+def stop_collecting_dependencies():
+    """
+    Stop recording, return the version keys (see ``invalidate_cache_for_object``)
+    of the objects recorded, use ``get_versions`` to resolve them.
+    """
+    keys = getattr(_dependencies, 'keys', None)
+    _dependencies.keys = None
+    return keys or set()
+
+
+def get_versions(keys):
+    " Return dict of ``keys`` and the versions currently stored under them, in one round trip. "
+    if not keys:
+        return {}
+    versions = cache.get_many(list(keys))
+    return dict((key, versions.get(key)) for key in keys)
+
+
+def add_dependency(obj):
+    " Record that the page being rendered uses ``obj``. "
+    keys = getattr(_dependencies, 'keys', None)
+    if keys is None or obj is None or not obj.pk:
+        return
+    keys.add(get_version_key(obj))
+
+
+def get_version_key(obj):
+    " Cache key holding the version of ``obj``, bumped by ``invalidate_cache_for_object``. "
+    return _get_key(KEY_PREFIX, ContentType.objects.get_for_model(obj), pk=obj.pk, version_key=True)
 
 
 def invalidate_cache_for_object(obj):
-    key = _get_key(KEY_PREFIX, ContentType.objects.get_for_model(obj), pk=obj.pk, version_key=True)
+    key = get_version_key(obj)
     try:
         cache.incr(key)
     except ValueError:
-        cache.set(key, 1, timeout=CACHE_TIMEOUT)
+        # the key expired or was evicted, start from a value it never had so
+        # that pages stored with an older version cannot match it again
+        cache.set(key, int(time() * 1000) * 1000 + randint(0, 999), timeout=VERSION_TIMEOUT)
 
 
 def normalize_key(key):
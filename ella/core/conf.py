@@ -60,4 +60,17 @@ ECACHE_INFO = 'ella.core.middleware.ECACHE_INFO'
 # templates
 ARCHIVE_TEMPLATE = 'listing.html'
 
+# number of compiled templates the {% render %} tag keeps in each process
+RENDER_TEMPLATE_CACHE_SIZE = 500
+
+# render boxes with esi parameter as edge side includes
+ESI = False
+# seconds the ESI fragments can be cached for if the esi parameter doesn't say
+ESI_TIMEOUT = 60
+# put ESI fragments into the page in ESIMiddleware, for use without ESI proxy
+ESI_ASSEMBLE = False
+
+# answer conditional GET requests for publishables and categories with 304
+CONDITIONAL_GET = False
+
 core_settings = Settings('ella.core.conf', '')
@@ -2,6 +2,7 @@ import re
 
 from django.http import Http404
 from django.core.urlresolvers import RegexURLResolver
+from django.utils.translation import get_language
 
 try:
     from django.conf.urls import patterns, url, include
@@ -27,6 +28,8 @@ class CustomURLResolver(object):
     """
     def __init__(self):
         self._patterns = {}
+        self._resolvers = {}
+        self._static_suffixes = {}
         self.root_mapping = {}
 
     def has_custom_detail(self, obj):
@@ -53,14 +56,45 @@ class CustomURLResolver(object):
                     url('^%s/' % re.escape(prefix), include((urlpatterns, '', ''))),
                 )
         self._patterns.setdefault(key, []).extend(urlpatterns)
+        # patterns registered for ALL show in every resolver
+        self._resolvers.clear()
+        self._static_suffixes.clear()
 
     def _get_resolver(self, obj):
-        return RegexURLResolver(r'^', self._patterns.get(str(obj._meta), []) + self._patterns.get(ALL, []))
+        key = str(obj._meta)
+        try:
+            return self._resolvers[key]
+        except KeyError:
+            resolver = RegexURLResolver(r'^', self._patterns.get(key, []) + self._patterns.get(ALL, []))
+            self._resolvers[key] = resolver
+            return resolver
+
+    def _get_static_suffix(self, obj, view_name):
+        """
+        Return the URL suffix of ``view_name`` if it has a pattern without any
+        arguments, ``None`` otherwise.
+        """
+        key = (str(obj._meta), view_name, get_language())
+        try:
+            return self._static_suffixes[key]
+        except KeyError:
+            resolver = self._get_resolver(obj)
+            suffix = None
+            for possibilities, pattern, defaults in resolver.reverse_dict.getlist(view_name):
+                if any(not params for result, params in possibilities):
+                    suffix = resolver.reverse(view_name)
+                    break
+            self._static_suffixes[key] = suffix
+            return suffix
 
     def resolve(self, obj, url_remainder):
         return self._get_resolver(obj).resolve(url_remainder)
 
     def reverse(self, obj, view_name, *args, **kwargs):
+        if not args and not kwargs:
+            suffix = self._get_static_suffix(obj, view_name)
+            if suffix is not None:
+                return obj.get_absolute_url() + suffix
         return obj.get_absolute_url() + self._get_resolver(obj).reverse(view_name, *args, **kwargs)
 
     def call_custom_view(self, request, obj, url_remainder, context):
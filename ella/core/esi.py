@@ -0,0 +1,56 @@
+"""
+Edge side includes - boxes with the ``esi`` parameter are left out of the page
+and rendered by ``ella.core.views.esi_box`` as separate fragments which the
+ESI capable proxy caches for their own time and puts into the page.
+"""
+import re
+from copy import copy
+
+from django.core.urlresolvers import resolve
+from django.http import QueryDict
+from django.utils.crypto import salted_hmac, constant_time_compare
+from django.utils.encoding import smart_str
+
+
+ESI_INCLUDE = '<esi:include src="%s"/>'
+ESI_INCLUDE_RE = re.compile(r'<esi:include src="([^"]*)"\s*/>')
+
+
+def esi_include(src):
+    return ESI_INCLUDE % src
+
+
+def get_signature(content_type_id, pk, box_type, params):
+    """
+    Signature of the fragment's URL parts made with ``SECRET_KEY`` so that
+    only the boxes Ella itself included can be requested.
+    """
+    value = '\n'.join(smart_str(v) for v in (content_type_id, pk, box_type, params))
+    return salted_hmac('ella.core.esi', value).hexdigest()
+
+
+def check_signature(signature, content_type_id, pk, box_type, params):
+    return constant_time_compare(smart_str(signature), get_signature(content_type_id, pk, box_type, params))
+
+
+def assemble(request, content):
+    """
+    Replace ESI includes in ``content`` with output of the views they point to.
+    Meant for development and tests where no ESI capable proxy is available.
+    """
+    def include(match):
+        path, _, query = match.group(1).partition('?')
+        view, args, kwargs = resolve(path, getattr(request, 'urlconf', None))
+
+        fragment_request = copy(request)
+        fragment_request.path = fragment_request.path_info = path
+        fragment_request.GET = QueryDict(query)
+
+        response = view(fragment_request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        if response.status_code != 200:
+            return ''
+        return response.content
+
+    return ESI_INCLUDE_RE.sub(include, content)
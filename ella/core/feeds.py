@@ -37,7 +37,7 @@ class RSSTopCategoryListings(Feed):
         return cat
 
     def items(self, obj):
-        qset = Listing.objects.get_queryset_wrapper(category=obj, children=ListingHandler.ALL)
+        qset = Listing.objects.get_queryset_wrapper(category=obj, children=ListingHandler.ALL, prefetch_authors=True)
         return qset.get_listings(count=core_settings.RSS_NUM_IN_FEED)
 
     # Feed metadata
@@ -81,7 +81,7 @@ class RSSTopCategoryListings(Feed):
         return desc
 
     def item_author_name(self, item):
-        return ', '.join(map(unicode, item.publishable.authors.all()))
+        return ', '.join(map(unicode, item.publishable.get_authors()))
 
     # Enclosure - Photo
     ###########################################################################
@@ -0,0 +1,61 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ella.core import urls
+from ella.core.url_dispatcher import URLDispatcher
+
+PATHS = (
+    '',
+    'news/',
+    'news/world/europe/',
+    'news/world/europe/2012/10/4/some-article-slug/',
+    'news/2012/10/4/some-article-slug/comments/',
+    'news/world/2012/',
+    'about/123-contact/',
+    '2012/10/4/some-article-slug/',
+    'news/world/feeds/',
+    'export/',
+    'some/not/existing/path/to/a-page.html',
+)
+
+
+class Command(BaseCommand):
+    help = 'Compare resolving sample paths by ella.core.urls patterns one by one and by URLDispatcher'
+    args = '[path path ...]'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--number',
+            dest='number',
+            type='int',
+            default=10000,
+            help='Number of times each path is resolved'),
+        )
+
+    def handle(self, *paths, **options):
+        paths = paths or PATHS
+        number = options['number']
+
+        patterns = [p for p in urls.urlpatterns if not isinstance(p, URLDispatcher)]
+        dispatcher = URLDispatcher(patterns, urls.res['author'])
+
+        def one_by_one(path):
+            for p in patterns:
+                match = p.resolve(path)
+                if match:
+                    return match
+
+        def dispatched(path):
+            # what django does after the dispatcher fails
+            return dispatcher.resolve(path) or one_by_one(path)
+
+        print '%-50s %12s %12s' % ('path', 'patterns', 'dispatcher')
+        for path in paths:
+            results = []
+            for resolve in (one_by_one, dispatched):
+                start = time.time()
+                for i in xrange(number):
+                    resolve(path)
+                results.append((time.time() - start) / number * 1000000)
+            print '%-50s %10.1fus %10.1fus' % (path[:50], results[0], results[1])
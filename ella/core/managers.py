@@ -1,3 +1,5 @@
+from datetime import datetime, timedelta
+from itertools import chain
 from operator import attrgetter
 
 from django.db import models
@@ -5,12 +7,17 @@ from django.core.exceptions import ImproperlyConfigured
 from django.utils.encoding import smart_str
 from django.db.models.loading import get_model
 from django.conf import settings
+from django.core.cache import cache
 
-from ella.core.cache import cache_this
+from ella.core.cache import cache_this, get_cached_objects, normalize_key, NONE, SKIP
+from ella.core.cache.utils import AUTHORS_KEY
 from ella.core.conf import core_settings
 from ella.utils import timezone, import_module_member
 
 
+URL_INDEX_KEY = 'ella.url:%s:%s:%d-%d-%d:%s'
+
+
 class PublishableManager(models.Manager):
     def current(self, now=None):
         now = timezone.now().replace(second=0, microsecond=0)
@@ -20,6 +27,111 @@ class PublishableManager(models.Manager):
             published=True, publish_from__lte=now
         )
 
+    def _get_url_key(self, category, year, month, day, slug):
+        return normalize_key(URL_INDEX_KEY % (category.site_id, smart_str(category.tree_path), year, month, day, smart_str(slug)))
+
+    def _get_publishable_url_key(self, publishable):
+        publish_from = timezone.localize(publishable.publish_from)
+        return self._get_url_key(publishable.category, publish_from.year, publish_from.month, publish_from.day, publishable.slug)
+
+    def _matches_url(self, publishable, category, year, month, day, slug):
+        publish_from = timezone.localize(publishable.publish_from)
+        return publishable.published and not publishable.static and \
+            publishable.category_id == category.pk and publishable.slug == slug and \
+            (publish_from.year, publish_from.month, publish_from.day) == (year, month, day)
+
+    def get_by_url(self, category, year, month, day, slug):
+        """
+        Return the published non-static publishable living at the dated URL.
+        The URL index maps the URL to content type and pk so that only the
+        object itself has to be fetched, from cache if possible. Entries
+        pointing to an object with a different URL are ignored.
+
+        :raises DoesNotExist: if there is no such object.
+        """
+        key = self._get_url_key(category, year, month, day, slug)
+        ct_pk = cache.get(key)
+        if ct_pk is not None:
+            publishable = get_cached_objects([ct_pk], missing=NONE)[0]
+            if publishable is not None and self._matches_url(publishable, category, year, month, day, slug):
+                return publishable
+
+        start_date = timezone.localize(datetime(year, month, day))
+        ct_pk = self.filter(
+            published=True,
+            static=False,
+            category=category,
+            slug=slug,
+            publish_from__gte=start_date,
+            publish_from__lt=start_date + timedelta(days=1),
+        ).values_list('content_type_id', 'pk').get()
+        cache.set(key, ct_pk, core_settings.CACHE_TIMEOUT_LONG)
+        return get_cached_objects([ct_pk])[0]
+
+    def update_url_index(self, publishable, old_publishable=None):
+        " Point the URL index to ``publishable``, drop the entry for ``old_publishable``'s URL. "
+        key = None
+        if publishable.published and not publishable.static:
+            key = self._get_publishable_url_key(publishable)
+            cache.set(key, (publishable.content_type_id, publishable.pk), core_settings.CACHE_TIMEOUT_LONG)
+
+        if old_publishable is not None and old_publishable.published and not old_publishable.static:
+            old_key = self._get_publishable_url_key(old_publishable)
+            if old_key != key:
+                cache.delete(old_key)
+
+    def save_many(self, publishables, **kwargs):
+        """
+        Save ``publishables`` one by one, create redirects for the changed
+        URLs and send the publish signals once all of them are saved. Meant
+        for importers saving many objects at once.
+        """
+        from ella.core.models.publishable import start_batch, finish_batch
+        start_batch()
+        try:
+            for publishable in publishables:
+                publishable.save(**kwargs)
+        finally:
+            finish_batch()
+
+    def remove_from_url_index(self, publishable):
+        if publishable.published and not publishable.static:
+            cache.delete(self._get_publishable_url_key(publishable))
+
+    def get_author_ids(self, publishables):
+        """
+        Return dict mapping pks of ``publishables`` to lists of ids of their
+        authors. The lists are cached per publishable, those missing in the
+        cache are loaded in one query.
+        """
+        keys = dict((AUTHORS_KEY % p.pk, p.pk) for p in publishables)
+        author_ids = dict((keys[k], ids) for k, ids in cache.get_many(keys.keys()).iteritems())
+
+        missing = [pk for pk in keys.itervalues() if pk not in author_ids]
+        if missing:
+            for pk in missing:
+                author_ids[pk] = []
+            through = self.model.authors.through
+            for pk, author_id in through.objects.filter(publishable__in=missing).order_by('pk').values_list('publishable_id', 'author_id'):
+                author_ids[pk].append(author_id)
+            cache.set_many(dict((AUTHORS_KEY % pk, author_ids[pk]) for pk in missing), core_settings.CACHE_TIMEOUT_LONG)
+
+        return author_ids
+
+    def prefetch_authors(self, publishables):
+        """
+        Attach authors to ``publishables`` so that ``Publishable.get_authors``
+        returns them right away. The authors themselves are retrieved by
+        ``get_cached_objects``.
+        """
+        if not publishables:
+            return
+        author_ids = self.get_author_ids(publishables)
+        pks = list(set(chain(*author_ids.values())))
+        authors = dict((a.pk, a) for a in get_cached_objects(pks, get_model('core', 'author'), missing=SKIP))
+        for p in publishables:
+            p._authors = [authors[pk] for pk in author_ids[p.pk] if pk in authors]
+
 
 class CategoryManager(models.Manager):
     _cache = {}
@@ -148,12 +260,13 @@ class ListingHandler(object):
         pass
 
     def __init__(self, category, children=NONE, content_types=[],
-                 date_range=(), exclude=None, **kwargs):
+                 date_range=(), exclude=None, prefetch_authors=False, **kwargs):
         self.category = category
         self.children = children
         self.content_types = content_types
         self.date_range = date_range
         self.exclude = exclude
+        self.prefetch_authors = prefetch_authors
         self.kwargs = kwargs
 
     def __getitem__(self, k):
@@ -175,6 +288,12 @@ class ListingHandler(object):
     def get_listings(self, offset=0, count=10):
         raise NotImplementedError
 
+    def prefetch(self, listings):
+        " Attach authors to the listed publishables when asked to with ``prefetch_authors``. "
+        if self.prefetch_authors:
+            get_model('core', 'publishable').objects.prefetch_authors([l.publishable for l in listings])
+        return listings
+
     def get_listing(self, i):
         return self.get_listings(i, i + 1)[0]
 
@@ -346,7 +465,7 @@ class ModelListingHandler(ListingHandler):
 
     def get_listings(self, offset=0, count=10):
         Listing = get_model('core', 'listing')
-        return Listing.objects.get_listing(
+        return self.prefetch(Listing.objects.get_listing(
                 self.category,
                 children=self.children,
                 content_types=self.content_types,
@@ -354,7 +473,7 @@ class ModelListingHandler(ListingHandler):
                 offset=offset,
                 count=count,
                 exclude=self.exclude
-            )
+            ))
 
     def count(self):
         if not hasattr(self, '_count'):
@@ -1,14 +1,25 @@
 import time
 import re
 import logging
+import threading
+import zlib
+from uuid import uuid4
 log = logging.getLogger('ella.core.middleware')
 
 from django import template
 from django.middleware.cache import CacheMiddleware as DjangoCacheMiddleware
+from django.core.handlers.base import BaseHandler
+from django.http import HttpRequest, HttpResponse
+from django.db import connection
 from django.core.cache import cache
-from django.utils.cache import get_cache_key, add_never_cache_headers, learn_cache_key
+from django.utils.cache import get_cache_key, add_never_cache_headers, learn_cache_key, patch_vary_headers
 from django.conf import settings
+from django.utils.encoding import smart_str
 from ella.core.conf import core_settings
+from ella.core.box import Box, DOUBLE_RENDER_MARKER_RE, parse_double_render_marker
+from ella.core.cache.utils import get_cached_objects, NONE, \
+    start_collecting_dependencies, stop_collecting_dependencies, get_versions
+from ella.core.esi import assemble
 
 class DoubleRenderMiddleware(object):
 
@@ -38,16 +49,67 @@ class DoubleRenderMiddleware(object):
                     return response
 
         try:
-            c = template.RequestContext(request, {'SECOND_RENDER': True})
-            t = template.Template(response.content)
-            response.content = t.render(c)
-            response['Content-Length'] = len(response.content)
+            content = self.render_boxes(request, response.content)
+            if content is not None:
+                response.content = content
+                response['Content-Length'] = len(response.content)
         except Exception, e:
             log.warning('Failed to double render on (%s)', unicode(e).encode('utf8'))
 
         return response
 
+    def render_boxes(self, request, content):
+        """
+        Replace placeholders left by ``Box.double_render`` with the rendered
+        boxes, the rest of the content is left untouched. All the objects
+        are fetched at once. Returns ``None`` when there is nothing to replace.
+        """
+        boxes = {}
+        for match in DOUBLE_RENDER_MARKER_RE.finditer(content):
+            if match.group(0) not in boxes:
+                boxes[match.group(0)] = parse_double_render_marker(match)
+        if not boxes:
+            return None
+
+        keys = list(set((ct_id, pk) for ct_id, pk, box_type, nodelist in boxes.values()))
+        objects = dict(zip(keys, get_cached_objects(keys, missing=NONE)))
+
+        c = template.RequestContext(request, {'SECOND_RENDER': True})
+        rendered = {}
+        for marker, (ct_id, pk, box_type, nodelist) in boxes.items():
+            obj = objects[(ct_id, pk)]
+            if obj is None:
+                rendered[marker] = ''
+            else:
+                box = getattr(obj, 'box_class', Box)(obj, box_type, nodelist)
+                rendered[marker] = smart_str(box.render(c))
+
+        return DOUBLE_RENDER_MARKER_RE.sub(lambda m: rendered[m.group(0)], content)
+
+class ESIMiddleware(object):
+    """
+    Mark pages containing ESI includes for the proxy or, with ``ESI_ASSEMBLE``,
+    put the fragments in place right away.
+    """
+    def process_response(self, request, response):
+        if response.status_code != 200 \
+            or not response['Content-Type'].startswith('text') \
+            or not core_settings.ESI \
+            or '<esi:include' not in response.content:
+            return response
+
+        if core_settings.ESI_ASSEMBLE:
+            response.content = assemble(request, response.content)
+            response['Content-Length'] = len(response.content)
+        else:
+            response['Surrogate-Control'] = 'content="ESI/1.0"'
+        return response
+
 class CacheMiddleware(DjangoCacheMiddleware):
+    def __init__(self, *args, **kwargs):
+        super(CacheMiddleware, self).__init__(*args, **kwargs)
+        self.never_cache_headers = getattr(settings, 'CACHE_MIDDLEWARE_NEVER_CACHE_HEADERS', True)
+
     def process_request(self, request):
         resp = super(CacheMiddleware, self).process_request(request)
 
@@ -60,7 +122,8 @@ class CacheMiddleware(DjangoCacheMiddleware):
         resp = super(CacheMiddleware, self).process_response(request, response)
 
         # never cache headers + ETag
-        add_never_cache_headers(resp)
+        if self.never_cache_headers:
+            add_never_cache_headers(resp)
 
         return resp
 
@@ -68,6 +131,127 @@ class CacheMiddleware(DjangoCacheMiddleware):
 
 
 
+# bodies are stored gzipped so that they can be served as they are
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+# appended to the ETag of gzipped responses so that both variants differ
+GZIP_ETAG_SUFFIX = '-gzip'
+
+
+def accepts_gzip(request):
+    """
+    Whether the client accepts gzip according to its ``Accept-Encoding``,
+    codings with ``q=0`` are refused.
+    """
+    qualities = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[name] = q
+
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+
+def store_page(cache_key, response, orig_time, timeout, dependencies=None):
+    """
+    Store the response under ``cache_key`` together with its creation time
+    and ``dependencies`` - versions of the objects it was rendered from (see
+    ``ella.core.cache.utils.add_dependency``). The page is considered missing
+    once any of them changes.
+
+    Status, headers and cookies are stored with the first chunk of the
+    gzipped body, bodies bigger than ``CACHE_MIDDLEWARE_CHUNK_SIZE`` are split
+    across several keys so that no item hits the limit of the cache backend.
+    The keys of the chunks contain a token of this store so that chunks of
+    a concurrent store of the same page are never mixed in.
+    """
+    chunk_size = getattr(settings, 'CACHE_MIDDLEWARE_CHUNK_SIZE', 900 * 1024)
+
+    if response.has_header('Content-Encoding'):
+        # already encoded by some other middleware, store as it is
+        body, gzipped = response.content, False
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+        body, gzipped = compressor.compress(response.content) + compressor.flush(), True
+
+    chunks = [body[i:i + chunk_size] for i in xrange(0, len(body), chunk_size)] or ['']
+    token = uuid4().hex
+    head = {
+        'status': response.status_code,
+        'headers': response.items(),
+        'cookies': response.cookies,
+        'gzipped': gzipped,
+        'token': token,
+        'chunks': len(chunks),
+        'size': len(body),
+        'body': chunks[0],
+        'dependencies': dependencies or {},
+    }
+
+    to_set = {cache_key: (orig_time, head)}
+    for i, chunk in enumerate(chunks[1:]):
+        to_set['%s:%s:%d' % (cache_key, token, i + 1)] = chunk
+    cache.set_many(to_set, timeout)
+
+
+def build_page(request, cache_key, head):
+    """
+    Return response from ``head`` stored by ``store_page`` or ``None`` if some
+    part of it is missing or broken. Gzipped body is sent to clients
+    accepting it, with its own ETag.
+    """
+    if not isinstance(head, dict) or 'token' not in head:
+        return None
+
+    body = head['body']
+    keys = ['%s:%s:%d' % (cache_key, head['token'], i) for i in xrange(1, head['chunks'])]
+    dependencies = head.get('dependencies', {})
+    if keys or dependencies:
+        cached = cache.get_many(keys + dependencies.keys())
+        for key, version in dependencies.iteritems():
+            if cached.get(key) != version:
+                return None
+        if not all(k in cached for k in keys):
+            return None
+        body = ''.join([body] + [cached[k] for k in keys])
+    if len(body) != head['size']:
+        return None
+
+    send_gzipped = head['gzipped'] and accepts_gzip(request)
+    if head['gzipped'] and not send_gzipped:
+        try:
+            body = zlib.decompress(body, GZIP_WBITS)
+        except zlib.error:
+            return None
+
+    response = HttpResponse(body, status=head['status'])
+    for header, value in head['headers']:
+        response[header] = value
+    response.cookies = head['cookies']
+
+    if head['gzipped']:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    if send_gzipped:
+        response['Content-Encoding'] = 'gzip'
+        if response.has_header('ETag'):
+            etag = response['ETag']
+            response['ETag'] = etag[:-1] + GZIP_ETAG_SUFFIX + '"' if etag.endswith('"') else etag + GZIP_ETAG_SUFFIX
+    response['Content-Length'] = str(len(body))
+    return response
+
+
 class UpdateCacheMiddleware(object):
     """
     Response-phase cache middleware that updates the cache if the response is
@@ -81,12 +265,15 @@ class UpdateCacheMiddleware(object):
         self.cache_timeout = settings.CACHE_MIDDLEWARE_SECONDS
         self.key_prefix = settings.CACHE_MIDDLEWARE_KEY_PREFIX
         self.cache_anonymous_only = getattr(settings, 'CACHE_MIDDLEWARE_ANONYMOUS_ONLY', False)
+        self.never_cache_headers = getattr(settings, 'CACHE_MIDDLEWARE_NEVER_CACHE_HEADERS', True)
 
     def process_response(self, request, response):
         """Sets the cache, if needed."""
+        dependencies = stop_collecting_dependencies()
 
         # never cache headers + ETag
-        add_never_cache_headers(response)
+        if self.never_cache_headers:
+            add_never_cache_headers(response)
 
         if not hasattr(request, '_cache_update_cache') or not request._cache_update_cache:
             # We don't need to update the cache, just return.
@@ -107,7 +294,7 @@ class UpdateCacheMiddleware(object):
             cache_key = learn_cache_key(request, response, self.cache_timeout, self.key_prefix)
 
         # include the orig_time information within the cache
-        cache.set(cache_key, (time.time(), response), self.cache_timeout)
+        store_page(cache_key, response, time.time(), self.cache_timeout, get_versions(dependencies))
         return response
 
 class FetchFromCacheMiddleware(object):
@@ -117,19 +304,54 @@ class FetchFromCacheMiddleware(object):
     Must be used as part of the two-part update/fetch cache middleware.
     FetchFromCacheMiddleware must be the last piece of middleware in
     MIDDLEWARE_CLASSES so that it'll get called last during the request phase.
+
+    When a page gets older than ``CACHE_MIDDLEWARE_REFRESH_SECONDS`` it is
+    either regenerated by the request that noticed it or, with
+    ``CACHE_MIDDLEWARE_BACKGROUND_REFRESH``, in a background thread while all
+    the requests keep getting the stale page. Both can be set per URL in
+    ``CACHE_MIDDLEWARE_REFRESH_POLICIES``, a list of (regex, dict) pairs
+    where the dict may contain ``refresh_seconds`` and ``background``.
     """
+    _handler = None
+    _handler_lock = threading.Lock()
+
     def __init__(self):
         self.cache_expire_timeout = settings.CACHE_MIDDLEWARE_SECONDS
         self.key_prefix = settings.CACHE_MIDDLEWARE_KEY_PREFIX
         self.cache_refresh_timeout = getattr(settings, 'CACHE_MIDDLEWARE_REFRESH_SECONDS', self.cache_expire_timeout / 2)
         self.timeout = getattr(settings, 'CACHE_MIDDLEWARE_REFRESH_TIMEOUT', 10)
         self.cache_anonymous_only = getattr(settings, 'CACHE_MIDDLEWARE_ANONYMOUS_ONLY', False)
+        self.background_refresh = getattr(settings, 'CACHE_MIDDLEWARE_BACKGROUND_REFRESH', False)
+        self.refresh_policies = [(re.compile(pattern), policy) for pattern, policy in
+                getattr(settings, 'CACHE_MIDDLEWARE_REFRESH_POLICIES', ())]
+
+    def get_refresh_policy(self, request):
+        " Return refresh timeout and whether to refresh in background for the request. "
+        for pattern, policy in self.refresh_policies:
+            if pattern.match(request.path):
+                return policy.get('refresh_seconds', self.cache_refresh_timeout), policy.get('background', self.background_refresh)
+        return self.cache_refresh_timeout, self.background_refresh
 
     def process_request(self, request):
         """
         Checks whether the page is already cached and returns the cached
-        version if available.
+        version if available. Starts recording the objects the page depends
+        on when it is going to be generated and cached.
         """
+        response = self._get_cached_response(request)
+        if getattr(request, '_cache_update_cache', False):
+            start_collecting_dependencies()
+        else:
+            stop_collecting_dependencies()
+        return response
+
+    def _get_cached_response(self, request):
+        if getattr(request, '_cache_refresh', False):
+            # background refresh, always regenerate
+            request._cache_middleware_key = get_cache_key(request, self.key_prefix)
+            request._cache_update_cache = True
+            return None
+
         if self.cache_anonymous_only:
             assert hasattr(request, 'user'), "The Django cache middleware with CACHE_MIDDLEWARE_ANONYMOUS_ONLY=True requires authentication middleware to be installed. Edit your MIDDLEWARE_CLASSES setting to insert 'django.contrib.auth.middleware.AuthenticationMiddleware' before the CacheMiddleware."
 
@@ -148,19 +370,86 @@ class FetchFromCacheMiddleware(object):
             request._cache_update_cache = True
             return None # No cache information available, need to rebuild.
 
-        response = cache.get(cache_key, None)
+        cached = cache.get(cache_key, None)
+        response = cached and build_page(request, cache_key, cached[1])
         if response is None:
             request._cache_update_cache = True
             return None # No cache information available, need to rebuild.
 
-        orig_time, response = response
+        orig_time, head = cached
+        refresh_timeout, background = self.get_refresh_policy(request)
         # time to refresh the cache
-        if orig_time and  ((time.time() - orig_time) > self.cache_refresh_timeout):
+        if orig_time and refresh_timeout is not None and ((time.time() - orig_time) > refresh_timeout):
+            if background:
+                # only the first request to notice starts the refresh, everybody
+                # (including that request) gets the stale page in the meantime
+                if cache.add(cache_key + ':refresh', 1, self.timeout):
+                    self.refresh_in_background(request)
+                request._cache_update_cache = False
+                return response
+
             request._cache_update_cache = True
             # keep the response in the cache for just self.timeout seconds and mark it for update
             # other requests will continue werving this response from cache while I alone work on refreshing it
-            cache.set(cache_key, (None, response), self.timeout)
+            cache.set(cache_key, (None, head), self.timeout)
             return None
 
         request._cache_update_cache = False
         return response
+
+    def get_refresh_request(self, request):
+        """
+        Anonymous request for the same page sharing no state with ``request``
+        - no cookies, session, user or input stream - so that the visitor's
+        identity doesn't end up in the refreshed page or session.
+        """
+        refresh = HttpRequest()
+        refresh.method = 'GET'
+        refresh.path = request.path
+        refresh.path_info = request.path_info
+        refresh.GET = request.GET.copy()
+        refresh.META = dict(
+            (k, v) for k, v in request.META.iteritems()
+            if k != 'HTTP_COOKIE' and not k.startswith('wsgi.')
+        )
+        if hasattr(request, 'urlconf'):
+            refresh.urlconf = request.urlconf
+        refresh._cache_middleware_key = request._cache_middleware_key
+        refresh._cache_refresh = True
+        return refresh
+
+    def refresh_in_background(self, request):
+        request = self.get_refresh_request(request)
+        t = threading.Thread(target=self._refresh_in_thread, args=(request,))
+        t.setDaemon(True)
+        t.start()
+
+    def _refresh_in_thread(self, request):
+        try:
+            self.refresh(request)
+        finally:
+            connection.close()
+
+    def get_handler(self):
+        " Handler running the refreshing requests, built once with the middleware of the project. "
+        if self._handler is None:
+            with self._handler_lock:
+                if self._handler is None:
+                    handler = BaseHandler()
+                    handler.load_middleware()
+                    self._handler = handler
+        return self._handler
+
+    def refresh(self, request):
+        """
+        Run the request through the whole stack, UpdateCacheMiddleware stores
+        the result. The refresh lock is released once done.
+        """
+        cache_key = getattr(request, '_cache_middleware_key', None)
+        try:
+            self.get_handler().get_response(request)
+        except Exception, e:
+            log.warning('Failed to refresh cached page %s (%s)', request.path, unicode(e).encode('utf8'))
+        finally:
+            if cache_key:
+                cache.delete(cache_key + ':refresh')
@@ -9,9 +9,11 @@ from django.utils.translation import ugettext_lazy as _
 
 from app_data import AppDataField
 
-from ella.core.cache import CachedGenericForeignKey, SiteForeignKey, ContentTypeForeignKey, CategoryForeignKey, CachedForeignKey, redis
+from ella.core.cache import CachedGenericForeignKey, SiteForeignKey, ContentTypeForeignKey, CategoryForeignKey, CachedForeignKey, redis, \
+    invalidate_cache_for_object
 from ella.core.conf import core_settings
 from ella.core.managers import CategoryManager, ListingHandler
+from ella.utils.timezone import now
 
 if hasattr(settings, 'AUTH_USER_MODEL'):
     User = settings.AUTH_USER_MODEL
@@ -136,14 +138,93 @@ class Category(models.Model):
                 self.tree_path = self.slug
         else:
             self.tree_path = ''
+
+        moved = self.pk and old_tree_path and old_tree_path != self.tree_path
+        if moved:
+            Category.objects.clear_cache()
+            descendant_ids = self.get_descendant_ids(old_tree_path)
+            publishables = self._get_publishables(descendant_ids)
+
         Category.objects.clear_cache()
         super(Category, self).save(**kwargs)
-        if old_tree_path != self.tree_path:
+
+        if moved:
+            self._move_descendants(old_tree_path, descendant_ids)
+            self._create_redirects(old_tree_path, publishables)
+            # positions are inherited from the ancestors which have changed
+            Position = models.get_model('positions', 'position')
+            if Position is not None:
+                Position.objects.invalidate_category(self)
+        elif old_tree_path != self.tree_path:
             # the tree_path has changed, update children
             children = Category.objects.filter(tree_parent=self)
             for child in children:
                 child.save(force_update=True)
 
+    def get_descendant_ids(self, tree_path=None):
+        " Return pks of all the categories under the one with ``tree_path`` (this category's by default). "
+        if tree_path is None:
+            tree_path = self.tree_path
+        qset = Category.objects.filter(site=self.site_id).exclude(pk=self.pk)
+        if tree_path:
+            qset = qset.filter(tree_path__startswith=tree_path + '/')
+        return list(qset.values_list('pk', flat=True))
+
+    def _get_publishables(self, descendant_ids):
+        """
+        ``(tree_path, slug, publish_from)`` of non-static publishables in this
+        category and its descendants that have already been public.
+        """
+        from ella.core.models.publishable import Publishable
+        return list(Publishable.objects.filter(
+            category__in=[self.pk] + descendant_ids, static=False,
+            published=True, publish_from__lte=now()
+        ).values_list('category__tree_path', 'slug', 'publish_from'))
+
+    def _move_descendants(self, old_tree_path, descendant_ids):
+        """
+        Replace ``old_tree_path`` prefix of the descendants' ``tree_path`` by
+        the current one in a single query instead of saving them one by one.
+        """
+        from django.db import connection, transaction
+
+        qn = connection.ops.quote_name
+        if connection.vendor == 'mysql':
+            new_path = 'CONCAT(%s, SUBSTR(' + qn('tree_path') + ', %s))'
+        else:
+            new_path = '%s || SUBSTR(' + qn('tree_path') + ', %s)'
+
+        cursor = connection.cursor()
+        cursor.execute(
+            'UPDATE %s SET %s = %s WHERE %s = %%s AND SUBSTR(%s, 1, %%s) = %%s' % (
+                qn(self._meta.db_table), qn('tree_path'), new_path,
+                qn('site_id'), qn('tree_path')
+            ),
+            [self.tree_path + '/' if self.tree_path else '', len(old_tree_path) + 2,
+             self.site_id, len(old_tree_path) + 1, old_tree_path + '/']
+        )
+        transaction.commit_unless_managed()
+
+        Category.objects.clear_cache()
+        for pk in descendant_ids:
+            invalidate_cache_for_object(Category(pk=pk))
+
+    def _create_redirects(self, old_tree_path, publishables):
+        """
+        Redirect the old URLs of ``publishables`` to the new ones, computed
+        by replacing ``old_tree_path`` with the current one.
+        """
+        from ella.core.models.publishable import update_redirects, get_object_url
+        redirects = []
+        for tree_path, slug, publish_from in publishables:
+            new_tree_path = '/'.join(filter(None, (self.tree_path, tree_path[len(old_tree_path) + 1:])))
+            redirects.append((
+                self.site_id,
+                get_object_url(tree_path, slug, publish_from),
+                get_object_url(new_tree_path, slug, publish_from)
+            ))
+        update_redirects(redirects)
+
     def get_root_category(self):
         if '/' not in self.tree_path:
             return self
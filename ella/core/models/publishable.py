@@ -1,8 +1,10 @@
+import threading
+from copy import copy
+
 from django.db import models
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _, ugettext
 from django.contrib.contenttypes.models import ContentType
-from django.core.urlresolvers import reverse
 from django.contrib.redirects.models import Redirect
 from django.core.validators import validate_slug
 from django.core.exceptions import ValidationError
@@ -17,9 +19,117 @@ from ella.core.managers import ListingManager, RelatedManager, \
     PublishableManager
 from ella.core.models.main import Author, Source
 from ella.core.signals import content_published, content_unpublished
+from ella.utils.reverse import fast_reverse
 from ella.utils.timezone import now, localize
 
 
+# fields whose change may change the URL or publication status
+TRACKED_FIELDS = ('category_id', 'slug', 'static', 'publish_from', 'publish_to', 'published', 'last_updated')
+URL_FIELDS = set(('category_id', 'slug', 'static', 'publish_from'))
+
+# redirects and signals postponed by PublishableManager.save_many
+_batch = threading.local()
+
+
+def start_batch():
+    """
+    Postpone redirects and signals until the matching ``finish_batch``.
+    Batches may nest, only the outermost one is flushed.
+    """
+    depth = getattr(_batch, 'depth', 0)
+    if not depth:
+        _batch.redirects = []
+        _batch.signals = []
+    _batch.depth = depth + 1
+
+
+def finish_batch():
+    """
+    Create redirects and send signals postponed since the outermost
+    ``start_batch``. Redirects to URLs changed again within the batch are
+    collapsed.
+    """
+    _batch.depth -= 1
+    if _batch.depth:
+        return
+    redirects, signals = _batch.redirects, _batch.signals
+    _batch.redirects = _batch.signals = None
+    if redirects:
+        update_redirects(redirects)
+    for signal, publishable in signals:
+        signal.send(sender=publishable.__class__, publishable=publishable)
+
+
+def add_redirect(site_id, old_path, new_path):
+    if getattr(_batch, 'redirects', None) is not None:
+        _batch.redirects.append((site_id, old_path, new_path))
+    else:
+        update_redirects([(site_id, old_path, new_path)])
+
+
+def send_publish_signal(signal, publishable):
+    if getattr(_batch, 'signals', None) is not None:
+        _batch.signals.append((signal, publishable))
+    else:
+        signal.send(sender=publishable.__class__, publishable=publishable)
+
+
+def update_redirects(redirects):
+    """
+    Make ``old_path`` redirect to ``new_path`` for each ``(site_id, old_path,
+    new_path)`` in ``redirects``, including the existing redirects pointing
+    to ``old_path``. Chains of changes are collapsed first so that every
+    path redirects straight to its final URL.
+    """
+    by_site = {}
+    for site_id, old_path, new_path in redirects:
+        paths = by_site.setdefault(site_id, {})
+        for o, n in paths.items():
+            if n == old_path:
+                paths[o] = new_path
+        paths[old_path] = new_path
+
+    for site_id, paths in by_site.items():
+        updates, loops, missing = {}, [], dict(paths)
+        existing = Redirect.objects.filter(site=site_id).filter(
+            models.Q(old_path__in=paths.keys()) | models.Q(new_path__in=paths.keys()))
+        for pk, old_path, new_path in existing.values_list('pk', 'old_path', 'new_path'):
+            if old_path in paths:
+                target = paths[old_path]
+                missing.pop(old_path, None)
+            else:
+                target = paths[new_path]
+
+            if target == old_path:
+                loops.append(pk)
+            elif target != new_path:
+                updates.setdefault(target, []).append(pk)
+
+        if loops:
+            Redirect.objects.filter(pk__in=loops).delete()
+        for target, pks in updates.items():
+            Redirect.objects.filter(pk__in=pks).update(new_path=target)
+        Redirect.objects.bulk_create([
+            Redirect(site_id=site_id, old_path=old_path, new_path=new_path)
+            for old_path, new_path in missing.items() if old_path != new_path
+        ])
+
+
+def get_object_url(tree_path, slug, publish_from):
+    " URL of a non-static publishable in the category with ``tree_path``. "
+    publish_from = localize(publish_from)
+    kwargs = {
+        'slug': slug,
+        'year': publish_from.year,
+        'month': publish_from.month,
+        'day': publish_from.day,
+    }
+    if tree_path:
+        kwargs['category'] = tree_path
+        return fast_reverse('object_detail', **kwargs)
+    return fast_reverse('home_object_detail', **kwargs)
+
+
 def PublishableBox(publishable, box_type, nodelist, model=None):
     "add some content type info of self.target"
     if not model:
@@ -88,9 +198,24 @@ class Publishable(models.Model):
         return isinstance(other, Publishable) and self.pk == other.pk
 
     def get_absolute_url(self, domain=False):
-        " Get object's URL. "
+        """
+        Get object's URL. The URL is kept on the instance together with the
+        values it was computed from and only computed again once they change.
+        """
         category = self.category
+        state = (self.pk, self.slug, self.static, self.publish_from, category.pk, category.tree_path)
+        cached = self.__dict__.get('_url_cache')
+        if cached is not None and cached[0] == state:
+            url = cached[1]
+        else:
+            url = self._compute_url(category)
+            self._url_cache = (state, url)
+
+        if category.site_id != settings.SITE_ID or domain:
+            return 'http://' + category.site.domain + url
+        return url
 
+    def _compute_url(self, category):
         kwargs = {
             'slug': self.slug,
         }
@@ -99,29 +224,23 @@ class Publishable(models.Model):
             kwargs['id'] = self.pk
             if category.tree_parent_id:
                 kwargs['category'] = category.tree_path
-                url = reverse('static_detail', kwargs=kwargs)
-            else:
-                url = reverse('home_static_detail', kwargs=kwargs)
-        else:
-            publish_from = localize(self.publish_from)
-            kwargs.update({
-                    'year': publish_from.year,
-                    'month': publish_from.month,
-                    'day': publish_from.day,
-                })
-            if category.tree_parent_id:
-                kwargs['category'] = category.tree_path
-                url = reverse('object_detail', kwargs=kwargs)
-            else:
-                url = reverse('home_object_detail', kwargs=kwargs)
+                return fast_reverse('static_detail', **kwargs)
+            return fast_reverse('home_static_detail', **kwargs)
 
-        if category.site_id != settings.SITE_ID or domain:
-            return 'http://' + category.site.domain + url
-        return url
+        return get_object_url(category.tree_path if category.tree_parent_id else '', self.slug, self.publish_from)
 
     def get_domain_url(self):
         return self.get_absolute_url(domain=True)
 
+    def get_authors(self):
+        """
+        Authors of the object, attached by ``PublishableManager.prefetch_authors``
+        when listed together with others or loaded the same way on first use.
+        """
+        if not hasattr(self, '_authors'):
+            Publishable.objects.prefetch_authors([self])
+        return self._authors
+
     def clean(self):
         if self.static or not self.published:
             return
@@ -145,32 +264,55 @@ class Publishable(models.Model):
         if qset:
             raise ValidationError(_('Another %s already published at this URL.') % self._meta.verbose_name)
 
+    def __init__(self, *args, **kwargs):
+        super(Publishable, self).__init__(*args, **kwargs)
+        self._snapshot_state()
+
+    def _snapshot_state(self):
+        " Remember the values ``save`` compares to detect URL and publication changes. "
+        try:
+            self._saved_state = dict((f, self.__dict__[f]) for f in TRACKED_FIELDS)
+        except KeyError:
+            # deferred field, let save fetch the old values
+            self._saved_state = None
+
+    def _get_old_self(self):
+        """
+        Return the instance as it was loaded or last saved. The values
+        snapshotted when the instance was loaded from the DB are used if
+        available, only instances not coming from the DB are fetched.
+        """
+        state = getattr(self, '_saved_state', None)
+        if state is not None and not self._state.adding:
+            old_self = copy(self)
+            old_self.__dict__.pop('_category_cache', None)
+            old_self.__dict__.update(state)
+            return old_self
+
+        try:
+            return self.__class__.objects.get(pk=self.pk)
+        except Publishable.DoesNotExist:
+            return None
+
     def save(self, **kwargs):
         # update the content_type if it isn't already set
         if not self.content_type_id:
             self.content_type = ContentType.objects.get_for_model(self)
         send_signal = None
         old_self = None
+        changed = True
         if self.pk:
-            try:
-                old_self = self.__class__.objects.get(pk=self.pk)
-            except Publishable.DoesNotExist:
-                pass
+            old_self = self._get_old_self()
 
         if old_self:
-            old_path = old_self.get_absolute_url()
-            new_path = self.get_absolute_url()
+            changed = [f for f in TRACKED_FIELDS if getattr(old_self, f) != getattr(self, f)]
 
             # detect change in URL and not a static one
-            if old_path != new_path and new_path and not old_self.static:
-                # and create a redirect
-                redirect = Redirect.objects.get_or_create(old_path=old_path,
-                    site=self.category.site)[0]
-                redirect.new_path = new_path
-                redirect.save(force_update=True)
-                # also update all potentially already existing redirects
-                Redirect.objects.filter(new_path=old_path).exclude(
-                    pk=redirect.pk).update(new_path=new_path)
+            if set(changed) & URL_FIELDS and not old_self.static:
+                old_path = old_self.get_absolute_url()
+                new_path = self.get_absolute_url()
+                if old_path != new_path and new_path:
+                    add_redirect(self.category.site_id, old_path, new_path)
 
             # detect change in publication status
             if old_self.is_published() != self.is_published():
@@ -205,12 +347,21 @@ class Publishable(models.Model):
 
         super(Publishable, self).save(**kwargs)
 
+        # refresh the URL, it may have been computed before the pk was known
+        self.__dict__.pop('_url_cache', None)
+        self.get_absolute_url()
+
+        if changed:
+            Publishable.objects.update_url_index(self, old_self)
+        self._snapshot_state()
+
         if send_signal:
-            send_signal.send(sender=self.__class__, publishable=self)
+            send_publish_signal(send_signal, self)
 
     def delete(self):
         url = self.get_absolute_url()
         Redirect.objects.filter(new_path=url).delete()
+        Publishable.objects.remove_from_url_index(self)
         if self.announced:
             content_unpublished.send(sender=self.__class__, publishable=self)
         return super(Publishable, self).delete()
@@ -1,4 +1,5 @@
 import logging
+from hashlib import md5
 
 from django import template
 from django.db import models
@@ -6,11 +7,14 @@ from django.utils.encoding import smart_str
 from django.utils.safestring import mark_safe
 from django.template.defaultfilters import stringfilter
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 
 from ella.core.models import Listing, Category
 from ella.core.managers import ListingHandler
-from ella.core.cache.utils import get_cached_object
+from ella.core.cache.utils import get_cached_object, _get_key, KEY_PREFIX
 from ella.core.box import Box
+from ella.core.conf import core_settings
+from ella.utils.lru import LRUCache
 
 
 log = logging.getLogger('ella.core.templatetags')
@@ -315,9 +319,35 @@ def _parse_box(nodelist, bits):
             pass
         return BoxNode(bits[1], nodelist, model=model, lookup=(smart_str(bits[5]), lookup_val))
 
+# compiled templates of the {% render %} tag keyed by hash of their source
+_compiled_templates = LRUCache(core_settings.RENDER_TEMPLATE_CACHE_SIZE)
+
+
 class RenderNode(template.Node):
-    def __init__(self, var):
+    def __init__(self, var, cached=False):
         self.var = template.Variable(var)
+        self.cached = cached
+
+    def get_template(self, text, text_hash):
+        t = _compiled_templates.get(text_hash)
+        if t is None:
+            t = template.Template(text, name='render-%s' % self.var)
+            _compiled_templates[text_hash] = t
+        return t
+
+    def get_cache_key(self, context, text_hash):
+        """
+        Key of the rendered output, contains the version of the object the
+        variable belongs to so that it changes when the object is saved.
+        ``None`` when the variable doesn't belong to a saved object, the
+        output may depend on anything in the context then.
+        """
+        obj = None
+        if self.var.lookups and len(self.var.lookups) > 1:
+            obj = context.get(self.var.lookups[0])
+        if isinstance(obj, models.Model) and obj.pk:
+            return 'ella.render:%s:%s' % (_get_key(KEY_PREFIX, ContentType.objects.get_for_model(obj), pk=obj.pk), text_hash)
+        return None
 
     def render(self, context):
         try:
@@ -325,20 +355,36 @@ class RenderNode(template.Node):
         except template.VariableDoesNotExist:
             return ''
 
-        template_name = 'render-%s' % self.var
-        return template.Template(text, name=template_name).render(context)
+        text_hash = md5(smart_str(text)).hexdigest()
+        key = self.get_cache_key(context, text_hash) if self.cached else None
+        if key is not None:
+            out = cache.get(key)
+            if out is None:
+                out = self.get_template(text, text_hash).render(context)
+                cache.set(key, out, core_settings.CACHE_TIMEOUT)
+            return out
+
+        return self.get_template(text, text_hash).render(context)
 
 @register.tag('render')
 def do_render(parser, token):
     """
     Renders a rich-text field using defined markup.
 
+    With ``cached`` the output is stored in the cache until the object owning
+    the variable is saved, use it only when the text doesn't depend on
+    the request. Variables not belonging to an object are never cached.
+
     Example::
 
         {% render some_var %}
+        {% render object.content cached %}
     """
     bits = token.split_contents()
 
+    if len(bits) == 3 and bits[2] == 'cached':
+        return RenderNode(bits[1], cached=True)
+
     if len(bits) != 2:
         raise template.TemplateSyntaxError()
 
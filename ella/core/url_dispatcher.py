@@ -0,0 +1,111 @@
+"""
+Resolving of ella's URL space without trying all the patterns of
+``ella.core.urls`` one by one. The path is looked at once to find out which
+kinds of URL it may be (dated, static, feed, export...) and only the
+patterns of those kinds are tried, in their original order, so the result is
+the same as if all of them were tried.
+"""
+import re
+
+from django.core.urlresolvers import RegexURLPattern
+
+STATIC_SEGMENT_RE = re.compile(r'\d+-')
+
+# kind of URL for each pattern name in ella.core.urls
+KINDS = {
+    'root_homepage': 'root',
+    'esi_box': 'esi',
+    'author_detail': 'author',
+    'named_export_xml': 'export',
+    'export': 'export',
+    'named_export': 'export',
+    'list_day': 'home_dated',
+    'list_month': 'home_dated',
+    'list_year': 'home_dated',
+    'home_object_detail': 'home_dated',
+    'home_object_detail_action': 'home_dated',
+    'object_detail': 'dated',
+    'object_detail_action': 'dated',
+    'category_list_day': 'dated',
+    'category_list_month': 'dated',
+    'category_list_year': 'dated',
+    'home_static_detail_action': 'home_static',
+    'home_static_detail': 'home_static',
+    'static_detail_action': 'static',
+    'static_detail': 'static',
+    'home_rss_feed': 'home_feed',
+    'home_atom_feed': 'home_feed',
+    'rss_feed': 'feed',
+    'atom_feed': 'feed',
+    'category_detail': 'category',
+}
+
+
+def classify(path, author):
+    """
+    Return kinds of URL ``path`` may be. Each kind is only ruled out when the
+    path lacks a segment all its patterns require.
+    """
+    if not path:
+        return frozenset(('root',))
+
+    segments = path.split('/')
+    kinds = set(('category',))
+
+    first = segments[0]
+    if first == 'esi':
+        kinds.add('esi')
+    elif first == author:
+        kinds.add('author')
+    elif first == 'export':
+        kinds.add('export')
+    elif first == 'feeds':
+        kinds.add('home_feed')
+
+    if len(first) == 4 and first.isdigit():
+        kinds.add('home_dated')
+    elif STATIC_SEGMENT_RE.match(first):
+        kinds.add('home_static')
+
+    for segment in segments[1:]:
+        if len(segment) == 4 and segment.isdigit():
+            kinds.add('dated')
+        elif STATIC_SEGMENT_RE.match(segment):
+            kinds.add('static')
+
+    if path.endswith('/feeds/') or path.endswith('/feeds/atom/'):
+        kinds.add('feed')
+
+    return frozenset(kinds)
+
+
+def _never(request):
+    raise AssertionError('URLDispatcher is never resolved to directly.')
+
+
+class URLDispatcher(RegexURLPattern):
+    """
+    Pattern put in front of ``patterns`` that resolves them by trying just
+    the ones matching the kind of the path. Patterns of unknown names are
+    always tried. When nothing matches, the resolver continues with the
+    following patterns as usual.
+    """
+    def __init__(self, patterns, author):
+        super(URLDispatcher, self).__init__(r'^$', _never)
+        self.patterns = list(patterns)
+        self.author = author
+        self._candidates = {}
+
+    def get_candidates(self, kinds):
+        try:
+            return self._candidates[kinds]
+        except KeyError:
+            candidates = [p for p in self.patterns if p.name not in KINDS or KINDS[p.name] in kinds]
+            self._candidates[kinds] = candidates
+            return candidates
+
+    def resolve(self, path):
+        for pattern in self.get_candidates(classify(path, self.author)):
+            match = pattern.resolve(path)
+            if match:
+                return match
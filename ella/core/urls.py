@@ -9,7 +9,7 @@ except ImportError:
     from django.conf.urls.defaults import patterns, include, url
 
 from ella.core.views import object_detail, list_content_type, category_detail, \
-                            home, AuthorView
+                            home, AuthorView, esi_box
 
 
 try:
@@ -25,6 +25,7 @@ except:
     pass
 
 from ella.core.feeds import RSSTopCategoryListings, AtomTopCategoryListings
+from ella.core.url_dispatcher import URLDispatcher
 
 
 res = {
@@ -43,6 +44,9 @@ urlpatterns = patterns('',
     # home page
     url(r'^$', home, name="root_homepage"),
 
+    # ESI fragments
+    url(r'^esi/box/(?P<content_type_id>\d+)/(?P<pk>\d+)/(?P<box_type>[^/]+)/$', esi_box, name='esi_box'),
+
     # author detail
     url(r'^%(author)s/%(slug)s/$' % res, AuthorView.as_view(), name='author_detail'),
 
@@ -87,3 +91,6 @@ urlpatterns = patterns('',
     url(r'^%(cat)s/$' % res, category_detail, name="category_detail"),
 
 )
+
+# resolve the patterns above without trying them one by one
+urlpatterns.insert(0, URLDispatcher(urlpatterns, res['author']))
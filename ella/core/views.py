@@ -1,26 +1,35 @@
 from datetime import datetime, timedelta
+from hashlib import md5
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.http import Http404
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.shortcuts import redirect, render
+from django.template import RequestContext, NodeList, TextNode
 from django.template.defaultfilters import slugify
 from django.template.response import TemplateResponse
-from django.utils.translation import ugettext_lazy as _
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+from django.utils.encoding import force_unicode
+from django.utils.translation import ugettext_lazy as _, get_language
 from django.views.generic.list import ListView
 
+from ella.core.box import Box
+from ella.core.esi import check_signature
 from ella.core.models import Listing, Category, Publishable, Author
 from ella.core.cache import get_cached_object_or_404, cache_this, get_cached_object
+from ella.core.cache.utils import get_version_key
 from ella.core import custom_urls
 from ella.core.conf import core_settings
+from ella.core.middleware import GZIP_ETAG_SUFFIX
 from ella.core.signals import object_rendering, object_rendered
 from ella.api import render_as_api
-from ella.utils.timezone import now, localize
+from ella.utils.timezone import now, localize, to_timestamp
 
 __docformat__ = "restructuredtext en"
 
-# local cache for get_content_type()
+# local cache for get_content_type(), language -> {slug: model}
 CONTENT_TYPE_MAPPING = {}
 
 
@@ -99,6 +108,39 @@ class EllaCoreView(object):
     def render(self, request, context, template):
         return TemplateResponse(request, template, context)
 
+    def get_validators(self, request, context):
+        """
+        Return ``(etag, last_modified)`` of the page described by ``context``,
+        either can be ``None``. Only used with ``CONDITIONAL_GET`` enabled.
+        """
+        return None, None
+
+    def render_conditional(self, request, context, template):
+        """
+        Render the page unless the client already has it, as told by the
+        validators from ``get_validators``, in which case ``304 Not Modified``
+        is returned without rendering the template.
+        """
+        if not core_settings.CONDITIONAL_GET or request.method not in ('GET', 'HEAD'):
+            return self.render(request, context, template)
+
+        etag, last_modified = self.get_validators(request, context)
+        if etag is not None:
+            etag = quote_etag(etag)
+        if last_modified is not None:
+            last_modified = http_date(to_timestamp(last_modified))
+
+        if is_not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = self.render(request, context, template)
+
+        if etag is not None:
+            response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = last_modified
+        return response
+
     def __call__(self, request, **kwargs):
         context = self.get_context(request, **kwargs)
         return self.render(request, context, self.get_templates(context))
@@ -163,7 +205,15 @@ class ObjectDetail(EllaCoreView):
 
         object_rendered.send(sender=context['object'].__class__, request=request, category=context['category'], publishable=context['object'])
 
-        return self.render(request, context, self.get_templates(context))
+        return self.render_conditional(request, context, self.get_templates(context))
+
+    def get_validators(self, request, context):
+        " Publishable changes either by editor touching ``last_updated`` or by bumping its cache version. "
+        obj = context['object']
+        etag = md5('%s:%s:%s:%s' % (
+            obj.content_type_id, obj.pk, to_timestamp(obj.last_updated), cache.get(get_version_key(obj))
+        )).hexdigest()
+        return etag, obj.last_updated
 
     def get_context(self, request, category, slug, year, month, day, id):
         try:
@@ -176,22 +226,20 @@ class ObjectDetail(EllaCoreView):
                 cat = None
 
         if year:
-            start_date = localize(datetime(int(year), int(month), int(day)))
-            end_date = start_date + timedelta(days=1)
-
-            lookup = {
-                'publish_from__gte': start_date,
-                'publish_from__lt': end_date,
-                'category': cat,
-                'slug': slug,
-                'static': False
-            }
             try:
-                publishable = get_cached_object(Publishable, published=True, **lookup)
+                publishable = Publishable.objects.get_by_url(cat, int(year), int(month), int(day), slug)
             except Publishable.DoesNotExist:
                 # Fallback for staff members in case there are multiple
                 # objects with same URL.
                 if request.user.is_staff:
+                    start_date = localize(datetime(int(year), int(month), int(day)))
+                    lookup = {
+                        'publish_from__gte': start_date,
+                        'publish_from__lt': start_date + timedelta(days=1),
+                        'category': cat,
+                        'slug': slug,
+                        'static': False
+                    }
                     try:
                         # Make sure we return specific publishable subclass
                         # like when using `get_cached_object` if possible.
@@ -315,7 +363,29 @@ class ListContentType(EllaCoreView):
         if archive_template and not context.get('is_title_page'):
             template_name = archive_template
 
-        return self.render(request, context, self.get_templates(context, template_name))
+        return self.render_conditional(request, context, self.get_templates(context, template_name))
+
+    def get_validators(self, request, context):
+        """
+        Category page changes when the category's cache version gets bumped,
+        which happens whenever anything gets published in it, or when any of
+        the listed objects changes. The newest listing is the last modification.
+        """
+        cat = context['category']
+        listings = context.get('listings', ())
+        keys = [get_version_key(l.publishable) for l in listings]
+        cat_key = get_version_key(cat)
+        versions = cache.get_many(keys + [cat_key])
+
+        parts = [request.get_full_path(), versions.get(cat_key)]
+        last_modified = None
+        for l, key in zip(listings, keys):
+            p = l.publishable
+            parts.append('%s:%s:%s' % (p.pk, to_timestamp(p.last_updated), versions.get(key)))
+            updated = max(p.last_updated, l.publish_from or p.publish_from)
+            if last_modified is None or updated > last_modified:
+                last_modified = updated
+        return md5(':'.join(map(str, parts))).hexdigest(), last_modified
 
     @cache_this(archive_year_cache_key, timeout=60 * 60 * 24)
     def _archive_entry_year(self, category):
@@ -415,6 +485,27 @@ class ListContentType(EllaCoreView):
 
         return context
 
+def is_not_modified(request, etag, last_modified):
+    """
+    Check the conditional headers of ``request`` against the quoted ``etag``
+    and ``last_modified`` formatted as HTTP date. ``If-None-Match`` takes
+    precedence over ``If-Modified-Since`` as the ETag is more precise.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        if etag is None:
+            return False
+        etags = parse_etags(if_none_match)
+        etag = etag.strip('"')
+        # the gzipped variant served from the page cache counts too
+        return '*' in etags or etag in etags or etag + GZIP_ETAG_SUFFIX in etags
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since is None or last_modified is None:
+        return False
+    return parse_http_date_safe(last_modified) <= if_modified_since
+
+
 # backwards compatibility
 object_detail = ObjectDetail()
 home = category_detail = list_content_type = ListContentType()
@@ -424,7 +515,8 @@ def get_content_type(ct_name):
     """
     A helper function that returns ContentType object based on its slugified verbose_name_plural.
 
-    Results of this function is cached to improve performance.
+    The mapping of all the names is built once per language, names of no
+    model are recognized without any lookup.
 
     :Parameters:
         - `ct_name`:  Slugified verbose_name_plural of the target model.
@@ -432,19 +524,28 @@ def get_content_type(ct_name):
     :Exceptions:
         - `Http404`: if no matching ContentType is found
     """
+    mapping = CONTENT_TYPE_MAPPING.get(get_language())
+    if mapping is None:
+        mapping = _build_content_type_mapping()
     try:
-        ct = CONTENT_TYPE_MAPPING[ct_name]
+        model = mapping[ct_name]
     except KeyError:
-        for model in models.get_models():
-            if ct_name == slugify(model._meta.verbose_name_plural):
-                ct = ContentType.objects.get_for_model(model)
-                CONTENT_TYPE_MAPPING[ct_name] = ct
-                break
-        else:
-            raise Http404
-    return ct
+        raise Http404
+    return ContentType.objects.get_for_model(model)
 
 
+def _build_content_type_mapping():
+    """
+    Map slugified verbose_name_plural of all models to the models at once so
+    that unknown names are recognized without going through them again. Kept
+    for each language as the names are translated.
+    """
+    mapping = {}
+    for model in models.get_models():
+        mapping.setdefault(slugify(force_unicode(model._meta.verbose_name_plural)), model)
+    CONTENT_TYPE_MAPPING[get_language()] = mapping
+    return mapping
+
 
 def get_templates(name, slug=None, category=None, app_label=None, model_label=None):
     """
@@ -562,6 +663,43 @@ def export(request, count, name='', content_type=None):
         )
 
 
+def esi_box(request, content_type_id, pk, box_type):
+    """
+    Render a box as ESI fragment, the ``Surrogate-Control`` header tells the
+    proxy how long it can keep it. Only published objects are rendered and
+    only for URLs signed by ``Box.esi_render``.
+
+    :Parameters:
+        - `content_type_id`, `pk`: identify the object in the box
+        - `box_type`: type of the box
+        - `params` (GET): parameters of the box as they were in its tag
+        - `sig` (GET): signature of all the above
+    """
+    params = request.GET.get('params', '')
+    if not check_signature(request.GET.get('sig', ''), content_type_id, pk, box_type, params):
+        raise Http404()
+
+    try:
+        ct = ContentType.objects.get_for_id(content_type_id)
+    except ContentType.DoesNotExist:
+        raise Http404()
+    model = ct.model_class()
+    if model is None or not issubclass(model, Publishable):
+        raise Http404()
+    obj = get_cached_object_or_404(ct, pk=pk)
+    if not obj.is_published():
+        raise Http404()
+
+    box = getattr(obj, 'box_class', Box)(obj, box_type, NodeList([TextNode(params)]))
+    response = HttpResponse(box.render(RequestContext(request, {'ESI_RENDER': True})))
+
+    timeout = box.get_esi_timeout()
+    if timeout is None:
+        timeout = core_settings.ESI_TIMEOUT
+    response['Surrogate-Control'] = 'max-age=%d' % timeout
+    return response
+
+
 ##
 # Error handlers
 ##
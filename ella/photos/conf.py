@@ -27,8 +27,18 @@ PHOTO_MIN_HEIGHT = 150
 
 DEFAULT_BG_COLOR = 'black'
 
+# JPEG images are decoded at reduced size (1/2, 1/4 or 1/8) when that still
+# leaves this many times more pixels than the format needs, None to disable
+DRAFT_OVERSAMPLING = 2
+
 FORMATED_PHOTO_FILENAME = None
 
+# expiry (in seconds) of photo info stored in PHOTOS_REDIS, None to keep forever
+REDIS_TTL = None
+
+# seconds between checks whether formats were changed by another process
+FORMAT_VERSION_CHECK_INTERVAL = 10
+
 DEBUG = False
 DEBUG_PLACEHOLDER_PROVIDER_TEMPLATE = 'http://placehold.it/%(width)sx%(height)s'
 
@@ -1,15 +1,27 @@
+from math import ceil
+
 from PIL import Image, ExifTags
 
 from ella.photos.conf import photos_settings
 
 TAGS = dict((b,a) for a,b in ExifTags.TAGS.items())
 
+# EXIF orientation -> rotation
+EXIF_ROTATIONS = {
+    6: -90,
+    3: -180,
+    8: -270,
+}
+
 class Formatter(object):
-    def __init__(self, image, format, crop_box=None, important_box=None):
+    def __init__(self, image, format, crop_box=None, important_box=None, scale=1.0):
         self.image = image
         self.fmt = format
         self.crop_box = crop_box
         self.important_box = important_box
+        # size of the supplied image relative to the original photo, crop_box
+        # and important_box are always in the original's coordinates
+        self.scale = scale
 
         # precompute and store a bunch of numbers
         f = format
@@ -24,12 +36,68 @@ class Formatter(object):
         Crop and resize the supplied image. Return the image and the crop_box used.
         If the input format is JPEG and in EXIF there is information about rotation, use it and rotate resulting image.
         """
+        self.draft()
         if hasattr(self.image, '_getexif'):
             self.rotate_exif()
         crop_box = self.crop_to_ratio()
         self.resize()
         return self.image, crop_box
 
+    def get_image_size(self):
+        " Return size of the image in the coordinates of the original photo. "
+        iw, ih = self.image.size
+        if self.scale == 1:
+            return iw, ih
+        return int(round(iw / self.scale)), int(round(ih / self.scale))
+
+    def scale_box(self, box):
+        " Convert box from the original photo's coordinates to the image's. "
+        if self.scale == 1:
+            return box
+        return tuple(int(round(c * self.scale)) for c in box)
+
+    def get_target_scale(self):
+        """
+        Return the ratio between the size of the formatted image and the part
+        of the original photo it will be generated from. Errs on the larger
+        side since the exact crop isn't known before the image is rotated.
+        """
+        f = self.fmt
+        fh = self.fh
+        if f.flexible_height and f.flexible_max_height:
+            fh = max(fh, f.flexible_max_height)
+
+        if self.crop_box:
+            cw = self.crop_box[2] - self.crop_box[0]
+            ch = self.crop_box[3] - self.crop_box[1]
+        else:
+            cw, ch = self.get_image_size()
+            if self.get_exif_rotation() in (-90, -270):
+                cw, ch = ch, cw
+
+        if cw <= 0 or ch <= 0:
+            return 1.0
+        return max(float(self.fw) / cw, float(fh) / ch)
+
+    def draft(self):
+        """
+        If the target format is much smaller than the image, let the JPEG
+        decoder scale the image down (by 1/2, 1/4 or 1/8) while loading it,
+        which is a lot cheaper than decoding it whole and resizing it after.
+        Has no effect on images that are already loaded.
+        """
+        oversampling = photos_settings.DRAFT_OVERSAMPLING
+        if not oversampling or getattr(self.image, 'format', None) != 'JPEG':
+            return
+
+        target = self.get_target_scale() * oversampling
+        if target >= 0.5:
+            return
+
+        iw, ih = self.image.size
+        self.image.draft(self.image.mode, (int(ceil(iw * target)), int(ceil(ih * target))))
+        self.scale *= float(self.image.size[0]) / iw
+
     def set_format(self):
         """
         Check if the format has a flexible height, if so check if the ratio
@@ -68,7 +136,7 @@ class Formatter(object):
             # crop coordinates passed in explicitely
             return self.crop_box
 
-        iw, ih = self.image.size
+        iw, ih = self.get_image_size()
 
         if iw <= self.fw and ih <= self.fh:
             # image fits in the target format, no need to crop
@@ -98,7 +166,7 @@ class Formatter(object):
         # shortcuts
         ib = self.important_box
         cl, ct, cr, cb = crop_box
-        iw, ih = self.image.size
+        iw, ih = self.get_image_size()
 
         # compute the move of crop center onto important center
         move_horiz = (ib[0] + ib[2]) // 2 - (cl + cr) // 2
@@ -130,26 +198,30 @@ class Formatter(object):
 
         crop_box = self.center_important_part(crop_box)
 
-        iw, ih = self.image.size
+        iw, ih = self.get_image_size()
         # see if we want to crop something from outside of the image
         out_of_photo = min(crop_box[0], crop_box[1]) < 0 or crop_box[2] > iw or crop_box[3] > ih
         # check whether there's transparent information in the image
         transparent = self.image.mode in ('RGBA', 'LA')
 
+        # the actual cropping happens in the image's coordinates
+        box = self.scale_box(crop_box)
+
         if photos_settings.DEFAULT_BG_COLOR != 'black' and out_of_photo and not transparent:
             # if we do, just crop the image to the portion that will be visible
+            iw, ih = self.image.size
             updated_crop_box = (
-                max(0, crop_box[0]), max(0, crop_box[1]), min(iw, crop_box[2]), min(ih, crop_box[3]),
+                max(0, box[0]), max(0, box[1]), min(iw, box[2]), min(ih, box[3]),
             )
             cropped = self.image.crop(updated_crop_box)
 
             # create new image of the proper size and color
-            self.image = Image.new('RGB', (crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]), photos_settings.DEFAULT_BG_COLOR)
+            self.image = Image.new('RGB', (box[2] - box[0], box[3] - box[1]), photos_settings.DEFAULT_BG_COLOR)
             # and paste the cropped part into it's proper position
-            self.image.paste(cropped, (abs(min(crop_box[0], 0)), abs(min(crop_box[1], 0))))
+            self.image.paste(cropped, (abs(min(box[0], 0)), abs(min(box[1], 0))))
         else:
             # crop normally if not the case
-            self.image = self.image.crop(crop_box)
+            self.image = self.image.crop(box)
         return crop_box
 
     def get_resized_size(self):
@@ -188,21 +260,20 @@ class Formatter(object):
 
         self.image = self.image.resize(resized_size, Image.ANTIALIAS)
 
+    def get_exif_rotation(self):
+        " Return the rotation (in degrees) requested by image's EXIF, 0 for none. "
+        if not hasattr(self.image, '_getexif'):
+            return 0
+        exif = self.image._getexif() or {}
+        return EXIF_ROTATIONS.get(exif.get(TAGS['Orientation'], 1), 0)
+
     def rotate_exif(self):
         """
         Rotate image via exif information.
         Only 90, 180 and 270 rotations are supported.
         """
-        exif = self.image._getexif() or {}
-        rotation = exif.get(TAGS['Orientation'], 1)
-
-        rotations = {
-            6: -90,
-            3: -180,
-            8: -270,
-        }
-        if rotation not in rotations:
+        rotation = self.get_exif_rotation()
+        if not rotation:
             return
 
-        self.image = self.image.rotate(rotations[rotation])
-
+        self.image = self.image.rotate(rotation)
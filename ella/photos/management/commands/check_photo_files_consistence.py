@@ -1,11 +1,60 @@
 import re
 import os
 import sys
+import time
+import heapq
+from tempfile import TemporaryFile
+from multiprocessing.pool import ThreadPool
 from optparse import make_option
 from django.core.management.base import BaseCommand
+from django.utils.encoding import force_unicode
 from ella.photos.conf import photos_settings
 
 
+def sorted_on_disk(iterable, chunk_size):
+    """
+    Sort strings from ``iterable`` keeping at most ``chunk_size`` of them in
+    memory - sorted runs are stored in temporary files and merged lazily.
+    """
+    runs = []
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            runs.append(_write_run(chunk))
+            chunk = []
+
+    if not runs:
+        return iter(sorted(chunk))
+
+    if chunk:
+        runs.append(_write_run(chunk))
+    return heapq.merge(*[_read_run(f) for f in runs])
+
+
+def _write_run(chunk):
+    f = TemporaryFile()
+    for item in sorted(chunk):
+        f.write(item.encode('utf-8') + '\n')
+    f.seek(0)
+    return f
+
+
+def _read_run(f):
+    for line in f:
+        yield line[:-1].decode('utf-8')
+    f.close()
+
+
+def unique(iterable):
+    " Skip consecutive duplicates in a sorted iterable. "
+    last = None
+    for item in iterable:
+        if item != last:
+            yield item
+            last = item
+
+
 class Command(BaseCommand):
 
     help = 'Check consistence between database records and coresponding image files'
@@ -21,6 +70,8 @@ class Command(BaseCommand):
     all = False
     extensions = None
     extensions_ic = True
+    threads = 8
+    chunk_size = 100000
 
     option_list = BaseCommand.option_list + (
         make_option('--delete',
@@ -41,6 +92,16 @@ class Command(BaseCommand):
             dest='extensions_ic',
             default=extensions_ic,
             help='Case sensitive comparation of extensions'),
+        make_option('--threads',
+            dest='threads',
+            type='int',
+            default=threads,
+            help='Number of threads listing directories in parallel'),
+        make_option('--chunk-size',
+            dest='chunk_size',
+            type='int',
+            default=chunk_size,
+            help='Number of paths kept in memory, larger sets are sorted on disk'),
         )
 
     def process_options(self, options):
@@ -49,6 +110,8 @@ class Command(BaseCommand):
         self.all = bool(options['all'])
         self.extensions = options['extensions'] and options['extensions'].split(',')
         self.extensions_ic = options['extensions_ic']
+        self.threads = max(1, int(options.get('threads') or 1))
+        self.chunk_size = max(1, int(options.get('chunk_size') or self.chunk_size))
 
     def print_message(self, message, level, fd=None):
         if level <= self.verbosity:
@@ -75,6 +138,11 @@ class Command(BaseCommand):
     def print_debug(self, message):
         self.print_message(message, self.VERBOSITY_DEBUG)
 
+    def print_throughput(self, what, count, start):
+        duration = time.time() - start
+        self.print_stat("%s: %d in %.1fs (%.0f/s)"
+                % (what, count, duration, count / max(duration, 0.001)))
+
     def handle(self, *args, **options):
 
         self.process_options(options)
@@ -96,66 +164,128 @@ class Command(BaseCommand):
                 '(%s)$' % ('|'.join([re.escape(ex) for ex in extensions])),
                 self.extensions_ic and re.IGNORECASE or 0)
 
-        # breadth-first search
-        files = []
-        nodes = [subdir]
-        while nodes:
-            current = nodes.pop()
-            self.print_debug("Entering directory '%s'" % current)
-            current_dirs, current_files = storage.listdir(current)
-
-            if not (current_dirs or current_files):
-                self.print_info("Directory '%s' is empty" % current)
-            else:
-                nodes += [
-                        '%s%s%s' % (current, os.sep, directory)
-                        for directory in current_dirs]
-
-                for current_file in current_files:
-                    f = '%s%s%s' % (current, os.sep, current_file)
-                    is_image = bool(photo_extension_re.search(current_file))
-                    if not is_image:
-                        self.print_info("File '%s' is not image" % f)
-                    if is_image or self.all:
-                        files.append(f)
-                        self.print_debug("Appending file '%s'" % f)
+        self.counts = {'disk': 0, 'db': 0}
 
-            self.print_debug("Leaving directory '%s'" % current)
+        start = time.time()
+        photo_files = unique(sorted_on_disk(self.list_files(storage, subdir, photo_extension_re), self.chunk_size))
+        db_files = unique(sorted_on_disk(self.list_db_files(), self.chunk_size))
 
-        photo_files_set = set(files)
-        db_files_set = set([photo.image.url for photo in Photo.objects.all()])
-        self.print_summarization(photo_files_set, db_files_set)
+        to_delete = self.compare(photo_files, db_files)
+        self.print_throughput('Files compared', self.counts['disk'] + self.counts['db'], start)
 
         if self.delete:
-            self.delete_files(storage, photo_files_set -db_files_set)
-
-    def print_summarization(self, photo_files_set, db_files_set):
+            self.delete_files(storage, to_delete)
+
+    def list_files(self, storage, subdir, photo_extension_re):
+        " Walk the storage listing directories in parallel, yield paths of the files. "
+        start = time.time()
+        count = 0
+        pool = ThreadPool(self.threads)
+        try:
+            nodes = [subdir]
+            while nodes:
+                current_nodes, nodes = nodes, []
+                for current, (current_dirs, current_files) in zip(current_nodes, pool.imap(storage.listdir, current_nodes)):
+                    self.print_debug("Entering directory '%s'" % current)
+
+                    if not (current_dirs or current_files):
+                        self.print_info("Directory '%s' is empty" % current)
+                    else:
+                        nodes += [
+                                '%s/%s' % (current, force_unicode(directory))
+                                for directory in current_dirs]
+
+                        for current_file in current_files:
+                            f = '%s/%s' % (current, force_unicode(current_file))
+                            is_image = bool(photo_extension_re.search(current_file))
+                            if not is_image:
+                                self.print_info("File '%s' is not image" % f)
+                            if is_image or self.all:
+                                count += 1
+                                self.print_debug("Appending file '%s'" % f)
+                                yield f
+
+                    self.print_debug("Leaving directory '%s'" % current)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.print_throughput('Files listed on disk', count, start)
+
+    def list_db_files(self):
+        " Stream names of all the photo and formatted photo files from the database in chunks. "
+        from ella.photos.models import Photo, FormatedPhoto
+
+        start = time.time()
+        count = 0
+        for model in (Photo, FormatedPhoto):
+            last_pk = 0
+            while True:
+                rows = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'image')[:self.chunk_size])
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                for pk, name in rows:
+                    if name:
+                        count += 1
+                        yield force_unicode(name)
+
+        self.print_throughput('Files listed in database', count, start)
+
+    def compare(self, photo_files, db_files):
+        """
+        Merge the two sorted streams, report the differences and return a
+        temporary file with paths of files only on disk.
+        """
+        only_on_disk = TemporaryFile()
+        only_in_database_count = only_on_disk_count = paired_count = 0
+
+        self.print_info("Files only in database (all extensions) and only on disk (selected extensions):")
+        disk_file = next(photo_files, None)
+        db_file = next(db_files, None)
+        while disk_file is not None or db_file is not None:
+            if disk_file is not None and (db_file is None or disk_file < db_file):
+                self.counts['disk'] += 1
+                only_on_disk_count += 1
+                self.print_info("Only on disk: '%s'" % disk_file)
+                only_on_disk.write(disk_file.encode('utf-8') + '\n')
+                disk_file = next(photo_files, None)
+            elif disk_file is None or db_file < disk_file:
+                self.counts['db'] += 1
+                only_in_database_count += 1
+                self.print_info("Only in database: '%s'" % db_file)
+                db_file = next(db_files, None)
+            else:
+                self.counts['disk'] += 1
+                self.counts['db'] += 1
+                paired_count += 1
+                disk_file = next(photo_files, None)
+                db_file = next(db_files, None)
 
         self.print_stat("Count of files on disk (selected extensions): %d"
-                % len(photo_files_set))
+                % self.counts['disk'])
 
         self.print_stat("Count of files in database (all extensions): %d"
-                % len(db_files_set))
+                % self.counts['db'])
 
-        only_in_database = db_files_set -photo_files_set
-        self.print_info("Files only in database (all extensions):")
-        self.print_info(only_in_database)
         self.print_stat("Count of files only in database (all extensions): %d"
-                % len(only_in_database))
+                % only_in_database_count)
 
-        only_on_disk = photo_files_set -db_files_set
-        self.print_info("Files only on disk (selected extensions):")
-        self.print_info(only_on_disk)
         self.print_stat("Count of files only on disk (selected extensions): %d"
-                % len(only_on_disk))
+                % only_on_disk_count)
 
         self.print_stat("Count of paired files (selected extensions): %d"
-                % len(photo_files_set & db_files_set))
+                % paired_count)
 
+        only_on_disk.seek(0)
+        return only_on_disk
 
     def delete_files(self, storage, to_delete):
-            for f in to_delete:
+            count = 0
+            for line in to_delete:
+                f = line[:-1].decode('utf-8')
                 self.print_info("Delete file '%s'" % f)
                 storage.delete(f)
-            self.print_stat("%d files are deleted" % len(to_delete))
-
+                count += 1
+            to_delete.close()
+            self.print_stat("%d files are deleted" % count)
@@ -0,0 +1,96 @@
+import sys
+import time
+from datetime import timedelta
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ella.photos.models import Photo, Format, generate_all_formats
+from ella.utils.timezone import now
+
+
+def generate_formats(args):
+    """
+    Generate missing formats for one photo. Runs in the worker processes so
+    it has to be a module-level function and must never raise.
+    """
+    photo_id, format_ids, threads = args
+    try:
+        photo = Photo.objects.get(pk=photo_id)
+        formats = list(Format.objects.filter(pk__in=format_ids))
+        return photo_id, len(generate_all_formats(photo, formats, threads=threads)), None
+    except Exception, e:
+        return photo_id, 0, '%s: %s' % (e.__class__.__name__, e)
+
+
+class Command(BaseCommand):
+
+    help = 'Pre-generate formatted photos for all formats of the current site for recently uploaded photos'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--days',
+            dest='days',
+            type='int',
+            default=7,
+            help='Process photos uploaded in the last DAYS days, 0 for all photos'),
+        make_option('--formats',
+            dest='formats',
+            default=None,
+            help='Specify comma separated names of formats, all formats of the current site by default'),
+        make_option('--processes',
+            dest='processes',
+            type='int',
+            default=4,
+            help='Number of worker processes'),
+        make_option('--threads',
+            dest='threads',
+            type='int',
+            default=1,
+            help='Number of threads writing the files of a single photo'),
+        )
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+
+        formats = Format.objects.filter(sites=settings.SITE_ID)
+        if options['formats']:
+            formats = formats.filter(name__in=options['formats'].split(','))
+        format_ids = list(formats.values_list('pk', flat=True))
+
+        photos = Photo.objects.order_by('-created')
+        if options['days']:
+            photos = photos.filter(created__gte=now() - timedelta(days=options['days']))
+        tasks = [(pk, format_ids, options['threads']) for pk in photos.values_list('pk', flat=True)]
+
+        if verbosity:
+            print 'Generating %d formats for %d photos' % (len(format_ids), len(tasks))
+
+        start = time.time()
+        if options['processes'] > 1 and len(tasks) > 1:
+            # don't share the database connection with the workers
+            connection.close()
+            pool = Pool(options['processes'])
+            results = pool.imap_unordered(generate_formats, tasks)
+        else:
+            pool = None
+            results = (generate_formats(t) for t in tasks)
+
+        generated = errors = 0
+        try:
+            for photo_id, count, error in results:
+                generated += count
+                if error:
+                    errors += 1
+                    print >> sys.stderr, 'Photo %s failed with %s' % (photo_id, error)
+                elif verbosity > 1:
+                    print 'Photo %s: %d formats generated' % (photo_id, count)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if verbosity:
+            print '%d formatted photos generated in %.1fs, %d photos failed' % (generated, time.time() - start, errors)
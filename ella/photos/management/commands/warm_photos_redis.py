@@ -0,0 +1,79 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ella.photos.models import Photo, FormatedPhoto, redis, store_image_info, \
+    REDIS_PHOTO_KEY, REDIS_FORMATTED_PHOTO_KEY
+
+
+class Command(BaseCommand):
+
+    help = 'Store information about all photos and formatted photos in PHOTOS_REDIS'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',
+            dest='batch_size',
+            type='int',
+            default=1000,
+            help='Number of rows read from the database and sent to redis at once'),
+        make_option('--ttl',
+            dest='ttl',
+            type='int',
+            default=None,
+            help='Expiry of the stored keys in seconds, PHOTOS_REDIS_TTL by default'),
+        )
+
+    def handle(self, *args, **options):
+        if not redis:
+            raise CommandError('PHOTOS_REDIS is not configured.')
+
+        self.verbosity = int(options['verbosity'])
+        self.batch_size = max(1, options['batch_size'])
+        self.ttl = options['ttl']
+
+        try:
+            # longer values make redis store the hash as a hashtable, not a compact ziplist
+            self.ziplist_value = int(redis.config_get('hash-max-ziplist-value')['hash-max-ziplist-value'])
+        except Exception:
+            self.ziplist_value = None
+
+        self.warm(Photo, (), lambda row: REDIS_PHOTO_KEY % row[0])
+        self.warm(FormatedPhoto, ('photo', 'format'), lambda row: REDIS_FORMATTED_PHOTO_KEY % row[4:6])
+
+    def warm(self, model, key_fields, get_key):
+        """
+        Store the image info of all instances of ``model`` read as plain rows
+        of ``(pk, image, width, height) + key_fields``, ``get_key`` turns a
+        row into the redis key.
+        """
+        storage = model._meta.get_field('image').storage
+        fields = ('pk', 'image', 'width', 'height') + key_fields
+        start = time.time()
+        stored = oversized = 0
+        last_pk = 0
+        while True:
+            rows = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list(*fields)[:self.batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+
+            p = redis.pipeline(transaction=False)
+            for row in rows:
+                pk, image, width, height = row[:4]
+                if not image:
+                    continue
+                info = {'url': storage.url(image), 'width': width, 'height': height}
+                if self.ziplist_value and max(len(str(v)) for v in info.itervalues()) > self.ziplist_value:
+                    oversized += 1
+                store_image_info(p, get_key(row), info, self.ttl)
+                stored += 1
+            p.execute()
+
+        if self.verbosity:
+            duration = time.time() - start
+            print '%s: %d keys stored in %.1fs (%.0f/s)' % (
+                model._meta.verbose_name_plural, stored, duration, stored / max(duration, 0.001))
+            if oversized:
+                print '%d of them have values longer than hash-max-ziplist-value (%d) and take more memory' % (
+                    oversized, self.ziplist_value)
@@ -1,9 +1,12 @@
 import logging
+from multiprocessing.pool import ThreadPool
 from PIL import Image
 from os import path
 from cStringIO import StringIO
 import os.path
 import string
+import warnings
+from time import time
 
 from django.db import models
 from django.db.models import signals
@@ -12,12 +15,13 @@ from django.utils.encoding import force_unicode, smart_str
 from django.contrib.sites.models import Site
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.core.cache import cache
 from django.template.defaultfilters import slugify
 
 from app_data import AppDataField
 
 from ella.core.models.main import Author, Source
-from ella.core.cache.utils import get_cached_object
+from ella.core.cache.utils import get_cached_object, get_cached_objects, NONE
 from ella.photos.conf import photos_settings
 from ella.utils.timezone import now
 
@@ -41,6 +45,18 @@ if hasattr(settings, 'PHOTOS_REDIS'):
         redis = Redis(**getattr(settings, 'PHOTOS_REDIS'))
 
 
+def store_image_info(pipe, key, info, ttl=None):
+    """
+    Add commands storing ``info`` under ``key`` to redis pipeline ``pipe``.
+    ``ttl`` defaults to ``PHOTOS_REDIS_TTL``.
+    """
+    if ttl is None:
+        ttl = photos_settings.REDIS_TTL
+    pipe.hmset(key, info)
+    if ttl:
+        pipe.expire(key, ttl)
+
+
 def upload_to(instance, filename):
     name, ext = os.path.splitext(filename)
     if instance.slug:
@@ -107,6 +123,19 @@ class Photo(models.Model):
             self._pil_image = Image.open(self.image)
         return self._pil_image
 
+    def _get_important_box(self):
+        if self.important_top is None:
+            return None
+        return (self.important_left, self.important_top, self.important_right, self.important_bottom)
+
+    def _open_image(self):
+        """
+        Open the original image independently of ``_get_image`` so that it
+        can be decoded at a reduced size without affecting other formats.
+        """
+        self.image.open()
+        return Image.open(self.image)
+
     def save(self, **kwargs):
         """Overrides models.Model.save.
 
@@ -163,16 +192,78 @@ class Photo(models.Model):
         return FormatedPhoto.objects.get_photo_in_format(self, format)
 
 
-FORMAT_CACHE = {}
+FORMATS_VERSION_KEY = 'ella.photos.formats:VER'
+
+
+class DeprecatedFormatCache(object):
+    """
+    Stand-in for the former module level ``FORMAT_CACHE`` dict of formats of
+    the current site keyed by name. Use ``Format.objects.get_for_name``.
+    """
+    def _get_formats(self):
+        warnings.warn('FORMAT_CACHE is deprecated, use Format.objects.get_for_name().',
+            DeprecationWarning, stacklevel=3)
+        return Format.objects.get_for_site(settings.SITE_ID)
+
+    def __getitem__(self, name):
+        return self._get_formats()[name]
+
+    def __setitem__(self, name, format):
+        self._get_formats()[name] = format
+
+    def __contains__(self, name):
+        return name in self._get_formats()
+
+    def get(self, name, default=None):
+        return self._get_formats().get(name, default)
+
+    def clear(self):
+        warnings.warn('FORMAT_CACHE is deprecated, use Format.objects.clear_cache().',
+            DeprecationWarning, stacklevel=2)
+        Format.objects.clear_cache()
+
+FORMAT_CACHE = DeprecatedFormatCache()
 
 
 class FormatManager(models.Manager):
+    """
+    All formats of a site are loaded in one query and kept in the process.
+    Saving or deleting a format bumps a version stored in the cache which the
+    other processes check at most every ``PHOTOS_FORMAT_VERSION_CHECK_INTERVAL``
+    seconds.
+    """
+    # site_id -> (version, time of the last version check, {name: format})
+    _cache = {}
+
     def get_for_name(self, name):
         try:
-            return FORMAT_CACHE[name]
+            return self.get_for_site(settings.SITE_ID)[name]
         except KeyError:
-            FORMAT_CACHE[name] = format = get_cached_object(Format, name=name, sites__id=settings.SITE_ID)
-        return format
+            raise self.model.DoesNotExist('Format %r does not exist for site id %s.' % (name, settings.SITE_ID))
+
+    def get_for_site(self, site_id):
+        " Return dict of all formats of given site keyed by their names. "
+        timestamp = time()
+        try:
+            version, checked, formats = self.__class__._cache[site_id]
+        except KeyError:
+            version, checked, formats = None, None, None
+
+        if checked is None or timestamp - checked >= photos_settings.FORMAT_VERSION_CHECK_INTERVAL:
+            current_version = cache.get(FORMATS_VERSION_KEY) or 0
+            if formats is None or current_version != version:
+                formats = {}
+                for f in self.filter(sites=site_id).order_by('-pk'):
+                    # the oldest format wins if the name is not unique
+                    formats[f.name] = f
+            self.__class__._cache[site_id] = (current_version, timestamp, formats)
+
+        return formats
+
+    def clear_cache(self):
+        " Drop the formats of this process and make the other processes reload them. "
+        self.__class__._cache.clear()
+        cache.set(FORMATS_VERSION_KEY, time())
 
 
 class Format(models.Model):
@@ -266,6 +357,9 @@ class Format(models.Model):
 
 
 class FormatedPhotoManager(models.Manager):
+    # lookups served from and missed in PHOTOS_REDIS by this process
+    redis_stats = {'hits': 0, 'misses': 0}
+
     def get_photo_in_format(self, photo, format, include_original=True):
         if isinstance(photo, Photo):
             photo_id = photo.id
@@ -281,10 +375,12 @@ class FormatedPhotoManager(models.Manager):
             p.hgetall(REDIS_PHOTO_KEY % photo_id)
             p.hgetall(REDIS_FORMATTED_PHOTO_KEY % (photo_id, format.id))
             original, formatted = p.execute()
-            if formatted:
+            if formatted and (original or not include_original):
+                self.redis_stats['hits'] += 1
                 if include_original:
                     formatted['original'] = original
                 return formatted
+            self.redis_stats['misses'] += 1
 
         if not photo:
             try:
@@ -303,16 +399,85 @@ class FormatedPhotoManager(models.Manager):
                 log.warning("Cannot create formatted photo due to %s.", e)
                 return format.get_blank_img()
 
-        info = {
-            'url': formated_photo.url,
-            'width': formated_photo.width,
-            'height': formated_photo.height,
-        }
+        info = formated_photo.get_image_info()
+        original = photo.get_image_info()
+
+        if redis:
+            # populate redis so that the next lookup doesn't end up here
+            p = redis.pipeline()
+            store_image_info(p, REDIS_PHOTO_KEY % photo.id, original)
+            store_image_info(p, REDIS_FORMATTED_PHOTO_KEY % (photo.id, format.id), info)
+            p.execute()
+
         if include_original:
-            info['original'] = photo.get_image_info()
+            info['original'] = original
 
         return info
 
+    def get_photos_in_format(self, photos, format, include_original=True):
+        """
+        Same as ``get_photo_in_format`` for several photos at once, returns
+        a dict mapping photo ids to the image infos. Redis is asked in one
+        pipeline and the photos missing there are loaded together, only the
+        formatted photos that do not exist yet are created one by one.
+        """
+        if not isinstance(format, Format):
+            format = Format.objects.get_for_name(format)
+
+        instances = {}
+        for photo in photos:
+            if isinstance(photo, Photo):
+                instances[photo.id] = photo
+            else:
+                instances.setdefault(photo, None)
+        photo_ids = instances.keys()
+
+        infos = {}
+        if redis and photo_ids:
+            p = redis.pipeline()
+            for photo_id in photo_ids:
+                p.hgetall(REDIS_PHOTO_KEY % photo_id)
+                p.hgetall(REDIS_FORMATTED_PHOTO_KEY % (photo_id, format.id))
+            results = p.execute()
+            for photo_id, original, formatted in zip(photo_ids, results[::2], results[1::2]):
+                if formatted and (original or not include_original):
+                    self.redis_stats['hits'] += 1
+                    if include_original:
+                        formatted['original'] = original
+                    infos[photo_id] = formatted
+                else:
+                    self.redis_stats['misses'] += 1
+
+        missing = [photo_id for photo_id in photo_ids if photo_id not in infos]
+        if not missing:
+            return infos
+
+        to_load = [photo_id for photo_id in missing if instances[photo_id] is None]
+        if to_load:
+            instances.update(zip(to_load, get_cached_objects(to_load, Photo, missing=NONE)))
+        formated_photos = dict((fp.photo_id, fp) for fp in self.filter(photo__in=missing, format=format))
+
+        p = redis.pipeline() if redis else None
+        for photo_id in missing:
+            photo = instances[photo_id]
+            if photo is None or photo_id not in formated_photos:
+                # missing photo or formatted photo yet to be generated
+                infos[photo_id] = self.get_photo_in_format(photo or photo_id, format, include_original)
+                continue
+
+            info = formated_photos[photo_id].get_image_info()
+            original = photo.get_image_info()
+            if p is not None:
+                store_image_info(p, REDIS_PHOTO_KEY % photo_id, original)
+                store_image_info(p, REDIS_FORMATTED_PHOTO_KEY % (photo_id, format.id), info)
+            if include_original:
+                info['original'] = original
+            infos[photo_id] = info
+        if p is not None:
+            p.execute()
+
+        return infos
+
 
 class FormatedPhoto(models.Model):
     """
@@ -347,18 +512,23 @@ class FormatedPhoto(models.Model):
         "Returns url of the photo file."
         return self.image.url
 
+    def get_image_info(self):
+        return {
+            'url': self.url,
+            'width': self.width,
+            'height': self.height,
+        }
+
     def _generate_img(self):
         crop_box = None
         if self.crop_left:
             crop_box = (self.crop_left, self.crop_top, \
                     self.crop_left + self.crop_width, self.crop_top + self.crop_height)
 
-        important_box = None
-        if self.photo.important_top is not None:
-            p = self.photo
-            important_box = (p.important_left, p.important_top, p.important_right, p.important_bottom)
+        important_box = self.photo._get_important_box()
 
         image = None
+        scale = 1.0
         if crop_box is None and self.format.master_id:
             try:
                 fp = FormatedPhoto.objects.get(format=self.format.master_id, photo=self.photo)
@@ -367,11 +537,47 @@ class FormatedPhoto(models.Model):
                 pass
 
         if image is None:
-            image = self.photo._get_image()
-        formatter = Formatter(image, self.format, crop_box=crop_box, important_box=important_box)
+            image, scale = self._get_source_image(crop_box, important_box)
+        formatter = Formatter(image, self.format, crop_box=crop_box, important_box=important_box, scale=scale)
 
         return formatter.format()
 
+    def _get_source_image(self, crop_box, important_box):
+        """
+        Return the smallest image this format can be generated from together
+        with its size relative to the original photo. That is either an
+        existing uncropped ``FormatedPhoto`` that is still big enough or the
+        original image itself.
+        """
+        image = self.photo._open_image()
+        target = Formatter(image, self.format, crop_box=crop_box, important_box=important_box).get_target_scale()
+        long_side = max(self.photo.width, self.photo.height)
+        if target >= 1 or not long_side:
+            return image, 1.0
+
+        # formats with master are derived from a (possibly cropped) formatted photo
+        qset = FormatedPhoto.objects.filter(photo=self.photo, crop_width=0,
+            crop_height=0, format__master__isnull=True).exclude(format=self.format_id)
+
+        candidates = []
+        for name, width, height in qset.values_list('image', 'width', 'height'):
+            # formatted photos are already rotated, compare the longer sides
+            scale = float(max(width, height)) / long_side
+            if target <= scale < 1:
+                candidates.append((scale, name))
+
+        for scale, name in sorted(candidates):
+            try:
+                source = Image.open(self.image.storage.open(name))
+            except IOError, e:
+                log.warning('Cannot use formatted photo %s as source due to %s.', name, e)
+                continue
+            # the original was only needed for its size
+            self.photo.image.close()
+            return source, scale
+
+        return image, 1.0
+
     def generate(self, save=True):
         """
         Generates photo file in current format.
@@ -379,7 +585,11 @@ class FormatedPhoto(models.Model):
         If ``save`` is ``True``, file is saved too.
         """
         stretched_photo, crop_box = self._generate_img()
+        self._set_image_info(stretched_photo, crop_box)
+        self.image.save(self.file(), self._get_content(stretched_photo), save)
 
+    def _set_image_info(self, stretched_photo, crop_box):
+        " Store the crop_box and dimensions of the generated image. "
         # set crop_box to (0,0,0,0) if photo not cropped
         if not crop_box:
             crop_box = 0, 0, 0, 0
@@ -390,6 +600,8 @@ class FormatedPhoto(models.Model):
 
         self.width, self.height = stretched_photo.size
 
+    def _get_content(self, stretched_photo):
+        " Encode the generated image in the same file format as the original. "
         f = StringIO()
         imgf = (self.photo._get_image().format or
                 Image.EXTENSION[path.splitext(self.photo.image.name)[1]])
@@ -397,7 +609,7 @@ class FormatedPhoto(models.Model):
         stretched_photo.save(f, format=imgf, quality=self.format.resample_quality)
         f.seek(0)
 
-        self.image.save(self.file(), ContentFile(f.read()), save)
+        return ContentFile(f.read())
 
     def save(self, **kwargs):
         """Overrides models.Model.save
@@ -431,23 +643,106 @@ class FormatedPhoto(models.Model):
         source_file = path.split(self.photo.image.name)
         return path.join(source_file[0], str(self.format.id) + '-' + source_file[1])
 
+def generate_all_formats(photo, formats, threads=4):
+    """
+    Generate ``FormatedPhoto`` objects for all ``formats`` the ``photo``
+    doesn't have yet. The original image is only decoded and rotated once
+    and the formats are derived from the largest to the smallest, each from
+    the smallest already generated uncropped image that is still big enough.
+    Resulting files are encoded and written using ``threads`` threads.
+
+    Returns list of the created ``FormatedPhoto`` objects.
+    """
+    existing = set(photo.formatedphoto_set.values_list('format_id', flat=True))
+    formats = [f for f in formats if f.pk not in existing]
+    if not formats:
+        return []
+
+    important_box = photo._get_important_box()
+    image = photo._open_image()
+    targets = sorted(
+        ((Formatter(image, f, important_box=important_box).get_target_scale(), f) for f in formats if not f.master_id),
+        key=lambda t: t[0], reverse=True
+    )
+
+    generated = []
+    if targets:
+        # decode (and rotate) the original just once, big enough for the largest format
+        base = Formatter(image, targets[0][1], important_box=important_box)
+        base.draft()
+        base.rotate_exif()
+        base.image.load()
+        width = base.get_image_size()[0]
+        sources = [(base.scale, base.image)]
+
+        for target, format in targets:
+            scale, source = min(
+                [s for s in sources if s[0] >= target] or sources[:1],
+                key=lambda s: s[0]
+            )
+            stretched_photo, crop_box = Formatter(source, format, important_box=important_box, scale=scale).format()
+
+            fp = FormatedPhoto(photo=photo, format=format)
+            fp._set_image_info(stretched_photo, crop_box)
+            generated.append((fp, stretched_photo))
+
+            # uncropped and smaller than the original, use it for smaller formats
+            if crop_box is None and stretched_photo.size[0] < width:
+                sources.append((float(stretched_photo.size[0]) / width, stretched_photo))
+
+        # make sure the original's file format is known before going parallel
+        photo._get_image()
+
+        def write(item):
+            fp, stretched_photo = item
+            fp.image.save(fp.file(), fp._get_content(stretched_photo), save=False)
+
+        if threads > 1 and len(generated) > 1:
+            pool = ThreadPool(min(threads, len(generated)))
+            try:
+                pool.map(write, generated)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            map(write, generated)
+
+    out = []
+    for fp, stretched_photo in generated:
+        # file is already written, skip FormatedPhoto.save() which would generate it again
+        fp.save_base(force_insert=True)
+        out.append(fp)
+
+    # formats derived from master's formatted photo go the usual way
+    for f in formats:
+        if f.master_id:
+            out.append(FormatedPhoto.objects.create(photo=photo, format=f))
+
+    return out
+
+
+def invalidate_formats(**kwargs):
+    Format.objects.clear_cache()
+
+signals.post_save.connect(invalidate_formats, sender=Format)
+signals.post_delete.connect(invalidate_formats, sender=Format)
+signals.m2m_changed.connect(invalidate_formats, sender=Format.sites.through)
+
+
 if redis:
     def store_photo(instance, **kwargs):
         if instance.image:
-            redis.hmset(REDIS_PHOTO_KEY % instance.pk, instance.get_image_info())
+            p = redis.pipeline()
+            store_image_info(p, REDIS_PHOTO_KEY % instance.pk, instance.get_image_info())
+            p.execute()
 
     def remove_photo(instance, **kwargs):
         redis.delete(REDIS_PHOTO_KEY % instance.id)
 
     def store_formated_photo(instance, **kwargs):
-        redis.hmset(
-            REDIS_FORMATTED_PHOTO_KEY % (instance.photo_id, instance.format.id),
-            {
-                'url': instance.url,
-                'width': instance.width,
-                'height': instance.height,
-            }
-        )
+        p = redis.pipeline()
+        store_image_info(p, REDIS_FORMATTED_PHOTO_KEY % (instance.photo_id, instance.format.id), instance.get_image_info())
+        p.execute()
 
     def remove_formated_photo(instance, **kwargs):
         redis.delete(REDIS_FORMATTED_PHOTO_KEY % (instance.photo_id, instance.format.id))
@@ -1,28 +1,92 @@
 import logging
+from math import ceil
 
 from django.utils.translation import ugettext_lazy as _
 from django.db import models
-from django.db.models import Q
-from django.template import Template, TemplateSyntaxError
+from django.db.models import Q, signals
+from django.core.cache import cache
+from django.template import Template, TemplateSyntaxError, NodeList, TextNode
 from django.core.exceptions import ValidationError
 
 from ella.core.box import Box
-from ella.core.cache import cache_this, CachedGenericForeignKey, \
-    CategoryForeignKey, ContentTypeForeignKey, get_cached_object
+from ella.core.cache import CachedGenericForeignKey, \
+    CategoryForeignKey, ContentTypeForeignKey, get_cached_object, \
+    invalidate_cache_for_object
+from ella.core.conf import core_settings
+from ella.core.models import Category
 from ella.utils import timezone
 
 
 log = logging.getLogger('ella.positions.models')
 
 
-def get_position_key(self, category, name, nofallback=False):
-    return 'positions:%d:%s:%s' % (
-            category.pk, name, nofallback and '1' or '0'
-    )
+# compiled position definitions, pk -> ((name, text), Template)
+_templates = {}
+
+
+def get_positions_key(category_id):
+    return 'positions:%d' % category_id
 
 
 class PositionManager(models.Manager):
-    @cache_this(get_position_key)
+    def get_positions_for_category(self, category):
+        """
+        Return dict of active positions for given category keyed by position
+        name. Positions not defined for the category itself are taken from
+        the nearest ancestor, all of them are loaded in one query.
+
+        The result is cached until the nearest moment some position in the
+        chain gets activated or deactivated, ``CACHE_TIMEOUT_LONG`` at most.
+        """
+        key = get_positions_key(category.pk)
+        positions = cache.get(key)
+        if positions is None:
+            positions, timeout = self._resolve_positions(category)
+            cache.set(key, positions, timeout)
+        return positions
+
+    def _resolve_positions(self, category):
+        chain = []
+        while category is not None:
+            chain.append(category.pk)
+            category = category.tree_parent
+        depth = dict((pk, i) for i, pk in enumerate(chain))
+
+        now = timezone.now()
+        next_change = None
+        positions = {}
+        qset = self.filter(Q(active_till__isnull=True) | Q(active_till__gt=now), category__in=chain, disabled=False)
+        for pos in qset.order_by('pk'):
+            if pos.active_from is not None and pos.active_from > now:
+                change = pos.active_from
+            else:
+                change = pos.active_till
+                current = positions.get(pos.name)
+                if current is None or depth[pos.category_id] < depth[current.category_id]:
+                    positions[pos.name] = pos
+
+            if change is not None and (next_change is None or change < next_change):
+                next_change = change
+
+        timeout = core_settings.CACHE_TIMEOUT_LONG
+        if next_change is not None:
+            delta = next_change - now
+            timeout = min(timeout, max(1, int(ceil(delta.days * 86400 + delta.seconds + delta.microseconds / 1e6))))
+        return positions, timeout
+
+    def invalidate_category(self, category):
+        """
+        Drop cached positions of the category and all its descendants and
+        invalidate the cached pages showing them.
+        """
+        categories = Category.objects.filter(site=category.site_id).exclude(pk=category.pk)
+        if category.tree_path:
+            categories = categories.filter(tree_path__startswith=category.tree_path + '/')
+        categories = [category] + list(categories)
+        cache.delete_many([get_positions_key(c.pk) for c in categories])
+        for c in categories:
+            invalidate_cache_for_object(c)
+
     def get_active_position(self, category, name, nofallback=False):
         """
         Get active position for given position name.
@@ -33,25 +97,14 @@ class PositionManager(models.Manager):
             nofallback - if True than do not fall back to parent
                         category if active position is not found for category
         """
-        now = timezone.now()
-        lookup = (Q(active_from__isnull=True) | Q(active_from__lte=now)) & \
-                 (Q(active_till__isnull=True) | Q(active_till__gt=now))
-
-        while True:
-            try:
-                return self.get(lookup, category=category, name=name,
-                    disabled=False)
-            except Position.DoesNotExist:
-                # if nofallback was specified, do not look into parent categories
-                if nofallback:
-                    return False
-
-                # traverse the category tree to the top otherwise
-                category = category.tree_parent
+        return self.get_from_map(self.get_positions_for_category(category), category, name, nofallback)
 
-                # we reached the top and still haven't found the position - return
-                if category is None:
-                    return False
+    def get_from_map(self, positions, category, name, nofallback=False):
+        " Pick the position from the result of ``get_positions_for_category``. "
+        pos = positions.get(name)
+        if pos is None or (nofallback and pos.category_id != category.pk):
+            return False
+        return pos
 
 
 def PositionBox(position, *args, **kwargs):
@@ -116,6 +169,35 @@ class Position(models.Model):
     def __unicode__(self):
         return u'%s:%s' % (self.category, self.name)
 
+    def get_template(self):
+        " Compiled ``text``, kept in the process until the position changes. "
+        stamp = (self.name, self.text)
+        try:
+            cached_stamp, template = _templates[self.pk]
+            if cached_stamp == stamp:
+                return template
+        except KeyError:
+            pass
+
+        template = Template(self.text, name="position-%s" % self.name)
+        if self.pk:
+            _templates[self.pk] = (stamp, template)
+        return template
+
+    def _prepend_text(self, text, nodelist):
+        """
+        Return new NodeList with ``text`` followed by ``nodelist``, adjacent
+        text nodes are joined as if the whole was parsed at once.
+        """
+        out = NodeList([TextNode(text)])
+        for node in nodelist:
+            if isinstance(node, TextNode) and isinstance(out[-1], TextNode):
+                out[-1] = TextNode(out[-1].s + node.s)
+            else:
+                out.append(node)
+                out.contains_nontext = True
+        return out
+
     def render(self, context, nodelist, box_type):
         " Render the position. "
         if not self.target:
@@ -124,7 +206,7 @@ class Position(models.Model):
                 log.warning('Broken target for position with pk %r', self.pk)
                 return ''
             try:
-                return Template(self.text, name="position-%s" % self.name).render(context)
+                return self.get_template().render(context)
             except TemplateSyntaxError:
                 log.error('Broken definition for position with pk %r', self.pk)
                 return ''
@@ -132,8 +214,27 @@ class Position(models.Model):
         if self.box_type:
             box_type = self.box_type
         if self.text:
-            nodelist = Template('%s\n%s' % (nodelist.render({}), self.text),
-                name="position-%s" % self.name).nodelist
+            nodelist = self._prepend_text(nodelist.render({}) + '\n', self.get_template().nodelist)
 
         b = self.box_class(self, box_type, nodelist)
         return b.render(context)
+
+
+def store_old_category(instance, **kwargs):
+    instance._old_category_id = None
+    if instance.pk:
+        old = Position.objects.filter(pk=instance.pk).values_list('category', flat=True)
+        if old:
+            instance._old_category_id = old[0]
+
+
+def invalidate_positions(instance, **kwargs):
+    _templates.pop(instance.pk, None)
+    Position.objects.invalidate_category(instance.category)
+    old_category_id = getattr(instance, '_old_category_id', None)
+    if old_category_id is not None and old_category_id != instance.category_id:
+        Position.objects.invalidate_category(Category.objects.get_for_id(old_category_id))
+
+signals.pre_save.connect(store_old_category, sender=Position)
+signals.post_save.connect(invalidate_positions, sender=Position)
+signals.post_delete.connect(invalidate_positions, sender=Position)
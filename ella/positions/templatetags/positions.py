@@ -2,6 +2,7 @@ from django import template
 from django.template import TemplateSyntaxError
 
 from ella.core.models import Category
+from ella.core.cache.utils import add_dependency
 from ella.positions.models import Position
 
 
@@ -18,6 +19,20 @@ def _get_category_from_pars_var(template_var, context):
     return cat
 
 
+def _get_active_position(cat, name, nofallback, context):
+    '''
+    get active position reusing positions of the category resolved earlier
+    during rendering of the same page
+    '''
+    # the outermost scope of render_context lives as long as the context
+    # itself and is shared by all templates rendered with it
+    resolved = context.render_context.dicts[0].setdefault('_ella_positions', {})
+    if cat.pk not in resolved:
+        add_dependency(cat)
+        resolved[cat.pk] = Position.objects.get_positions_for_category(cat)
+    return Position.objects.get_from_map(resolved[cat.pk], cat, name, nofallback)
+
+
 @register.tag
 def position(parser, token):
     """
@@ -65,7 +80,7 @@ class PositionNode(template.Node):
 
     def render(self, context):
         cat = _get_category_from_pars_var(self.category, context)
-        pos = Position.objects.get_active_position(cat, self.position, self.nofallback)
+        pos = _get_active_position(cat, self.position, self.nofallback, context)
 
         if pos:
             return pos.render(context, self.nodelist, self.box_type)
@@ -118,7 +133,7 @@ class IfPositionNode(template.Node):
         cat = _get_category_from_pars_var(self.category, context)
 
         for pos in self.positions:
-            if Position.objects.get_active_position(cat, pos, self.nofallback):
+            if _get_active_position(cat, pos, self.nofallback, context):
                 return self.nodelist_true.render(context)
 
         return self.nodelist_false.render(context)
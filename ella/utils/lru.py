@@ -0,0 +1,39 @@
+class LRUCache(object):
+    """
+    Dict-like cache holding at most ``size`` items. When full, the least
+    recently used tenth of the items is dropped at once so that the cost of
+    finding them is spread over many insertions.
+    """
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._data = {}
+        self._tick = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            item = self._data[key]
+        except KeyError:
+            return default
+        self._tick += 1
+        item[1] = self._tick
+        return item[0]
+
+    def __setitem__(self, key, value):
+        if key not in self._data and len(self._data) >= self.size:
+            self._evict()
+        self._tick += 1
+        self._data[key] = [value, self._tick]
+
+    def _evict(self):
+        by_age = sorted(self._data.items(), key=lambda i: i[1][1])
+        for key, item in by_age[:max(1, self.size // 10)]:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
@@ -0,0 +1,74 @@
+import re
+
+from django.conf import settings
+from django.core.urlresolvers import reverse, get_resolver, get_urlconf, get_script_prefix, NoReverseMatch
+from django.utils.encoding import iri_to_uri, force_unicode
+from django.utils.translation import get_language
+
+# values matching the patterns of the arguments ella URLs use
+PLACEHOLDERS = {
+    'category': 'ellacategoryplaceholder',
+    'slug': 'ellaslugplaceholder',
+    'year': '9876',
+    'month': '54',
+    'day': '32',
+    'id': '123456789',
+}
+
+# (urlconf, language, viewname, argument names) -> (URL template, pattern) or None
+_templates = {}
+
+
+def _build_template(viewname, names, urlconf):
+    """
+    Reverse the URL once with placeholder arguments and turn the result into
+    a template, together with the compiled pattern of the URL it was reversed
+    from. Return ``None`` when the placeholders cannot be told apart from the
+    rest of the URL.
+    """
+    try:
+        placeholders = dict((name, PLACEHOLDERS[name]) for name in names)
+        url = reverse(viewname, urlconf, kwargs=placeholders, prefix='/')[1:]
+    except (KeyError, NoReverseMatch):
+        return None
+
+    template = url.replace('%', '%%')
+    for name, value in placeholders.iteritems():
+        if template.count(value) != 1:
+            return None
+        template = template.replace(value, '%%(%s)s' % name)
+
+    if template % placeholders != url:
+        return None
+
+    for possibility, pattern, defaults in get_resolver(urlconf).reverse_dict.getlist(viewname):
+        regex = re.compile(u'^%s' % pattern, re.UNICODE)
+        if regex.search(url):
+            return template, regex
+    return None
+
+
+def fast_reverse(viewname, **kwargs):
+    """
+    Same as ``reverse(viewname, kwargs=kwargs)`` for URLs made of plain path
+    segments, like ``object_detail`` or ``static_detail``. The resolver is
+    only used the first time, the URL is then filled into a template and
+    checked against the pattern; values the pattern doesn't accept are
+    left to ``reverse``.
+    """
+    key = (get_urlconf() or settings.ROOT_URLCONF, get_language(), viewname, tuple(sorted(kwargs)))
+    try:
+        cached = _templates[key]
+    except KeyError:
+        cached = _templates[key] = _build_template(viewname, kwargs.keys(), key[0])
+
+    if cached is not None:
+        template, regex = cached
+        url = template % dict((k, force_unicode(v)) for k, v in kwargs.iteritems())
+        if regex.search(url):
+            return iri_to_uri(get_script_prefix() + url)
+    return reverse(viewname, kwargs=kwargs)
+
+
+def clear_cache():
+    _templates.clear()
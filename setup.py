@@ -14,6 +14,7 @@ tests_require = [
     'coverage',
     'feedparser',
     'redis',
+    'mock',
 ]
 
 long_description = open('README.rst').read()
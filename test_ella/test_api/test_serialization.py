@@ -1,10 +1,15 @@
 from test_ella.cases import RedisTestCase as TestCase
 
-from ella.api import object_serializer, FULL
+from django.utils import simplejson as json
+
+from ella.api import object_serializer, response_serializer, FULL
+from ella.api import serializers
+from ella.api.serializers import serialize_list, serialize_dict
 from ella.core.models import Publishable
 from ella.articles.models import Article
 
 from nose import tools
+import mock
 
 class TestObjectSerialization(TestCase):
     def setUp(self):
@@ -22,3 +27,53 @@ class TestObjectSerialization(TestCase):
         art = Article(id=42)
         tools.assert_equals('Publishable 42', object_serializer.serialize(None, art))
 
+
+    def test_serializer_lookup_is_cached_per_class_and_context(self):
+        object_serializer.register(Publishable, lambda r, a: 'Publishable %s' % a.id)
+        object_serializer.get_serializer(Article, FULL)
+        tools.assert_true((Article, FULL) in object_serializer._serializers)
+
+    def test_register_drops_cached_lookups(self):
+        object_serializer.register(Publishable, lambda r, a: 'Publishable %s' % a.id)
+        art = Article(id=42)
+        tools.assert_equals('Publishable 42', object_serializer.serialize(None, art, FULL))
+        object_serializer.register(Article, lambda r, a: 'Article %s' % a.id, FULL)
+        tools.assert_equals('Article 42', object_serializer.serialize(None, art, FULL))
+
+    def test_containers_of_primitives_are_copied_without_serializing_items(self):
+        object_serializer.register(list, serialize_list)
+        object_serializer.register(dict, serialize_dict)
+        with mock.patch.object(object_serializer, 'serialize', wraps=object_serializer.serialize) as serialize:
+            tools.assert_equals([1, u'a', None], serialize_list(None, (1, u'a', None)))
+            tools.assert_equals({'a': 1.5, 'b': True}, serialize_dict(None, {'a': 1.5, 'b': True}))
+        tools.assert_equals(0, serialize.call_count)
+
+    def test_registered_primitive_type_is_serialized_in_containers(self):
+        object_serializer.register(list, serialize_list)
+        object_serializer.register(int, lambda r, i: i * 2)
+        tools.assert_equals([2, 'a'], object_serializer.serialize(None, [1, 'a']))
+
+
+def failing_objects(count):
+    for i in range(count):
+        yield 'object %d' % i
+    raise ValueError('broken object')
+
+
+class TestJsonResponse(TestCase):
+    def test_error_in_first_chunk_is_raised(self):
+        tools.assert_raises(ValueError, response_serializer.serialize, {'objects': failing_objects(1)}, 'application/json')
+
+    def test_error_after_first_chunk_ends_list_with_error_marker(self):
+        serializers.JSON_CHUNK_SIZE = 10
+        try:
+            response = response_serializer.serialize({'objects': failing_objects(3)}, 'application/json')
+            with mock.patch.object(serializers, 'log') as log:
+                content = response.content
+        finally:
+            serializers.JSON_CHUNK_SIZE = 16 * 1024
+        tools.assert_equals(1, log.exception.call_count)
+        tools.assert_equals(
+            {'objects': ['object 0', 'object 1', 'object 2', serializers.SERIALIZATION_ERROR]},
+            json.loads(content)
+        )
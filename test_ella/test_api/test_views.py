@@ -1,9 +1,18 @@
 from django.utils import simplejson as json
 
-from ella.api import object_serializer, FULL
+from django.db import connection
+
+from ella.api import object_serializer, serializers, FULL
+from ella.api.conf import api_settings
+from ella.api.serialization import StreamingResponse
 from ella.articles.models import Article
+from ella.core.models import Author
+from ella.photos.models import redis
+from ella.utils.test_helpers import create_photo
 
+from test_ella.test_core import create_and_place_more_publishables, list_all_publishables_in_category_by_hour
 from test_ella.test_core.test_views import ViewsTestCase
+from test_ella.test_photos.fixtures import create_photo_formats
 
 from nose import tools
 
@@ -41,3 +50,74 @@ class TestObjectDetail(ViewsTestCase):
         tools.assert_equals(200, response.status_code)
         tools.assert_equals('application/json', response['Content-Type'])
         tools.assert_equals('Article 1', json.loads(response.content))
+
+class TestCategoryListings(ViewsTestCase):
+    def setUp(self):
+        super(TestCategoryListings, self).setUp()
+        create_photo_formats(self)
+        create_photo(self)
+        self.old_formats = api_settings.PUBLISHABLE_PHOTO_FORMATS
+        api_settings.PUBLISHABLE_PHOTO_FORMATS = ['basic']
+
+        create_and_place_more_publishables(self)
+        self.author = Author.objects.create(slug='some-author', photo=self.photo)
+        for p in self.publishables:
+            p.photo = self.photo
+            p.save()
+            p.authors.add(self.author)
+        list_all_publishables_in_category_by_hour(self, category=self.category)
+
+    def tearDown(self):
+        api_settings.PUBLISHABLE_PHOTO_FORMATS = self.old_formats
+        self.photo.delete()
+        super(TestCategoryListings, self).tearDown()
+        if redis:
+            redis.flushdb()
+
+    def count_queries(self, path):
+        connection.use_debug_cursor = True
+        try:
+            # queries are reset when the request starts
+            response = self.client.get(path, HTTP_ACCEPT='application/json')
+            tools.assert_equals(200, response.status_code)
+            # objects are serialized while the content is being read
+            response.content
+            return len(connection.queries)
+        finally:
+            connection.use_debug_cursor = None
+
+    def test_listings_are_serialized_with_authors_and_photos(self):
+        response = self.client.get('/', HTTP_ACCEPT='application/json')
+        objects = json.loads(response.content)['listings']['objects']
+        tools.assert_equals([l.publishable.pk for l in self.listings], [o['id'] for o in objects])
+        for o in objects:
+            tools.assert_equals(['some-author'], [a['url'].strip('/').split('/')[-1] for a in o['authors']])
+            tools.assert_equals(['basic'], o['photo'].keys())
+            tools.assert_equals(['basic'], o['authors'][0]['photo'].keys())
+
+    def test_number_of_queries_does_not_depend_on_number_of_listings(self):
+        self.count_queries('/')
+        many = self.count_queries('/')
+        for l in self.listings[1:]:
+            l.delete()
+        self.count_queries('/')
+        tools.assert_equals(many, self.count_queries('/'))
+
+    def test_fields_parameter_limits_serialized_fields(self):
+        response = self.client.get('/', {'fields': 'id,title'}, HTTP_ACCEPT='application/json')
+        objects = json.loads(response.content)['listings']['objects']
+        tools.assert_equals(len(self.listings), len(objects))
+        for o in objects:
+            tools.assert_equals(set(['id', 'title']), set(o.keys()))
+
+    def test_response_is_sent_in_chunks(self):
+        response = self.client.get('/', HTTP_ACCEPT='application/json')
+        tools.assert_true(isinstance(response, StreamingResponse))
+
+        serializers.JSON_CHUNK_SIZE = 10
+        try:
+            chunks = list(serializers.serialize_json({'a': [1, 2], 'b': (str(i) for i in range(10))}))
+        finally:
+            serializers.JSON_CHUNK_SIZE = 16 * 1024
+        tools.assert_true(len(chunks) > 1)
+        tools.assert_equals({'a': [1, 2], 'b': [str(i) for i in range(10)]}, json.loads(''.join(chunks)))
@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
 from test_ella.cases import RedisTestCase as TestCase
-from django.template import Context
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.http import HttpResponse
+from django.template import Context, NodeList, TextNode
+from django.test.client import RequestFactory
 
 from nose import tools
 
 from ella.core.models import Publishable
-from ella.core.box import Box
+from ella.core.box import Box, DOUBLE_RENDER_MARKER_RE
+from ella.core.esi import ESI_INCLUDE_RE, get_signature
+from ella.core.middleware import DoubleRenderMiddleware, ESIMiddleware
 from ella.core.cache.utils import _get_key, KEY_PREFIX
 from ella.articles.models import Article
 
@@ -75,3 +82,72 @@ class TestPublishableBox(TestCase):
         box = publishable.box_class(publishable, 'box_type', [])
         tools.assert_equals(ArticleBox, box.__class__)
 
+
+    def test_double_render_leaves_placeholder_rendered_by_middleware(self):
+        template_loader.templates['box/box_type.html'] = '{{ object.title }}|{{ box.params.param }}'
+        settings.DOUBLE_RENDER = True
+        try:
+            box = Box(self.publishable, 'box_type', NodeList([TextNode('param: value:with-->')]))
+            box.can_double_render = True
+            placeholder = box.render(Context({}))
+            tools.assert_true(DOUBLE_RENDER_MARKER_RE.match(placeholder))
+
+            response = HttpResponse('<p>{{ not_a_variable }}</p>' + placeholder + placeholder)
+            response = DoubleRenderMiddleware().process_response(RequestFactory().get('/'), response)
+        finally:
+            del settings.DOUBLE_RENDER
+
+        tools.assert_equals('<p>{{ not_a_variable }}</p>First Article|value:with--&gt;First Article|value:with--&gt;', response.content)
+
+    def test_box_with_esi_param_is_rendered_as_esi_fragment(self):
+        template_loader.templates['box/box_type.html'] = '{{ object.title }}|{{ box.params.param }}'
+        settings.ESI = True
+        settings.ESI_ASSEMBLE = True
+        try:
+            box = Box(self.publishable, 'box_type', NodeList([TextNode('param: value\nesi: 30')]))
+            include = box.render(Context({}))
+            tools.assert_true(include.startswith('<esi:include src="/esi/box/'))
+
+            fragment = self.client.get(ESI_INCLUDE_RE.match(include).group(1))
+            tools.assert_equals('First Article|value', fragment.content)
+            tools.assert_equals('max-age=30', fragment['Surrogate-Control'])
+
+            response = ESIMiddleware().process_response(RequestFactory().get('/'), HttpResponse('<p>%s</p>' % include))
+        finally:
+            del settings.ESI
+            del settings.ESI_ASSEMBLE
+
+        tools.assert_equals('<p>First Article|value</p>', response.content)
+
+    def get_esi_fragment(self, obj, params='', sig=None):
+        template_loader.templates['404.html'] = ''
+        ct_id = ContentType.objects.get_for_model(obj).pk
+        if sig is None:
+            sig = get_signature(ct_id, obj.pk, 'box_type', params)
+        return self.client.get('/esi/box/%d/%d/box_type/' % (ct_id, obj.pk), {'params': params, 'sig': sig})
+
+    def test_esi_fragment_with_valid_signature_is_rendered(self):
+        template_loader.templates['box/box_type.html'] = '{{ object.title }}'
+        tools.assert_equals('First Article', self.get_esi_fragment(self.publishable).content)
+
+    def test_esi_fragment_with_bad_signature_is_refused(self):
+        template_loader.templates['box/box_type.html'] = '{{ object.title }}'
+        tools.assert_equals(404, self.get_esi_fragment(self.publishable, sig='x' * 40).status_code)
+        tools.assert_equals(404, self.get_esi_fragment(self.publishable, sig='').status_code)
+
+    def test_esi_fragment_with_changed_params_is_refused(self):
+        template_loader.templates['box/box_type.html'] = '{{ object.title }}'
+        sig = get_signature(ContentType.objects.get_for_model(self.publishable).pk, self.publishable.pk, 'box_type', '')
+        response = self.get_esi_fragment(self.publishable, params='template_name: page/404.html', sig=sig)
+        tools.assert_equals(404, response.status_code)
+
+    def test_esi_fragment_of_non_publishable_is_refused(self):
+        template_loader.templates['box/box_type.html'] = '{{ object }}'
+        user = User.objects.create(username='secret')
+        tools.assert_equals(404, self.get_esi_fragment(user).status_code)
+
+    def test_esi_fragment_of_unpublished_object_is_refused(self):
+        template_loader.templates['box/box_type.html'] = '{{ object.title }}'
+        self.publishable.published = False
+        self.publishable.save()
+        tools.assert_equals(404, self.get_esi_fragment(self.publishable).status_code)
@@ -10,9 +10,10 @@ from django.contrib.sites.models import Site
 from django.contrib.contenttypes.models import ContentType
 
 from ella.core.cache import utils, redis
-from ella.core.models import Listing, Publishable
+from ella.core.models import Listing, Publishable, Author
 from ella.core.views import ListContentType
 from ella.core.managers import ListingHandler
+from ella.core import managers
 from ella.articles.models import Article
 from ella.utils.timezone import from_timestamp, now
 
@@ -110,6 +111,119 @@ class TestCacheInvalidation(CacheTestCase):
         tools.assert_equals(new_version, initial_version + 1)
 
 
+class TestUrlIndex(CacheTestCase):
+    def setUp(self):
+        super(TestUrlIndex, self).setUp()
+        self.old_managers_cache = managers.cache
+        managers.cache = self.cache
+        create_basic_categories(self)
+        create_and_place_a_publishable(self)
+
+    def tearDown(self):
+        managers.cache = self.old_managers_cache
+        super(TestUrlIndex, self).tearDown()
+
+    def get_by_url(self, slug='first-article'):
+        return Publishable.objects.get_by_url(self.category_nested, 2008, 1, 10, slug)
+
+    def test_save_stores_url(self):
+        key = Publishable.objects._get_publishable_url_key(self.publishable)
+        tools.assert_equals((self.publishable.content_type_id, self.publishable.pk), self.cache.get(key))
+
+    def test_resolved_with_no_query(self):
+        self.get_by_url()
+        with self.assertNumQueries(0):
+            tools.assert_equals(self.publishable, self.get_by_url())
+
+    def test_resolved_with_one_query_when_object_cached(self):
+        self.cache.clear()
+        utils.get_cached_objects([self.publishable.pk], Publishable)
+        with self.assertNumQueries(1):
+            tools.assert_equals(self.publishable, self.get_by_url())
+        tools.assert_true(self.cache.get(Publishable.objects._get_publishable_url_key(self.publishable)) is not None)
+
+    def test_changed_slug_moves_the_entry(self):
+        old_key = Publishable.objects._get_publishable_url_key(self.publishable)
+        self.publishable.slug = 'other-article'
+        self.publishable.save()
+        tools.assert_equals(None, self.cache.get(old_key))
+        tools.assert_equals(self.publishable, self.get_by_url('other-article'))
+        tools.assert_raises(Publishable.DoesNotExist, self.get_by_url)
+
+    def test_stale_entry_is_ignored(self):
+        key = Publishable.objects._get_publishable_url_key(self.publishable)
+        Publishable.objects.filter(pk=self.publishable.pk).update(slug='other-article')
+        utils.invalidate_cache_for_object(self.publishable)
+        self.cache.set(key.replace('first', 'second'), (self.publishable.content_type_id, self.publishable.pk))
+        tools.assert_raises(Publishable.DoesNotExist, self.get_by_url, 'second-article')
+
+    def test_unpublished_is_removed(self):
+        self.publishable.published = False
+        self.publishable.save()
+        tools.assert_equals(None, self.cache.get(Publishable.objects._get_publishable_url_key(self.publishable)))
+        tools.assert_raises(Publishable.DoesNotExist, self.get_by_url)
+
+
+class TestAuthorsPrefetch(CacheTestCase):
+    def setUp(self):
+        super(TestAuthorsPrefetch, self).setUp()
+        self.old_managers_cache = managers.cache
+        managers.cache = self.cache
+        self.cache.clear()
+        create_basic_categories(self)
+        create_and_place_more_publishables(self)
+        self.authors = [Author.objects.create(slug='author-%d' % i) for i in range(2)]
+        self.publishables[0].authors.add(*self.authors)
+        self.publishables[1].authors.add(self.authors[1])
+
+    def tearDown(self):
+        managers.cache = self.old_managers_cache
+        super(TestAuthorsPrefetch, self).tearDown()
+
+    def fresh_publishables(self):
+        return list(Publishable.objects.filter(pk__in=[p.pk for p in self.publishables]).order_by('pk'))
+
+    def test_authors_are_attached_to_all_publishables(self):
+        publishables = self.fresh_publishables()
+        with self.assertNumQueries(2):
+            Publishable.objects.prefetch_authors(publishables)
+        with self.assertNumQueries(0):
+            tools.assert_equals(
+                [self.authors, [self.authors[1]], []],
+                [p.get_authors() for p in publishables]
+            )
+
+    def test_prefetched_authors_come_from_cache(self):
+        Publishable.objects.prefetch_authors(self.fresh_publishables())
+        publishables = self.fresh_publishables()
+        with self.assertNumQueries(0):
+            Publishable.objects.prefetch_authors(publishables)
+        tools.assert_equals(self.authors, publishables[0].get_authors())
+
+    def test_adding_author_invalidates_cached_ids(self):
+        Publishable.objects.prefetch_authors(self.fresh_publishables())
+        self.publishables[2].authors.add(self.authors[0])
+        tools.assert_equals([self.authors[0]], self.fresh_publishables()[2].get_authors())
+
+    def test_removing_author_invalidates_cached_ids(self):
+        Publishable.objects.prefetch_authors(self.fresh_publishables())
+        self.publishables[1].authors.remove(self.authors[1])
+        tools.assert_equals([], self.fresh_publishables()[1].get_authors())
+
+    def test_clearing_publishables_of_author_invalidates_cached_ids(self):
+        Publishable.objects.prefetch_authors(self.fresh_publishables())
+        self.authors[1].publishable_set.clear()
+        tools.assert_equals([[self.authors[0]], []], [p.get_authors() for p in self.fresh_publishables()[:2]])
+
+    def test_listing_handler_attaches_authors(self):
+        list_all_publishables_in_category_by_hour(self)
+        lh = Listing.objects.get_queryset_wrapper(category=self.category, children=ListingHandler.ALL, prefetch_authors=True)
+        listings = lh.get_listings()
+        with self.assertNumQueries(0):
+            authors = dict((l.publishable.pk, l.publishable.get_authors()) for l in listings)
+        tools.assert_equals(self.authors, authors[self.publishables[0].pk])
+
+
 class TestRedisListings(TestCase):
     def setUp(self):
         super(TestRedisListings, self).setUp()
@@ -138,6 +252,18 @@ class TestRedisListings(TestCase):
         tools.assert_equals(['%d:2' % ct_id, '%d:3' % ct_id], redis.client.zrange('listing:c:2', 0, 100))
         tools.assert_equals(['%d:2' % ct_id, '%d:3' % ct_id], redis.client.zrange('listing:d:2', 0, 100))
 
+    def test_moved_category_listings_move_to_new_ancestors(self):
+        list_all_publishables_in_category_by_hour(self)
+        ct_id = self.publishables[0].content_type_id
+        self.category_nested_second.tree_parent = self.category
+        self.category_nested_second.save()
+
+        tools.assert_equals(['%d:2' % ct_id], redis.client.zrange('listing:c:2', 0, 100))
+        tools.assert_equals(['%d:2' % ct_id], redis.client.zrange('listing:d:2', 0, 100))
+        tools.assert_equals(['%d:1' % ct_id, '%d:2' % ct_id, '%d:3' % ct_id], redis.client.zrange('listing:c:1', 0, 100))
+        tools.assert_equals(['%d:1' % ct_id, '%d:2' % ct_id, '%d:3' % ct_id], redis.client.zrange('listing:d:1', 0, 100))
+        tools.assert_equals(['%d:3' % ct_id], redis.client.zrange('listing:c:3', 0, 100))
+
     def test_listing_gets_removed_when_publishable_goes_unpublished(self):
         list_all_publishables_in_category_by_hour(self)
         p = self.publishables[0]
@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
+from datetime import timedelta
+
 from test_ella.cases import RedisTestCase as TestCase
 
 from nose import tools
 
+from django.contrib.redirects.models import Redirect
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models.signals import post_save
 from django.core.exceptions import ValidationError
 
 from ella.core.models import Category
+from ella.utils.timezone import now
 
-from test_ella.test_core import create_basic_categories
+from test_ella.test_core import create_basic_categories, create_and_place_a_publishable
+from ella.utils.test_helpers import create_category
 
 class TestCategory(TestCase):
 
@@ -53,6 +60,73 @@ class TestCategory(TestCase):
         category_nested_second = Category.objects.get(pk=self.category_nested_second.pk)
         tools.assert_equals(u"new-nested-category/second-nested-category", category_nested_second.tree_path)
 
+    def test_moving_category_rewrites_descendant_paths(self):
+        third = create_category(u'third', tree_parent=self.category_nested_second)
+        self.category_nested_second.tree_parent = self.category
+        self.category_nested_second.save()
+
+        tools.assert_equals(u'second-nested-category', self.category_nested_second.tree_path)
+        tools.assert_equals(u'second-nested-category/third', Category.objects.get(pk=third.pk).tree_path)
+        tools.assert_equals(u'nested-category', Category.objects.get(pk=self.category_nested.pk).tree_path)
+
+    def test_moving_category_doesnt_save_descendants(self):
+        create_category(u'third', tree_parent=self.category_nested_second)
+        create_category(u'fourth', tree_parent=self.category_nested_second)
+        saved = []
+        def category_saved(instance, **kwargs):
+            saved.append(instance)
+        post_save.connect(category_saved, sender=Category)
+        try:
+            self.category_nested.slug = u'new-nested-category'
+            self.category_nested.save()
+        finally:
+            post_save.disconnect(category_saved, sender=Category)
+        tools.assert_equals([self.category_nested], saved)
+        tools.assert_equals(3, Category.objects.filter(tree_path__startswith='new-nested-category/').count())
+
+    def test_moving_category_creates_redirects(self):
+        create_and_place_a_publishable(self, category=self.category_nested_second)
+        self.category_nested.slug = u'new-nested-category'
+        self.category_nested.save()
+
+        tools.assert_equals(
+            [(u'/nested-category/second-nested-category/2008/1/10/first-article/', u'/new-nested-category/second-nested-category/2008/1/10/first-article/')],
+            list(Redirect.objects.values_list('old_path', 'new_path'))
+        )
+
+    def test_moving_category_redirects_all_publishables_in_constant_queries(self):
+        def count_queries(slug):
+            self.category_nested.slug = slug
+            connection.use_debug_cursor = True
+            try:
+                start = len(connection.queries)
+                self.category_nested.save()
+                return len(connection.queries) - start
+            finally:
+                connection.use_debug_cursor = None
+
+        create_and_place_a_publishable(self, category=self.category_nested_second)
+        single = count_queries(u'moved-once')
+        Redirect.objects.all().delete()
+        for i in range(3):
+            create_and_place_a_publishable(self, slug=u'article-%d' % i, category=self.category_nested_second)
+        many = count_queries(u'moved-twice')
+
+        tools.assert_equals(single, many)
+        tools.assert_equals(
+            u'/moved-twice/second-nested-category/2008/1/10/article-2/',
+            Redirect.objects.get(old_path=u'/moved-once/second-nested-category/2008/1/10/article-2/').new_path
+        )
+
+    def test_moving_category_skips_never_published_objects(self):
+        create_and_place_a_publishable(self, category=self.category_nested_second, published=False)
+        create_and_place_a_publishable(self, category=self.category_nested_second, slug=u'future',
+            publish_from=now() + timedelta(days=1))
+        self.category_nested.slug = u'new-nested-category'
+        self.category_nested.save()
+
+        tools.assert_equals(0, Redirect.objects.count())
+
     def test_proper_parent(self):
         tools.assert_equals(self.category, self.category_nested.tree_parent)
 
@@ -4,6 +4,7 @@ from unittest import TestCase as UnitTestCase
 from test_ella.cases import RedisTestCase as TestCase
 
 from nose import tools
+import mock
 
 from django.http import Http404, HttpResponse
 from django.core.urlresolvers import NoReverseMatch
@@ -243,3 +244,20 @@ class TestCustomObjectDetailReverse(CustomObjectDetailTestCase):
 
         tools.assert_raises(NoReverseMatch,  custom_urls.resolver.reverse, self.publishable, 'prefix')
 
+
+    def test_resolver_is_reused(self):
+        custom_urls.resolver.register(self.urlpatterns, prefix='prefix')
+        tools.assert_true(custom_urls.resolver._get_resolver(self.publishable) is custom_urls.resolver._get_resolver(self.publishable))
+
+    def test_registration_drops_cached_resolvers(self):
+        custom_urls.resolver.register(self.urlpatterns, prefix='prefix', model=self.category.__class__)
+        tools.assert_raises(NoReverseMatch, custom_urls.resolver.reverse, self.publishable, 'prefix')
+        custom_urls.resolver.register(self.urlpatterns, prefix='other')
+        tools.assert_equals(self.url + 'other/', custom_urls.resolver.reverse(self.publishable, 'prefix'))
+
+    def test_static_suffix_skips_resolver(self):
+        custom_urls.resolver.register(self.urlpatterns, prefix='prefix')
+        custom_urls.resolver.reverse(self.publishable, 'prefix')
+        resolver = custom_urls.resolver._get_resolver(self.publishable)
+        with mock.patch.object(resolver, 'reverse', side_effect=AssertionError):
+            tools.assert_equals(self.url + 'prefix/', custom_urls.resolver.reverse(self.publishable, 'prefix'))
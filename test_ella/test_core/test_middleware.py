@@ -0,0 +1,280 @@
+import time
+import zlib
+from re import compile as re_compile
+from unittest import TestCase
+
+from nose import tools
+import mock
+
+from django.conf import settings
+from django.conf.urls import patterns, url
+from django.core.cache import get_cache
+from django.core.urlresolvers import set_urlconf
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.utils.cache import learn_cache_key
+
+from django.contrib.sites.models import Site
+from django.contrib.contenttypes.models import ContentType
+
+from ella.core import middleware
+from ella.core.cache import utils
+from ella.core.cache.utils import start_collecting_dependencies, stop_collecting_dependencies, \
+    add_dependency, invalidate_cache_for_object, get_version_key, get_versions, _get_key, KEY_PREFIX
+from ella.core.signals import object_rendering
+
+urlpatterns = patterns('',
+    url(r'^$', lambda request: HttpResponse('fresh')),
+)
+
+
+class TestFetchFromCacheMiddleware(TestCase):
+    def setUp(self):
+        super(TestFetchFromCacheMiddleware, self).setUp()
+        self._caches = settings.CACHES
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        self._cache = middleware.cache
+        middleware.cache = get_cache('default')
+        middleware.cache.clear()
+
+        self.rf = RequestFactory()
+        self.m = middleware.FetchFromCacheMiddleware()
+        self.refreshed = []
+        self.m.refresh_in_background = self.refreshed.append
+        self.m.background_refresh = True
+
+        request = self.rf.get('/')
+        self.response = HttpResponse('stale')
+        self.key = learn_cache_key(request, self.response, 600, self.m.key_prefix, cache=middleware.cache)
+        middleware.store_page(self.key, self.response, time.time() - 1000, 600)
+
+    def tearDown(self):
+        middleware.cache.clear()
+        middleware.cache = self._cache
+        settings.CACHES = self._caches
+        super(TestFetchFromCacheMiddleware, self).tearDown()
+
+    def test_stale_page_is_served_and_refreshed_once_in_background(self):
+        for i in range(2):
+            request = self.rf.get('/')
+            tools.assert_equals('stale', self.m.process_request(request).content)
+            tools.assert_false(request._cache_update_cache)
+        tools.assert_equals(1, len(self.refreshed))
+
+    def test_refreshing_request_regenerates_the_page(self):
+        request = self.rf.get('/')
+        request._cache_refresh = True
+        tools.assert_equals(None, self.m.process_request(request))
+        tools.assert_true(request._cache_update_cache)
+        tools.assert_equals(self.key, request._cache_middleware_key)
+
+    def test_refresh_policy_is_matched_by_url(self):
+        self.m.refresh_policies = [(re_compile(r'^/$'), {'refresh_seconds': None})]
+        tools.assert_equals((None, True), self.m.get_refresh_policy(self.rf.get('/')))
+        tools.assert_equals((self.m.cache_refresh_timeout, True), self.m.get_refresh_policy(self.rf.get('/other/')))
+
+        request = self.rf.get('/')
+        tools.assert_equals('stale', self.m.process_request(request).content)
+        tools.assert_equals([], self.refreshed)
+
+    def test_refresh_rewrites_cached_page_and_releases_lock(self):
+        middleware_classes = settings.MIDDLEWARE_CLASSES
+        settings.MIDDLEWARE_CLASSES = (
+            'ella.core.middleware.UpdateCacheMiddleware',
+            'ella.core.middleware.FetchFromCacheMiddleware',
+        )
+        self.addCleanup(set_urlconf, None)
+        try:
+            m = middleware.FetchFromCacheMiddleware()
+            m.background_refresh = True
+            request = self.rf.get('/')
+            # served stale, lock taken
+            tools.assert_equals('stale', m.process_request(request).content)
+            tools.assert_true(middleware.cache.get(self.key + ':refresh') is not None)
+
+            request.urlconf = __name__
+            m.refresh(m.get_refresh_request(request))
+        finally:
+            settings.MIDDLEWARE_CLASSES = middleware_classes
+
+        tools.assert_equals(None, middleware.cache.get(self.key + ':refresh'))
+        tools.assert_equals('fresh', self.m.process_request(self.rf.get('/')).content)
+        tools.assert_true(m.get_handler() is m.get_handler())
+
+    def test_refresh_request_is_anonymous_and_isolated(self):
+        request = self.rf.get('/?page=2', HTTP_COOKIE='sessionid=secret', HTTP_HOST='example.com')
+        request.user = object()
+        request.session = {}
+        request._cache_middleware_key = self.key
+
+        refresh = self.m.get_refresh_request(request)
+        tools.assert_true(refresh._cache_refresh)
+        tools.assert_equals(self.key, refresh._cache_middleware_key)
+        tools.assert_equals('/', refresh.path)
+        tools.assert_equals('2', refresh.GET['page'])
+        tools.assert_equals('example.com', refresh.get_host())
+        tools.assert_false('HTTP_COOKIE' in refresh.META)
+        tools.assert_false('wsgi.input' in refresh.META)
+        tools.assert_equals({}, refresh.COOKIES)
+        tools.assert_false(hasattr(refresh, 'user'))
+        tools.assert_false(hasattr(refresh, 'session'))
+        tools.assert_true('HTTP_COOKIE' in request.META)
+
+    def test_page_is_regenerated_in_request_without_background_refresh(self):
+        self.m.background_refresh = False
+        request = self.rf.get('/')
+        tools.assert_equals(None, self.m.process_request(request))
+        tools.assert_true(request._cache_update_cache)
+        tools.assert_equals([], self.refreshed)
+
+
+class TestPageStorage(TestCase):
+    def setUp(self):
+        super(TestPageStorage, self).setUp()
+        self._caches = settings.CACHES
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        self._cache = middleware.cache
+        middleware.cache = get_cache('default')
+        middleware.cache.clear()
+        self.rf = RequestFactory()
+
+    def tearDown(self):
+        middleware.cache.clear()
+        middleware.cache = self._cache
+        settings.CACHES = self._caches
+        super(TestPageStorage, self).tearDown()
+
+    def test_page_is_stored_in_chunks(self):
+        settings.CACHE_MIDDLEWARE_CHUNK_SIZE = 100
+        try:
+            response = HttpResponse(''.join(str(i) for i in xrange(10000)), content_type='text/plain')
+            response['X-Custom'] = 'value'
+            middleware.store_page('page', response, 1, 600)
+        finally:
+            del settings.CACHE_MIDDLEWARE_CHUNK_SIZE
+
+        orig_time, head = middleware.cache.get('page')
+        tools.assert_equals(1, orig_time)
+        tools.assert_true(head['chunks'] > 1)
+        tools.assert_true(middleware.cache.get('page:%s:1' % head['token']) is not None)
+
+        cached = middleware.build_page(self.rf.get('/'), 'page', head)
+        tools.assert_equals(response.content, cached.content)
+        tools.assert_equals('value', cached['X-Custom'])
+        tools.assert_equals('text/plain', cached['Content-Type'])
+        tools.assert_false(cached.has_header('Content-Encoding'))
+
+    def test_missing_chunk_is_a_miss(self):
+        settings.CACHE_MIDDLEWARE_CHUNK_SIZE = 10
+        try:
+            middleware.store_page('page', HttpResponse('x' * 1000), 1, 600)
+        finally:
+            del settings.CACHE_MIDDLEWARE_CHUNK_SIZE
+        head = middleware.cache.get('page')[1]
+        middleware.cache.delete('page:%s:1' % head['token'])
+        tools.assert_equals(None, middleware.build_page(self.rf.get('/'), 'page', head))
+
+    def test_chunks_of_concurrent_stores_are_not_mixed(self):
+        settings.CACHE_MIDDLEWARE_CHUNK_SIZE = 10
+        try:
+            middleware.store_page('page', HttpResponse('x' * 1000), 1, 600)
+            first_head = middleware.cache.get('page')[1]
+            middleware.store_page('page', HttpResponse(''.join(str(i) for i in xrange(1000))), 2, 600)
+        finally:
+            del settings.CACHE_MIDDLEWARE_CHUNK_SIZE
+        tools.assert_equals('x' * 1000, middleware.build_page(self.rf.get('/'), 'page', first_head).content)
+
+    def test_corrupted_body_is_a_miss(self):
+        middleware.store_page('page', HttpResponse('x' * 1000), 1, 600)
+        head = middleware.cache.get('page')[1]
+        head['body'] = 'y' * len(head['body'])
+        tools.assert_equals(None, middleware.build_page(self.rf.get('/'), 'page', head))
+
+    def test_body_of_wrong_size_is_a_miss(self):
+        middleware.store_page('page', HttpResponse('x' * 1000), 1, 600)
+        head = middleware.cache.get('page')[1]
+        head['size'] += 1
+        tools.assert_equals(None, middleware.build_page(self.rf.get('/', HTTP_ACCEPT_ENCODING='gzip'), 'page', head))
+
+    def test_gzip_with_zero_quality_is_refused(self):
+        middleware.store_page('page', HttpResponse('x' * 1000), 1, 600)
+        head = middleware.cache.get('page')[1]
+        for accept in ('gzip;q=0', 'gzip; q=0.0, deflate', 'identity', '*;q=0', ''):
+            cached = middleware.build_page(self.rf.get('/', HTTP_ACCEPT_ENCODING=accept), 'page', head)
+            tools.assert_false(cached.has_header('Content-Encoding'))
+            tools.assert_equals('x' * 1000, cached.content)
+        for accept in ('gzip;q=0.5', 'deflate, GZIP', '*'):
+            cached = middleware.build_page(self.rf.get('/', HTTP_ACCEPT_ENCODING=accept), 'page', head)
+            tools.assert_equals('gzip', cached['Content-Encoding'])
+
+    def test_gzipped_variant_has_its_own_etag(self):
+        response = HttpResponse('x' * 1000)
+        response['ETag'] = '"abc"'
+        middleware.store_page('page', response, 1, 600)
+        head = middleware.cache.get('page')[1]
+        plain = middleware.build_page(self.rf.get('/'), 'page', head)
+        gzipped = middleware.build_page(self.rf.get('/', HTTP_ACCEPT_ENCODING='gzip'), 'page', head)
+        tools.assert_equals('"abc"', plain['ETag'])
+        tools.assert_equals('"abc-gzip"', gzipped['ETag'])
+        tools.assert_true('Accept-Encoding' in plain['Vary'])
+
+    def test_gzipped_body_is_served_to_clients_accepting_it(self):
+        middleware.store_page('page', HttpResponse('x' * 1000), 1, 600)
+        cached = middleware.build_page(self.rf.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate'), 'page', middleware.cache.get('page')[1])
+        tools.assert_equals('gzip', cached['Content-Encoding'])
+        tools.assert_true('Accept-Encoding' in cached['Vary'])
+        tools.assert_equals('x' * 1000, zlib.decompress(cached.content, 16 + zlib.MAX_WBITS))
+
+    def test_page_is_missing_once_dependency_changes(self):
+        middleware.cache.set('obj:VER', 1)
+        middleware.store_page('page', HttpResponse('x'), 1, 600, {'obj:VER': 1, 'other:VER': None})
+        head = middleware.cache.get('page')[1]
+        tools.assert_equals('x', middleware.build_page(self.rf.get('/'), 'page', head).content)
+
+        middleware.cache.incr('obj:VER')
+        tools.assert_equals(None, middleware.build_page(self.rf.get('/'), 'page', head))
+
+    def test_page_is_missing_when_version_key_expires_between_edits(self):
+        site = Site.objects.get_current()
+        key = get_version_key(site)
+        orig_cache, utils.cache = utils.cache, middleware.cache
+        try:
+            invalidate_cache_for_object(site)
+            middleware.store_page('page', HttpResponse('x'), 1, 600, {key: middleware.cache.get(key)})
+            head = middleware.cache.get('page')[1]
+
+            middleware.cache.delete(key)
+            invalidate_cache_for_object(site)
+        finally:
+            utils.cache = orig_cache
+        tools.assert_equals(None, middleware.build_page(self.rf.get('/'), 'page', head))
+
+
+class TestDependencies(TestCase):
+    def tearDown(self):
+        stop_collecting_dependencies()
+        super(TestDependencies, self).tearDown()
+
+    def test_rendered_objects_are_recorded(self):
+        site = Site.objects.get_current()
+        start_collecting_dependencies()
+        object_rendering.send(sender=Site, request=None, category=site, publishable=None)
+        tools.assert_equals(
+            set([_get_key(KEY_PREFIX, ContentType.objects.get_for_model(Site), pk=site.pk, version_key=True)]),
+            stop_collecting_dependencies()
+        )
+
+    def test_nothing_is_recorded_when_not_collecting(self):
+        add_dependency(Site.objects.get_current())
+        tools.assert_equals(set(), stop_collecting_dependencies())
+
+    def test_versions_are_resolved_in_one_round_trip(self):
+        site = Site.objects.get_current()
+        start_collecting_dependencies()
+        with mock.patch.object(utils, 'cache') as cache:
+            add_dependency(site)
+            add_dependency(site)
+            tools.assert_equals(0, cache.get.call_count)
+            cache.get_many.return_value = {get_version_key(site): 3}
+            tools.assert_equals({get_version_key(site): 3}, get_versions(stop_collecting_dependencies()))
+        tools.assert_equals(1, cache.get_many.call_count)
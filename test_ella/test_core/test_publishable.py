@@ -9,11 +9,14 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 
 from ella.core.models import Category, Publishable
+from ella.core.models.publishable import start_batch, finish_batch, update_redirects
+from ella.articles.models import Article
 from ella.core import signals
 from ella.core.management import generate_publish_signals
 from ella.utils import timezone
 
 from nose import tools, SkipTest
+import mock
 
 from test_ella.test_core import create_basic_categories, create_and_place_a_publishable, default_time
 
@@ -48,6 +51,16 @@ class TestPublishableHelpers(PublishableTestCase):
         self.publishable.publish_from = datetime(2008, 1, 9, 23, 50, 0, tzinfo=utc)
         tools.assert_equals('/nested-category/2008/1/10/first-article/', self.publishable.get_absolute_url())
 
+    def test_url_is_kept_on_instance(self):
+        self.publishable.get_absolute_url()
+        with mock.patch('ella.core.models.publishable.fast_reverse', side_effect=AssertionError):
+            tools.assert_equals('/nested-category/2008/1/10/first-article/', self.publishable.get_absolute_url())
+
+    def test_url_changes_with_slug(self):
+        self.publishable.get_absolute_url()
+        self.publishable.slug = 'another-article'
+        tools.assert_equals('/nested-category/2008/1/10/another-article/', self.publishable.get_absolute_url())
+
     def test_domain_url(self):
         tools.assert_equals('http://example.com/nested-category/2008/1/10/first-article/', self.publishable.get_domain_url())
 
@@ -91,6 +104,67 @@ class TestRedirects(PublishableTestCase):
         tools.assert_equals('/nested-category/2008/1/10/old-article-new-slug/', r.new_path)
         tools.assert_equals(self.site_id, r.site_id)
 
+    def test_loaded_instance_isnt_fetched_again_on_save(self):
+        p = Article.objects.get(pk=self.publishable.pk)
+        p.slug = 'old-article-new-slug'
+        with mock.patch.object(Article.objects, 'get', side_effect=AssertionError):
+            p.save()
+        tools.assert_equals('/nested-category/2008/1/10/old-article-new-slug/', Redirect.objects.get().new_path)
+
+    def test_unchanged_url_skips_redirects(self):
+        self.publishable.title = 'Another title'
+        with mock.patch.object(Redirect.objects, 'filter', side_effect=AssertionError):
+            self.publishable.save()
+
+    def test_save_many_collapses_redirects(self):
+        Redirect.objects.create(site_id=self.site_id, new_path='/nested-category/2008/1/10/first-article/', old_path='some-path')
+        def renamed():
+            for slug in ('second-slug', 'third-slug'):
+                self.publishable.slug = slug
+                yield self.publishable
+        Publishable.objects.save_many(renamed())
+
+        tools.assert_equals(
+            set([
+                ('some-path', '/nested-category/2008/1/10/third-slug/'),
+                ('/nested-category/2008/1/10/first-article/', '/nested-category/2008/1/10/third-slug/'),
+                ('/nested-category/2008/1/10/second-slug/', '/nested-category/2008/1/10/third-slug/'),
+            ]),
+            set(Redirect.objects.values_list('old_path', 'new_path'))
+        )
+
+    def test_nested_save_many_is_flushed_by_the_outermost_batch(self):
+        start_batch()
+        try:
+            self.publishable.slug = 'second-slug'
+            Publishable.objects.save_many([self.publishable])
+            tools.assert_equals(0, Redirect.objects.count())
+        finally:
+            finish_batch()
+        tools.assert_equals(
+            [('/nested-category/2008/1/10/first-article/', '/nested-category/2008/1/10/second-slug/')],
+            list(Redirect.objects.values_list('old_path', 'new_path'))
+        )
+
+    def test_update_redirects_collapses_chains_into_bulk_queries(self):
+        Redirect.objects.create(site_id=self.site_id, old_path='/x/', new_path='/a/')
+        Redirect.objects.create(site_id=self.site_id, old_path='/y/', new_path='/b/')
+        with self.assertNumQueries(3):
+            update_redirects([
+                (self.site_id, '/a/', '/b/'),
+                (self.site_id, '/b/', '/c/'),
+                (self.site_id, '/c/', '/d/'),
+            ])
+        tools.assert_equals(
+            set([('/x/', '/d/'), ('/y/', '/d/'), ('/a/', '/d/'), ('/b/', '/d/'), ('/c/', '/d/')]),
+            set(Redirect.objects.values_list('old_path', 'new_path'))
+        )
+
+    def test_renaming_back_does_not_leave_redirect_loop(self):
+        update_redirects([(self.site_id, '/a/', '/b/')])
+        update_redirects([(self.site_id, '/b/', '/a/')])
+        tools.assert_equals([('/b/', '/a/')], list(Redirect.objects.values_list('old_path', 'new_path')))
+
     def test_ability_to_place_back_and_forth(self):
         self.publishable.slug = 'old-article-new-slug'
         self.publishable.save()
@@ -178,6 +252,23 @@ class TestSignals(TestCase):
         tools.assert_equals(1, len(self.unpublish_received))
         tools.assert_equals(self.publishable, self.unpublish_received[0]['publishable'])
 
+    def test_save_many_sends_signals_after_all_are_saved(self):
+        self._signal_clear()
+        create_and_place_a_publishable(self, slug='second-article', published=False)
+        first = Article.objects.get(slug='first-article')
+        second = self.publishable
+        first.published = False
+        second.published = True
+
+        def check_saved(**kwargs):
+            tools.assert_true(Publishable.objects.get(pk=second.pk).published)
+        signals.content_unpublished.connect(check_saved)
+        try:
+            Publishable.objects.save_many([first, second])
+        finally:
+            signals.content_unpublished.disconnect(check_saved)
+        tools.assert_equals([second], [kw['publishable'] for kw in self.publish_received])
+
     def test_generate_doesnt_issue_signal_twice(self):
         self._signal_clear()
         generate_publish_signals()
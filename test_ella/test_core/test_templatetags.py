@@ -1,19 +1,23 @@
 # -*- coding: utf-8 -*-
+from hashlib import md5
 from unittest import TestCase as UnitTestCase
 
 from nose import tools, SkipTest
+import mock
 
 import django
 from django import template
 from django.template import TemplateSyntaxError
 from django.contrib.sites.models import Site
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import get_cache
 from django.core.paginator import Paginator
 from django.test import RequestFactory
 
 from ella.core.templatetags.core import listing_parse, _parse_box, BoxNode, EmptyNode
 from ella.core.templatetags.pagination import _do_paginator
 from ella.core.models import Category
+from ella.core.cache.utils import _get_key, KEY_PREFIX
 from ella.core.managers import ListingHandler
 from ella.articles.models import Article
 from ella.photos.models import Photo
@@ -115,6 +119,31 @@ class TestRenderTag(UnitTestCase):
         t = template.Template('{% render var %}')
         tools.assert_equals('<html> ""', t.render(template.Context({'var': '<html> ""'})))
 
+    def test_compiled_template_is_reused(self):
+        t = template.Template('{% render var %}')
+        t.render(template.Context({'var': '{{ other_var }}', 'other_var': 'YYY'}))
+        node = t.nodelist[0]
+        text = '{{ other_var }}'
+        tools.assert_true(node.get_template(text, md5(text).hexdigest()) is node.get_template(text, md5(text).hexdigest()))
+
+    def test_renders_cached_var(self):
+        t = template.Template('{% render var cached %}')
+        tools.assert_equals('YYY', t.render(template.Context({'var': '{{ other_var }}', 'other_var' : 'YYY'})))
+
+    def test_cache_key_contains_object_version(self):
+        node = template.Template('{% render object.title cached %}').nodelist[0]
+        site = Site.objects.get_current()
+        tools.assert_equals(
+            'ella.render:%s:x' % _get_key(KEY_PREFIX, ContentType.objects.get_for_model(Site), pk=site.pk),
+            node.get_cache_key(template.Context({'object': site}), 'x')
+        )
+
+    def test_var_not_belonging_to_object_is_not_cached(self):
+        t = template.Template('{% render var cached %}')
+        with mock.patch('ella.core.templatetags.core.cache', get_cache('locmem://')):
+            tools.assert_equals('YYY', t.render(template.Context({'var': '{{ other_var }}', 'other_var' : 'YYY'})))
+            tools.assert_equals('ZZZ', t.render(template.Context({'var': '{{ other_var }}', 'other_var' : 'ZZZ'})))
+
 class TestListingTag(TestCase):
     def setUp(self):
         super(TestListingTag, self).setUp()
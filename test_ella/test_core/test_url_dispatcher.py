@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from nose import tools
+
+from ella.core import urls
+from ella.core.url_dispatcher import URLDispatcher, classify
+from ella.core.management.commands.benchmark_url_resolving import PATHS
+
+
+class TestURLDispatcher(TestCase):
+    def setUp(self):
+        super(TestURLDispatcher, self).setUp()
+        self.patterns = [p for p in urls.urlpatterns if not isinstance(p, URLDispatcher)]
+        self.dispatcher = URLDispatcher(self.patterns, urls.res['author'])
+
+    def resolve_one_by_one(self, path):
+        for p in self.patterns:
+            match = p.resolve(path)
+            if match:
+                return match
+
+    def assert_same_match(self, path):
+        expected = self.resolve_one_by_one(path)
+        match = self.dispatcher.resolve(path)
+        if expected is None:
+            tools.assert_equals(None, match)
+        else:
+            tools.assert_equals(
+                (expected.url_name, expected.func, expected.kwargs),
+                (match.url_name, match.func, match.kwargs)
+            )
+
+    def test_dispatcher_is_first_pattern(self):
+        tools.assert_true(isinstance(urls.urlpatterns[0], URLDispatcher))
+
+    def test_same_results_as_patterns(self):
+        for path in PATHS + (
+                'esi/box/1/2/box/',
+                '%s/some-author/' % urls.res['author'],
+                'export/xml/banners/',
+                'export/banners/',
+                '2012/',
+                '2012/10/',
+                '2012/10/4/',
+                'news/2012/10/4/',
+                '123-contact/',
+                '123-contact/custom/action/',
+                'about/123-contact/custom/action/',
+                'feeds/',
+                'feeds/atom/',
+                'news/feeds/atom/',
+                '12/abc/',
+                'news/2012/abc/',
+                'export/not/a/category/',
+            ):
+            self.assert_same_match(path)
+
+    def test_category_detail_tries_just_category_pattern(self):
+        tools.assert_equals(
+            ['category_detail'],
+            [p.name for p in self.dispatcher.get_candidates(classify('news/world/', urls.res['author']))]
+        )
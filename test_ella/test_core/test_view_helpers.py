@@ -3,12 +3,15 @@ from unittest import TestCase as UnitTestCase
 from test_ella.cases import RedisTestCase as TestCase
 
 from nose import tools
+import mock
 
 from django.http import Http404
 from django.db.models import get_models
 from django.contrib.contenttypes.models import ContentType
 from django.template.defaultfilters import slugify
+from django.utils import translation
 
+from ella.core import views
 from ella.core.views import ObjectDetail, get_content_type, ListContentType
 from ella.core.models import Listing, Publishable
 
@@ -39,6 +42,18 @@ class TestGetContentType(UnitTestCase):
     def test_raises_404_on_non_existing_model(self):
         tools.assert_raises(Http404, get_content_type, '')
 
+    def test_unknown_name_doesnt_go_through_models(self):
+        get_content_type('articles')
+        with mock.patch('ella.core.views.models.get_models', side_effect=AssertionError):
+            tools.assert_raises(Http404, get_content_type, 'no-such-things')
+
+    def test_mapping_kept_per_language(self):
+        views.CONTENT_TYPE_MAPPING.clear()
+        get_content_type('articles')
+        with translation.override('cs'):
+            tools.assert_raises(Http404, get_content_type, 'no-such-things')
+        tools.assert_equals(2, len(views.CONTENT_TYPE_MAPPING))
+
 class TestCategoryDetail(ViewHelpersTestCase):
     def setUp(self):
         super(TestCategoryDetail, self).setUp()
@@ -4,7 +4,9 @@ from datetime import datetime
 from test_ella.cases import RedisTestCase as TestCase
 
 from nose import tools, SkipTest
+import mock
 
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.template.defaultfilters import slugify
 from django.template import TemplateDoesNotExist
@@ -308,6 +310,84 @@ class TestObjectDetail(ViewsTestCase):
         self.client.get('/nested-category/%d-first-article/' % orig_publishable.id)
 
 
+class TestConditionalGet(ViewsTestCase):
+    def setUp(self):
+        super(TestConditionalGet, self).setUp()
+        settings.CONDITIONAL_GET = True
+        template_loader.templates['page/object.html'] = 'object'
+        template_loader.templates['page/category.html'] = 'category'
+        self.url = '/nested-category/2008/1/10/first-article/'
+
+    def tearDown(self):
+        del settings.CONDITIONAL_GET
+        super(TestConditionalGet, self).tearDown()
+
+    def test_object_detail_sends_validators(self):
+        response = self.client.get(self.url)
+        tools.assert_equals(200, response.status_code)
+        tools.assert_true(response.has_header('ETag'))
+        tools.assert_true(response.has_header('Last-Modified'))
+
+    def test_matching_etag_returns_not_modified_without_rendering(self):
+        etag = self.client.get(self.url)['ETag']
+        template_loader.templates = {}
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        tools.assert_equals(304, response.status_code)
+        tools.assert_equals('', response.content)
+        tools.assert_equals(etag, response['ETag'])
+
+    def test_etag_of_gzipped_variant_returns_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag[:-1] + '-gzip"')
+        tools.assert_equals(304, response.status_code)
+
+    def test_etag_changes_with_cache_version(self):
+        etag = self.client.get(self.url)['ETag']
+        with mock.patch('ella.core.views.cache') as cache:
+            cache.get.return_value = 42
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        tools.assert_equals(200, response.status_code)
+        tools.assert_not_equals(etag, response['ETag'])
+
+    def test_if_modified_since_returns_not_modified(self):
+        last_modified = self.client.get(self.url)['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        tools.assert_equals(304, response.status_code)
+
+    def test_if_modified_since_before_last_updated_renders_page(self):
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT')
+        tools.assert_equals(200, response.status_code)
+
+    def test_category_etag_changes_with_listed_objects(self):
+        create_and_place_more_publishables(self)
+        list_all_publishables_in_category_by_hour(self)
+        response = self.client.get('/')
+        tools.assert_true(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        tools.assert_equals(304, self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code)
+
+        self.publishables[0].last_updated = timezone.now()
+        self.publishables[0].save()
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        tools.assert_equals(200, response.status_code)
+
+    def test_category_versions_are_fetched_at_once(self):
+        create_and_place_more_publishables(self)
+        list_all_publishables_in_category_by_hour(self)
+        with mock.patch('ella.core.views.cache') as cache:
+            cache.get.side_effect = AssertionError
+            cache.get_many.return_value = {}
+            response = self.client.get('/')
+        tools.assert_equals(200, response.status_code)
+        tools.assert_equals(1, cache.get_many.call_count)
+        tools.assert_equals(len(response.context['listings']) + 1, len(cache.get_many.call_args[0][0]))
+
+    def test_no_validators_when_disabled(self):
+        settings.CONDITIONAL_GET = False
+        response = self.client.get(self.url)
+        tools.assert_false(response.has_header('ETag'))
+
+
 class TestGetTemplates(ViewsTestCase):
     def test_homepage_uses_only_path(self):
         tools.assert_equals(
@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
+import warnings
+
 from PIL import Image
 
+from django.core.cache import get_cache
 from django.core.files.base import ContentFile
+from django.core.management import call_command
 from test_ella.cases import RedisTestCase as TestCase
 from django.contrib.sites.models import Site
 
-from nose import tools
+from nose import tools, SkipTest
 
-from ella.photos.models import Format, FormatedPhoto, redis, REDIS_FORMATTED_PHOTO_KEY
+from ella.photos import models as photos_models
+from ella.photos.models import Format, FormatedPhoto, redis, REDIS_FORMATTED_PHOTO_KEY, REDIS_PHOTO_KEY, \
+    generate_all_formats, FORMATS_VERSION_KEY, FORMAT_CACHE
 from ella.photos.conf import photos_settings
 
 from test_ella.test_photos.fixtures import create_photo_formats, create_photo
@@ -64,6 +70,68 @@ class TestPhoto(TestCase):
         tools.assert_equals((300, 100), i.size)
         p2.image.close()
 
+    def test_smallest_adequate_formated_photo_is_used_as_source(self):
+        for name, size in (('big', 150), ('medium', 100), ('small', 30)):
+            f = Format.objects.create(name=name, max_width=size, max_height=size,
+                flexible_height=False, stretch=False, nocrop=True)
+            FormatedPhoto.objects.create(photo=self.photo, format=f)
+
+        fp = FormatedPhoto(photo=self.photo, format=self.basic_format)
+        image, scale = fp._get_source_image(None, None)
+        tools.assert_equals(0.5, scale)
+        tools.assert_equals((100, 50), image.size)
+        tools.assert_true(fp.photo.image.closed)
+
+    def test_formated_photo_generated_from_smaller_source_has_original_crop_box(self):
+        format = Format.objects.create(name='medium', max_width=100, max_height=100,
+            flexible_height=False, stretch=False, nocrop=True)
+        FormatedPhoto.objects.create(photo=self.photo, format=format)
+
+        fp = FormatedPhoto(photo=self.photo, format=self.basic_format)
+        fp.generate(False)
+        tools.assert_equals((50, 0, 100, 100), (fp.crop_left, fp.crop_top, fp.crop_width, fp.crop_height))
+        tools.assert_equals((20, 20), (fp.width, fp.height))
+
+    def test_cropped_formated_photo_is_not_used_as_source(self):
+        format = Format.objects.create(name='square', max_width=100, max_height=100,
+            flexible_height=False, stretch=False, nocrop=False)
+        FormatedPhoto.objects.create(photo=self.photo, format=format)
+
+        image, scale = FormatedPhoto(photo=self.photo, format=self.basic_format)._get_source_image(None, None)
+        tools.assert_equals(1, scale)
+        tools.assert_equals((200, 100), image.size)
+
+    def test_generate_all_formats_creates_missing_formated_photos(self):
+        FormatedPhoto.objects.get_photo_in_format(self.photo, self.basic_format)
+        medium = Format.objects.create(name='medium', max_width=100, max_height=100,
+            flexible_height=False, stretch=False, nocrop=True)
+        square = Format.objects.create(name='square', max_width=50, max_height=50,
+            flexible_height=False, stretch=False, nocrop=False)
+
+        created = generate_all_formats(self.photo, [self.basic_format, square, medium])
+
+        tools.assert_equals([medium, square], [fp.format for fp in created])
+        tools.assert_equals(3, self.photo.formatedphoto_set.count())
+
+        fp = FormatedPhoto.objects.get(photo=self.photo, format=medium)
+        tools.assert_equals((100, 50), (fp.width, fp.height))
+        tools.assert_equals((0, 0, 0, 0), (fp.crop_left, fp.crop_top, fp.crop_width, fp.crop_height))
+        fp.image.open()
+        tools.assert_equals((100, 50), Image.open(fp.image).size)
+
+        fp = FormatedPhoto.objects.get(photo=self.photo, format=square)
+        tools.assert_equals((50, 50), (fp.width, fp.height))
+        tools.assert_equals((50, 0, 100, 100), (fp.crop_left, fp.crop_top, fp.crop_width, fp.crop_height))
+
+    def test_generate_all_formats_handles_master_formats(self):
+        slave_format = Format.objects.create(name='slave', max_width=10, max_height=10,
+            flexible_height=False, stretch=False, nocrop=False, master=self.basic_format)
+
+        created = generate_all_formats(self.photo, [slave_format, self.basic_format], threads=1)
+
+        tools.assert_equals([self.basic_format, slave_format], [fp.format for fp in created])
+        tools.assert_equals((10, 10), (created[1].width, created[1].height))
+
     def test_formatted_photo_has_zero_crop_box_if_smaller_than_format(self):
         format = Format.objects.create(
             name='sample',
@@ -99,6 +167,64 @@ class TestPhoto(TestCase):
             tools.assert_equals(expected['width'], actual['width'])
             tools.assert_equals(expected['height'], actual['height'])
 
+    def test_redis_is_populated_on_miss_and_hit_is_counted(self):
+        if not redis:
+            raise SkipTest()
+        fp = FormatedPhoto.objects.create(photo=self.photo, format=self.basic_format)
+        redis.flushdb()
+        stats = FormatedPhoto.objects.redis_stats.copy()
+
+        expected = FormatedPhoto.objects.get_photo_in_format(self.photo.pk, self.basic_format)
+        tools.assert_equals(fp.url, expected['url'])
+        tools.assert_equals(stats['misses'] + 1, FormatedPhoto.objects.redis_stats['misses'])
+        tools.assert_equals(self.photo.image.url, redis.hgetall(REDIS_PHOTO_KEY % self.photo.pk)['url'])
+
+        with self.assertNumQueries(0):
+            formatted = FormatedPhoto.objects.get_photo_in_format(self.photo.pk, self.basic_format)
+        tools.assert_equals(fp.url, formatted['url'])
+        tools.assert_equals(self.photo.image.url, formatted['original']['url'])
+        tools.assert_equals(stats['hits'] + 1, FormatedPhoto.objects.redis_stats['hits'])
+
+    def test_photos_in_format_are_retrieved_at_once(self):
+        fp = FormatedPhoto.objects.create(photo=self.photo, format=self.basic_format)
+        if redis:
+            redis.flushdb()
+
+        with self.assertNumQueries(1):
+            formatted = FormatedPhoto.objects.get_photos_in_format([self.photo], self.basic_format)
+        tools.assert_equals([self.photo.pk], formatted.keys())
+        tools.assert_equals(fp.url, formatted[self.photo.pk]['url'])
+        tools.assert_equals(self.photo.image.url, formatted[self.photo.pk]['original']['url'])
+
+        if redis:
+            with self.assertNumQueries(0):
+                formatted = FormatedPhoto.objects.get_photos_in_format([self.photo.pk], self.basic_format, False)
+            tools.assert_equals(fp.url, formatted[self.photo.pk]['url'])
+            tools.assert_false('original' in formatted[self.photo.pk])
+
+    def test_photos_in_format_include_blank_image_for_missing_photo(self):
+        formatted = FormatedPhoto.objects.get_photos_in_format([self.photo.pk + 1], self.basic_format)
+        tools.assert_equals(self.basic_format.get_blank_img(), formatted[self.photo.pk + 1])
+
+    def test_redis_ttl_is_set(self):
+        if not redis:
+            raise SkipTest()
+        photos_settings.REDIS_TTL = 100
+        try:
+            FormatedPhoto.objects.get_photo_in_format(self.photo, self.basic_format)
+        finally:
+            photos_settings.REDIS_TTL = None
+        tools.assert_true(0 < redis.ttl(REDIS_FORMATTED_PHOTO_KEY % (self.photo.id, self.basic_format.id)) <= 100)
+
+    def test_warm_photos_redis_command_stores_all_photos(self):
+        if not redis:
+            raise SkipTest()
+        fp = FormatedPhoto.objects.create(photo=self.photo, format=self.basic_format)
+        redis.flushdb()
+        call_command('warm_photos_redis', verbosity=0, batch_size=1)
+        tools.assert_equals(self.photo.image.url, redis.hgetall(REDIS_PHOTO_KEY % self.photo.pk)['url'])
+        tools.assert_equals(fp.url, redis.hgetall(REDIS_FORMATTED_PHOTO_KEY % (self.photo.pk, self.basic_format.pk))['url'])
+
     def test_formattedphoto_cleared_when_image_changed(self):
         FormatedPhoto.objects.get_photo_in_format(self.photo, self.basic_format)
         tools.assert_equals(1, len(self.photo.formatedphoto_set.all()))
@@ -121,3 +247,103 @@ class TestPhoto(TestCase):
 
     def test_retrieving_ratio(self):
         tools.assert_equals(2, self.photo.ratio())
+
+
+class TestCheckPhotoFilesConsistence(TestCase):
+    def setUp(self):
+        super(TestCheckPhotoFilesConsistence, self).setUp()
+        from ella.photos.management.commands import check_photo_files_consistence
+        self.module = check_photo_files_consistence
+        self.command = check_photo_files_consistence.Command()
+        self.command.verbosity = 0
+        self.command.counts = {'disk': 0, 'db': 0}
+
+    def test_sorted_on_disk_merges_runs(self):
+        items = [u'photos/c.jpg', u'photos/a.jpg', u'photos/ž.jpg', u'photos/b.jpg', u'photos/a.jpg']
+        tools.assert_equals(
+            [u'photos/a.jpg', u'photos/b.jpg', u'photos/c.jpg', u'photos/ž.jpg'],
+            list(self.module.unique(self.module.sorted_on_disk(items, 2)))
+        )
+
+    def test_compare_returns_files_only_on_disk(self):
+        disk = iter([u'photos/a.jpg', u'photos/b.jpg', u'photos/d.jpg'])
+        db = iter([u'photos/b.jpg', u'photos/c.jpg'])
+        to_delete = self.command.compare(disk, db)
+        tools.assert_equals(['photos/a.jpg\n', 'photos/d.jpg\n'], list(to_delete))
+        tools.assert_equals({'disk': 3, 'db': 2}, self.command.counts)
+
+    def test_db_files_include_formated_photos(self):
+        create_photo_formats(self)
+        photo = create_photo(self)
+        fp = FormatedPhoto.objects.create(photo=photo, format=self.basic_format)
+        try:
+            self.command.chunk_size = 1
+            tools.assert_equals(
+                sorted([photo.image.name, fp.image.name]),
+                sorted(self.command.list_db_files())
+            )
+        finally:
+            photo.delete()
+
+
+class TestFormatRegistry(TestCase):
+    def setUp(self):
+        super(TestFormatRegistry, self).setUp()
+        # shared by the processes
+        self.old_cache = photos_models.cache
+        self.cache = photos_models.cache = get_cache('locmem://')
+        self.cache.clear()
+        self.old_interval = photos_settings.FORMAT_VERSION_CHECK_INTERVAL
+        photos_settings.FORMAT_VERSION_CHECK_INTERVAL = 0
+        Format.objects.clear_cache()
+        create_photo_formats(self)
+        self.other_site = Site.objects.create(domain='other.example.com', name='other')
+        self.other_format = Format.objects.create(name='basic', max_width=50, max_height=50, stretch=False, nocrop=False, flexible_height=False)
+        self.other_format.sites.add(self.other_site)
+
+    def tearDown(self):
+        Format.objects.clear_cache()
+        photos_models.cache = self.old_cache
+        photos_settings.FORMAT_VERSION_CHECK_INTERVAL = self.old_interval
+        super(TestFormatRegistry, self).tearDown()
+
+    def test_format_is_looked_up_for_current_site(self):
+        tools.assert_equals(self.basic_format, Format.objects.get_for_name('basic'))
+        tools.assert_equals(self.other_format, Format.objects.get_for_site(self.other_site.pk)['basic'])
+
+    def test_all_formats_of_site_are_loaded_in_one_query(self):
+        Format.objects.get_for_name('basic')
+        self.assertNumQueries(0, lambda: Format.objects.get_for_name('basic'))
+        tools.assert_raises(Format.DoesNotExist, lambda: self.assertNumQueries(0, lambda: Format.objects.get_for_name('unknown')))
+
+    def test_format_change_is_picked_up(self):
+        Format.objects.get_for_name('basic')
+        self.basic_format.max_width = 30
+        self.basic_format.save()
+        tools.assert_equals(30, Format.objects.get_for_name('basic').max_width)
+
+    def test_removal_from_site_is_picked_up(self):
+        Format.objects.get_for_name('basic')
+        self.basic_format.sites.clear()
+        tools.assert_raises(Format.DoesNotExist, Format.objects.get_for_name, 'basic')
+
+    def test_formats_are_reloaded_when_version_changes(self):
+        Format.objects.get_for_name('basic')
+        # another process saved the format, only the shared version tells
+        Format.objects.filter(pk=self.basic_format.pk).update(max_width=70)
+        self.cache.set(FORMATS_VERSION_KEY, 'other-version')
+        tools.assert_equals(70, Format.objects.get_for_name('basic').max_width)
+
+    def test_version_is_not_checked_within_interval(self):
+        photos_settings.FORMAT_VERSION_CHECK_INTERVAL = 3600
+        Format.objects.get_for_name('basic')
+        Format.objects.filter(pk=self.basic_format.pk).update(max_width=70)
+        self.cache.set(FORMATS_VERSION_KEY, 'other-version')
+        tools.assert_equals(20, Format.objects.get_for_name('basic').max_width)
+
+    def test_deprecated_format_cache_reads_registry(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            tools.assert_equals(self.basic_format, FORMAT_CACHE['basic'])
+            tools.assert_true('unknown' not in FORMAT_CACHE)
+        tools.assert_true(all(issubclass(w.category, DeprecationWarning) for w in caught))
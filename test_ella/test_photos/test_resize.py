@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from unittest import TestCase
 from os import path
+from cStringIO import StringIO
 
 from nose import tools
 
@@ -8,6 +9,7 @@ from PIL import Image
 
 from ella.photos.models import Format
 from ella.photos.formatter import Formatter
+from ella.photos.conf import photos_settings
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -161,6 +163,64 @@ class TestPhotoResize(TestCase):
         tools.assert_equals((100, 100), i.size)
         tools.assert_equals(BLACK, i.getpixel((0,0)))
 
+class TestPhotoResizeWithDraft(TestCase):
+
+    def setUp(self):
+        super(TestPhotoResizeWithDraft, self).setUp()
+        self.format = Format(max_height=100, max_width=100)
+
+    def tearDown(self):
+        super(TestPhotoResizeWithDraft, self).tearDown()
+        photos_settings.DRAFT_OVERSAMPLING = 2
+
+    def get_jpeg(self, size, color=RED):
+        f = StringIO()
+        Image.new('RGB', size, color).save(f, format='jpeg')
+        f.seek(0)
+        return Image.open(f)
+
+    def test_big_jpeg_is_decoded_in_reduced_size(self):
+        f = Formatter(self.get_jpeg((1600, 800)), self.format)
+
+        i, crop_box = f.format()
+        tools.assert_equals(0.25, f.scale)
+        tools.assert_equals((400, 0, 1200, 800), crop_box)
+        tools.assert_equals((100, 100), i.size)
+
+    def test_custom_crop_box_is_scaled_and_returned_intact(self):
+        i = self.get_jpeg((1600, 800))
+        f = Formatter(i, self.format, crop_box=(10, 10, 810, 810))
+
+        i, crop_box = f.format()
+        tools.assert_equals(0.25, f.scale)
+        tools.assert_equals((10, 10, 810, 810), crop_box)
+        tools.assert_equals((100, 100), i.size)
+
+    def test_jpeg_not_much_bigger_than_format_is_decoded_whole(self):
+        f = Formatter(self.get_jpeg((400, 200)), self.format)
+
+        i, crop_box = f.format()
+        tools.assert_equals(1, f.scale)
+        tools.assert_equals((100, 0, 300, 200), crop_box)
+        tools.assert_equals((100, 100), i.size)
+
+    def test_draft_can_be_disabled(self):
+        photos_settings.DRAFT_OVERSAMPLING = None
+        f = Formatter(self.get_jpeg((1600, 800)), self.format)
+
+        i, crop_box = f.format()
+        tools.assert_equals(1, f.scale)
+        tools.assert_equals((400, 0, 1200, 800), crop_box)
+        tools.assert_equals((100, 100), i.size)
+
+    def test_prescaled_image_returns_crop_box_of_the_original(self):
+        i = Image.new('RGB', (400, 200), BLACK)
+        f = Formatter(i, self.format, scale=0.5)
+
+        i, crop_box = f.format()
+        tools.assert_equals((200, 0, 600, 400), crop_box)
+        tools.assert_equals((100, 100), i.size)
+
 class TestPhotoResizeWithRotate(TestCase):
 
     def setUp(self):
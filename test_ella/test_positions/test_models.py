@@ -3,14 +3,18 @@ from datetime import datetime, timedelta
 from test_ella.cases import RedisTestCase as TestCase
 
 from nose import tools
+import mock
 
 from django.template import Context, NodeList
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Max
 from django.core.exceptions import ValidationError
+from django.core.cache import get_cache
 
 from test_ella.test_core import create_basic_categories
 
+from ella.core.conf import core_settings
+from ella.utils.test_helpers import create_category
 from ella.positions.models import Position
 from ella.utils.timezone import now, utc_localize
 
@@ -53,6 +57,24 @@ class TestPosition(TestCase):
         p = Position.objects.create(category=self.category, name='position-name', text='some text')
         tools.assert_equals('some text', p.render(Context({}), NodeList(), ''))
 
+    def test_compiled_text_is_reused_until_text_changes(self):
+        p = Position.objects.create(category=self.category, name='position-name', text='some text')
+        t = p.get_template()
+        tools.assert_true(t is Position.objects.get(pk=p.pk).get_template())
+        p.text = 'other text'
+        tools.assert_equals('other text', p.render(Context({}), NodeList(), ''))
+
+    def test_text_is_appended_to_box_params_without_parsing(self):
+        p = Position(category=self.category, name='position-name', text='param: value\n{{ object }}')
+        nodelist = p._prepend_text('template_name: x\n', p.get_template().nodelist)
+        tools.assert_equals('template_name: x\nparam: value\n', nodelist[0].s)
+        tools.assert_equals(2, len(nodelist))
+        tools.assert_true(nodelist.contains_nontext)
+
+        nodelist = p._prepend_text('\n', Position(text='param: value').get_template().nodelist)
+        tools.assert_equals(1, len(nodelist))
+        tools.assert_false(nodelist.contains_nontext)
+
     def test_render_position_with_invalid_target_returns_empty(self):
         target_ct = ContentType.objects.get_for_model(ContentType)
         invalid_id = ContentType.objects.aggregate(Max('id'))['id__max'] + 1
@@ -125,6 +147,42 @@ class TestPosition(TestCase):
         p = Position.objects.create(category=self.category, name='position-name', text='some text', disabled=True)
         tools.assert_false(Position.objects.get_active_position(self.category, 'position-name'))
 
+    def test_nearest_position_wins(self):
+        Position.objects.create(category=self.category, name='position-name', text='some text')
+        p = Position.objects.create(category=self.category_nested, name='position-name', text='nested text')
+        tools.assert_equals({'position-name': p}, Position.objects.get_positions_for_category(self.category_nested))
+
+    def test_positions_are_cached_until_next_deactivation(self):
+        Position.objects.create(category=self.category, name='position-name', text='some text', active_till=now() + timedelta(seconds=100))
+        positions, timeout = Position.objects._resolve_positions(self.category_nested)
+        tools.assert_equals(['position-name'], positions.keys())
+        tools.assert_true(98 <= timeout <= 100)
+
+    def test_positions_are_cached_until_next_activation(self):
+        Position.objects.create(category=self.category_nested, name='position-name', text='some text', active_from=now() + timedelta(seconds=50))
+        Position.objects.create(category=self.category, name='position-name', text='some text', active_till=now() + timedelta(seconds=100))
+        positions, timeout = Position.objects._resolve_positions(self.category_nested)
+        tools.assert_equals(self.category.pk, positions['position-name'].category_id)
+        tools.assert_true(48 <= timeout <= 50)
+
+    def test_positions_without_boundaries_are_cached_long(self):
+        Position.objects.create(category=self.category, name='position-name', text='some text')
+        tools.assert_equals(core_settings.CACHE_TIMEOUT_LONG, Position.objects._resolve_positions(self.category)[1])
+
+    def test_moved_category_inherits_positions_of_new_parent(self):
+        other = create_category(u'other', tree_parent=self.category)
+        child = create_category(u'child', tree_parent=self.category_nested)
+        nested = Position.objects.create(category=self.category_nested, name='position-name', text='nested text')
+        p = Position.objects.create(category=other, name='position-name', text='other text')
+
+        cache = get_cache('locmem://')
+        cache.clear()
+        with mock.patch('ella.positions.models.cache', cache):
+            tools.assert_equals(nested, Position.objects.get_active_position(child, 'position-name'))
+            child.tree_parent = other
+            child.save()
+            tools.assert_equals(p, Position.objects.get_active_position(child, 'position-name'))
+
     def test_position_with_broken_definition_dont_raise_big_500(self):
         p = Position.objects.create(category=self.category, name='position-name', text='{% load nonexistent_tags %}', disabled=False)
         tools.assert_equals('', p.render(Context({}), NodeList(), ''))
@@ -8,6 +8,7 @@ from django.template import Context
 
 
 from test_ella.test_core import create_basic_categories
+from test_ella import template_loader
 
 from ella.core.models import Category
 from ella.positions.models import Position
@@ -113,3 +114,27 @@ class TestPositionParsing(TestCase):
     def test_raising_exception_ifposition_templatetag_render_with_bad_category_tree_path(self):
         t = template.Template('{% load positions %}{% ifposition position-name for "nested-categoryy" %}IN{% else %}OUT{% endifposition %}')
         tools.assert_raises(Category.DoesNotExist, t.render, self.context)
+
+    def test_positions_of_a_page_are_resolved_in_one_query(self):
+        Position.objects.create(category=self.category, name='other-name', text='other')
+        t = template.Template('{% load positions %}{% position position-name for category %}{% endposition %}'
+            '{% position other-name for category %}{% endposition %}'
+            '{% ifposition missing for category %}IN{% else %}OUT{% endifposition %}')
+        # load the category chain
+        self.category_nested.tree_parent
+        with self.assertNumQueries(1):
+            tools.assert_equals('other textotherOUT', t.render(self.context_for_category_nested))
+
+    def test_resolved_positions_are_shared_with_included_templates(self):
+        template_loader.templates['inc.html'] = '{% load positions %}{% position position-name for category %}{% endposition %}'
+        self.addCleanup(template_loader.templates.pop, 'inc.html')
+        t = template.Template('{% load positions %}{% position position-name for category %}{% endposition %}{% include "inc.html" %}')
+        self.category_nested.tree_parent
+        with self.assertNumQueries(1):
+            tools.assert_equals('other textother text', t.render(self.context_for_category_nested))
+
+    def test_resolved_positions_do_not_leak_into_callers_dict(self):
+        data = {'category': self.category_nested}
+        t = template.Template('{% load positions %}{% position position-name for category %}{% endposition %}')
+        t.render(Context(data))
+        tools.assert_equals(['category'], data.keys())
@@ -0,0 +1,22 @@
+from unittest import TestCase
+
+from nose import tools
+from ella.utils.lru import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_returns_stored_value(self):
+        c = LRUCache(2)
+        c['a'] = 1
+        tools.assert_equals(1, c.get('a'))
+        tools.assert_equals(None, c.get('b'))
+
+    def test_least_recently_used_item_is_dropped(self):
+        c = LRUCache(2)
+        c['a'] = 1
+        c['b'] = 2
+        c.get('a')
+        c['c'] = 3
+        tools.assert_equals(2, len(c))
+        tools.assert_true('a' in c)
+        tools.assert_false('b' in c)
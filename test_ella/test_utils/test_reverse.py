@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+import mock
+from nose import tools
+
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.utils import translation
+
+from ella.utils import reverse as fast
+from ella.utils.reverse import fast_reverse
+
+
+class TestFastReverse(TestCase):
+    def setUp(self):
+        super(TestFastReverse, self).setUp()
+        fast.clear_cache()
+
+    def tearDown(self):
+        super(TestFastReverse, self).tearDown()
+        fast.clear_cache()
+
+    def test_object_detail_matches_reverse(self):
+        kwargs = {'category': 'nested/category', 'year': 2008, 'month': 1, 'day': 10, 'slug': 'some-slug'}
+        tools.assert_equals(reverse('object_detail', kwargs=kwargs), fast_reverse('object_detail', **kwargs))
+
+    def test_static_detail_matches_reverse(self):
+        kwargs = {'id': 42, 'slug': 'some-slug'}
+        tools.assert_equals(reverse('home_static_detail', kwargs=kwargs), fast_reverse('home_static_detail', **kwargs))
+
+    def test_resolver_used_only_once(self):
+        fast_reverse('home_object_detail', year=2008, month=1, day=10, slug='a')
+        with mock.patch.object(fast, 'reverse', side_effect=AssertionError):
+            tools.assert_equals('/2009/2/3/b/', fast_reverse('home_object_detail', year=2009, month=2, day=3, slug='b'))
+
+    def test_unknown_arguments_use_reverse(self):
+        tools.assert_equals(
+            reverse('named_export', kwargs={'name': 'banners'}),
+            fast_reverse('named_export', name='banners')
+        )
+
+    def test_templates_are_kept_per_language(self):
+        fast_reverse('home_object_detail', year=2008, month=1, day=10, slug='a')
+        with mock.patch.object(fast, '_build_template', wraps=fast._build_template) as build:
+            with translation.override('cs'):
+                fast_reverse('home_object_detail', year=2008, month=1, day=10, slug='a')
+        tools.assert_equals(1, build.call_count)
+
+    def test_arguments_not_matching_the_pattern_are_rejected(self):
+        fast_reverse('home_object_detail', year=2008, month=1, day=10, slug='a')
+        tools.assert_raises(NoReverseMatch, fast_reverse, 'home_object_detail', year=2008, month=1, day=10, slug='a/b')
+        tools.assert_raises(NoReverseMatch, fast_reverse, 'home_object_detail', year='20x8', month=1, day=10, slug='a')